@@ -2,6 +2,7 @@
 #define FORSCAPE_SETTINGS_DIFF_DIALOG_H
 
 #include <QDialog>
+#include <bitset>
 #include "forscape_settings_diff_dialog_codegen.h"
 
 namespace Ui {
@@ -16,6 +17,7 @@ namespace Forscape {
 
 struct Settings;
 struct SettingsDiff;
+struct SettingsDiffEdit;
 
 class SettingsDiffDialog : public QDialog {
     Q_OBJECT
@@ -23,6 +25,9 @@ class SettingsDiffDialog : public QDialog {
 public:
     static int exec(const Settings& inherited, SettingsDiff& diff);
 
+    /// Edit the diff, reporting the edits which transform its previous serialisation into its new serialisation
+    static int exec(const Settings& inherited, SettingsDiff& diff, std::vector<SettingsDiffEdit>& edits);
+
     static SettingsDiffDialog& getDialog();
 
 private:
@@ -34,23 +39,69 @@ private:
     void updateInherited(const Settings& inherited);
     void updateDiff(const SettingsDiff& diff);
 
+    /// Record the option a setting inherits, refreshing the row only if the option changed
+    void setInherited(size_t setting, int option);
+
+    /// Create the widgets of a row from its recorded state
+    void buildRow(size_t setting);
+
+    /// Build a batch of the rows which are not built yet, scheduling the next batch until every row is built
+    void buildPendingRows();
+
+    void applyPalette(size_t setting);
+    void applyInherited(size_t setting);
+    void applyStyle(size_t setting);
+
+    /// Insert a built row into the overridden or inherited section, in order of setting
+    void placeRow(size_t setting);
+
+    /// Remove a row from its section, keeping its widgets
+    void unplaceRow(size_t setting);
+
+    /// Restyle the row of a setting whose choice changed, moving it if it changed section
+    void updateChosenSetting(size_t setting, int index);
+
 private slots:
-    void updateChosenSetting();
     void updateFilters();
 
 private:
     Ui::SettingsDiffDialog* ui;
 
+    /// The option of a row which is not yet known
+    static constexpr int UNKNOWN_OPTION = -1;
+
     struct RowInfo {
-        QLabel* label;
-        QComboBox* box;
-        std::vector<uint8_t> categories;
+        QLabel* label = nullptr;  ///< Null until the row is built
+        QComboBox* box = nullptr;  ///< Null until the row is built
+        int inherited = UNKNOWN_OPTION;  ///< Local index of the inherited option
+        int chosen = 0;  ///< Index of the chosen combo box item, where 0 is to inherit
     };
     std::array<RowInfo, FORSCAPE_NUM_SETTINGS> rows;
+
+    /// A set of rows, with a bit per setting
+    typedef std::bitset<FORSCAPE_NUM_SETTINGS> RowSet;
     #undef FORSCAPE_NUM_SETTINGS
 
+    /// The rows placed in the overridden and inherited sections
+    RowSet overridden_rows;
+    RowSet inherited_rows;
+
+    /// The rows which pass the search term and category filters, whether built or not
+    RowSet visible_rows = RowSet().set();
+
+    /// Find the rows containing each word of the search term within a word of their title or descriptions
+    static RowSet searchRows(const QString& search_term);
+
     std::array<QCheckBox*, FORSCAPE_NUM_SETTING_FILTERS> filters;
     #undef FORSCAPE_NUM_SETTING_FILTERS
+
+    /// The palette revision last applied to the built rows
+    uint32_t palette_revision = 0;
+
+    /// Rows before this index are built
+    size_t next_unbuilt = 0;
+
+    bool build_scheduled = false;
 };
 
 }  // namespace Forscape
@@ -0,0 +1,179 @@
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+import codegen
+from codegen_model import SettingsModel, get_definition
+import codegen_ui
+import generate
+from synthetic_definition import synthetic_definition
+
+
+META_DIR = Path(__file__).resolve().parent
+STAGES = ["JSON load", "model build", "hash search", "C++ emission", ".ui emission", "file writes",
+          "file writes (unchanged)"]
+
+
+class StageProfiler:
+    """
+    Accumulates the exclusive time of each stage, where time spent in a nested stage is not charged to the stage
+    which called it. When tracing memory, also records the peak traced allocation while each stage was active.
+    """
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.seconds = defaultdict(float)
+        self.peak_bytes = defaultdict(int)
+        self.stack = []
+
+    def record_peak(self, name):
+        self.peak_bytes[name] = max(self.peak_bytes[name], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory and self.stack:
+            self.record_peak(self.stack[-1][0])
+        frame = [name, 0.0]
+        self.stack.append(frame)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.stack.pop()
+            self.seconds[name] += elapsed - frame[1]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+            if self.trace_memory:
+                self.record_peak(name)
+
+    def wrap(self, name, function):
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+@contextmanager
+def patched(module, attribute, replacement):
+    original = getattr(module, attribute)
+    setattr(module, attribute, replacement)
+    try:
+        yield
+    finally:
+        setattr(module, attribute, original)
+
+
+def run_generators(definition_path, output_root, profiler):
+    """Run every emitter in this process, charging the work to the benchmark stages"""
+    with patched(codegen, "build_perfect_hash", profiler.wrap("hash search", codegen.build_perfect_hash)), \
+         patched(codegen_ui, "write_form", profiler.wrap(".ui emission", codegen_ui.write_form)):
+        with profiler.stage("JSON load"):
+            settings_def = get_definition(definition_path)
+
+        with profiler.stage("model build"):
+            model = SettingsModel(settings_def)
+            model.check()
+
+        with profiler.stage("C++ emission"):
+            files = generate.run_emitters(model, output_root, jobs=1)
+
+        with profiler.stage("file writes"):
+            files.write()
+
+        with profiler.stage("file writes (unchanged)"):
+            files.write()
+
+
+def time_parallel_emission(definition_path, jobs):
+    """Time the emitters running concurrently in a process pool, including the pool startup"""
+    model = SettingsModel(get_definition(definition_path))
+    with tempfile.TemporaryDirectory() as output_root:
+        start = perf_counter()
+        generate.run_emitters(model, Path(output_root), jobs)
+        return perf_counter() - start
+
+
+def benchmark(definition_path, repeat, jobs):
+    """Time the generators as the minimum over several runs, then measure peak memory on a separate traced run"""
+    best_seconds = {stage: float("inf") for stage in STAGES}
+    for _ in range(repeat):
+        profiler = StageProfiler(trace_memory=False)
+        with tempfile.TemporaryDirectory() as output_root:
+            run_generators(definition_path, Path(output_root), profiler)
+        for stage in STAGES:
+            best_seconds[stage] = min(best_seconds[stage], profiler.seconds[stage])
+
+    parallel_seconds = min(time_parallel_emission(definition_path, jobs) for _ in range(repeat))
+
+    profiler = StageProfiler(trace_memory=True)
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as output_root:
+            run_generators(definition_path, Path(output_root), profiler)
+    finally:
+        tracemalloc.stop()
+
+    return best_seconds, profiler.peak_bytes, parallel_seconds
+
+
+def print_report(title, seconds, peak_bytes, parallel_seconds, jobs):
+    print(title)
+    print(f"    {'stage':<26}{'time (ms)':>12}{'peak (MiB)':>12}")
+    for stage in STAGES:
+        print(f"    {stage:<26}{1000 * seconds[stage]:>12.2f}{peak_bytes[stage] / 2**20:>12.2f}")
+    print(f"    {'total':<26}{1000 * sum(seconds.values()):>12.2f}{max(peak_bytes.values()) / 2**20:>12.2f}")
+    serial_seconds = seconds["hash search"] + seconds["C++ emission"] + seconds[".ui emission"]
+    print(f"    emission with {jobs} jobs: {1000 * parallel_seconds:.2f} ms (serial {1000 * serial_seconds:.2f} ms)")
+    print()
+
+
+def parse_size(size):
+    num_settings, num_options = size.split(":")
+    return int(num_settings), int(num_options)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time each stage of the settings code generators, on the real definition and synthetic ones")
+    parser.add_argument("--size", action="append", type=parse_size, metavar="SETTINGS:OPTIONS",
+                        help="size of a synthetic definition to benchmark, may be repeated (default 100:400, 500:2000)")
+    parser.add_argument("--options-per-setting", type=int, default=4, help="number of options of each setting")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs of which the fastest is reported")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes when timing parallel emission (default: number of CPUs)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    seconds, peak_bytes, parallel_seconds = benchmark(META_DIR / "settings_definition.json", args.repeat, args.jobs)
+    print_report("settings_definition.json", seconds, peak_bytes, parallel_seconds, args.jobs)
+    results.append({"definition": "settings_definition.json", "seconds": seconds, "peak_bytes": peak_bytes,
+                    "parallel_seconds": parallel_seconds})
+
+    with tempfile.TemporaryDirectory() as definition_dir:
+        for num_settings, num_options in args.size or [(100, 400), (500, 2000)]:
+            definition_path = Path(definition_dir) / f"synthetic_{num_settings}_{num_options}.json"
+            with open(definition_path, "w", encoding="utf-8") as settings_def_file:
+                json.dump(synthetic_definition(num_settings, num_options, args.options_per_setting), settings_def_file)
+
+            seconds, peak_bytes, parallel_seconds = benchmark(definition_path, args.repeat, args.jobs)
+            title = f"synthetic: {num_settings} settings, {num_options} options"
+            print_report(title, seconds, peak_bytes, parallel_seconds, args.jobs)
+            results.append({"definition": title, "seconds": seconds, "peak_bytes": peak_bytes,
+                            "parallel_seconds": parallel_seconds})
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as results_file:
+            json.dump(results, results_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,8 @@
-from collections import OrderedDict
-from ctypes import c_uint8
-import json
+from codegen_output import GeneratedFiles
+from codegen_writer import CodeWriter, cpp_file, cpp_string
 from math import ceil, log2
-import os
 from pathlib import Path
 import re
-
-
-def get_definition():
-    with open('settings_definition.json', encoding='utf-8') as settings_def_file:
-        settings_def = json.load(settings_def_file)
-        return settings_def
     
 
 def varupper(val):
@@ -21,507 +13,2257 @@ def vartitle(val):
     return re.sub(r'\W+', '', val.title())
 
 
-def hash(word, a):
-    hash = c_uint8(len(word))
-    for char in word:
-        hash.value ^= c_uint8(ord(char)).value
-        hash.value *= a
+FNV_OFFSET_BASIS = 2166136261
+FNV_PRIME = 16777619
+KEYS_PER_BUCKET = 4
+MAX_BUCKET_SEED = 1 << 20
+MAX_HASH_SEED = 1 << 8
+
+
+def fnv1a(word):
+    hash = FNV_OFFSET_BASIS
+    for byte in word.encode('utf-8'):
+        hash ^= byte
+        hash = (hash * FNV_PRIME) & 0xFFFFFFFF
+
+    return hash
+
+
+def hash(word, seed=0):
+    """
+    Base hash of the perfect hash, which consumes 4 little-endian bytes per step and then any trailing bytes singly.
+    The seed perturbs the initial state, so keys which collide for one seed are unlikely to collide for another.
+    Must match SettingsDiffScan::hash in the generated code.
+    """
+    data = word.encode('utf-8')
+    hash = FNV_OFFSET_BASIS ^ seed
+    num_words = len(data) // 4
+    for i in range(num_words):
+        hash ^= int.from_bytes(data[4*i:4*i+4], "little")
+        hash = (hash * FNV_PRIME) & 0xFFFFFFFF
+        hash ^= hash >> 15
+    for byte in data[4*num_words:]:
+        hash ^= byte
+        hash = (hash * FNV_PRIME) & 0xFFFFFFFF
+        hash ^= hash >> 15
+
+    return hash
+
 
+def mix(hash):
+    hash ^= hash >> 16
+    hash = (hash * 0x85EBCA6B) & 0xFFFFFFFF
+    hash ^= hash >> 13
+    hash = (hash * 0xC2B2AE35) & 0xFFFFFFFF
+    hash ^= hash >> 16
     return hash
 
 
-def hash_str(a):
-    return (
-        "uint8_t hash(std::string_view str) noexcept {\n"
-        "    uint8_t hash = str.size();\n"
-        "    for(char ch : str){\n"
-        "        hash ^= static_cast<uint8_t>(ch);\n"
-        f"        hash *= {a};\n"
-        "    }\n"
-        "    \n"
-        "    return hash;\n"
-        "}\n"
-    )
+def lookup_str(hash_seed, bucket_seeds, slots, pairs, setting_typedef, options_typedef):
+    """The perfect hash of setting=option pairs, which is constexpr so that diff literals are parsed at compile time"""
+    num_buckets = len(bucket_seeds)
+    num_keys = len(slots)
+    src = CodeWriter()
+    src.line("/// Primitives for tokenising serialised diffs. The byte-at-a-time versions are constexpr references.")
+    with src.block("struct SettingsDiffScan {", "};"):
+        src.lines([
+            "/// The index of the first ',' at or after start, or the size if there is none.",
+            "/// Compares 16 bytes per step with SSE2 or NEON where available, and 8 bytes per step otherwise.",
+            "static size_t findDelimiter(std::string_view str, size_t start) noexcept;",
+            "",
+        ])
+        with src.block("static constexpr size_t findDelimiterBytewise(std::string_view str, size_t start) noexcept {"):
+            src.line("while(start < str.size() && str[start] != ',') start++;")
+            src.line("return start;")
+        src.lines([
+            "",
+            "/// Hash consuming 4 bytes per step, which is the basis of the perfect hash.",
+            "/// The bytes are combined explicitly so the result is constexpr and independent of endianness;",
+            "/// optimising compilers fuse them into a single load.",
+        ])
+        with src.block("static constexpr uint32_t hash(std::string_view str, uint32_t seed = 0) noexcept {"):
+            src.line(f"uint32_t hash = {FNV_OFFSET_BASIS}u ^ seed;")
+            src.line("size_t i = 0;")
+            with src.block("for(; i + 4 <= str.size(); i += 4){"):
+                src.lines([
+                    "hash ^= static_cast<uint32_t>(static_cast<uint8_t>(str[i]))",
+                    "      | static_cast<uint32_t>(static_cast<uint8_t>(str[i+1])) << 8",
+                    "      | static_cast<uint32_t>(static_cast<uint8_t>(str[i+2])) << 16",
+                    "      | static_cast<uint32_t>(static_cast<uint8_t>(str[i+3])) << 24;",
+                    f"hash *= {FNV_PRIME}u;",
+                    "hash ^= hash >> 15;",
+                ])
+            with src.block("for(; i < str.size(); i++){"):
+                src.lines([
+                    "hash ^= static_cast<uint8_t>(str[i]);",
+                    f"hash *= {FNV_PRIME}u;",
+                    "hash ^= hash >> 15;",
+                ])
+            src.line()
+            src.line("return hash;")
+        src.line()
+        src.line("/// FNV-1a hash of a string, consuming 1 byte per step")
+        with src.block("static constexpr uint32_t hashBytewise(std::string_view str) noexcept {"):
+            src.line(f"uint32_t hash = {FNV_OFFSET_BASIS}u;")
+            with src.block("for(char ch : str){"):
+                src.line("hash ^= static_cast<uint8_t>(ch);")
+                src.line(f"hash *= {FNV_PRIME}u;")
+            src.line()
+            src.line("return hash;")
+    src.line()
+    src.line("/// Minimal perfect hash of setting=option pairs, usable in constant expressions")
+    with src.block("struct SettingsPairLookup {", "};"):
+        src.label("private:")
+        src.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "static constexpr size_t NOT_FOUND = static_cast<size_t>(-1);",
+            "",
+            "/// Seed of the base hash, for which no two keys have the same base hash",
+            f"static constexpr uint32_t HASH_SEED = {hash_seed};",
+            "",
+            "/// Avalanche the bits of a hash so that any subset of bits is usable",
+        ])
+        with src.block("static constexpr uint32_t mix(uint32_t hash) noexcept {"):
+            src.lines([
+                "hash ^= hash >> 16;",
+                "hash *= 0x85EBCA6Bu;",
+                "hash ^= hash >> 13;",
+                "hash *= 0xC2B2AE35u;",
+                "hash ^= hash >> 16;",
+                "return hash;",
+            ])
+        src.line()
+        src.line("/// Per-bucket seeds which displace the keys of each bucket into unique slots")
+        with src.block(f"static constexpr std::array<uint32_t, {num_buckets}> bucket_seeds {{", "};"):
+            for seed in bucket_seeds:
+                src.line(f"{seed},")
+        src.line()
+        src.line("/// Combine SettingId and SettingsOption to use only 1 dictionary lookup")
+        with src.block(f"static constexpr std::array<std::string_view, {num_keys}> decoding_str_map {{", "};"):
+            for key in slots:
+                src.line(f"{cpp_string(key)},")
+        src.line()
+        with src.block(
+            f"static constexpr std::array<std::pair<SettingsId, SettingsOption>, {num_keys}> decoding_pair {{",
+            "};",
+        ):
+            for key in slots:
+                src.line(f"{pairs[key]},")
+        src.line()
+        src.line("/// Every valid pair has a unique index in the decoding tables")
+        with src.block("static constexpr size_t decodingIndex(std::string_view str) noexcept {"):
+            src.lines([
+                "const uint32_t base_hash = SettingsDiffScan::hash(str, HASH_SEED);",
+                f"const uint32_t seed = bucket_seeds[mix(base_hash) % {num_buckets}u];",
+                f"return mix(base_hash ^ seed) % {num_keys}u;",
+            ])
+        src.line()
+        src.line("/// The index of a setting=option pair in the decoding tables, or NOT_FOUND if the pair is invalid")
+        with src.block("static constexpr size_t find(std::string_view setting_pair) noexcept {"):
+            src.line("const size_t index = decodingIndex(setting_pair);")
+            src.line("return decoding_str_map[index] == setting_pair ? index : NOT_FOUND;")
+        src.lines([
+            "",
+            "friend SettingsDiff;",
+            "template<size_t N> friend struct SettingsDiffLiteral;",
+        ])
+    src.line()
+
+    return src
 
 
 def build_perfect_hash(keys):
-    for a in range(256):
-        if len({hash(key, a).value for key in keys}) == len(keys):
-            return lambda key: hash(key, a).value, hash_str(a)
-    raise Exception("Failed to find perfect hash")
-
-def main():
-    inputs = [
-        Path("settings_definition.json"),
-        Path("codegen.py"),
-    ]
+    """
+    Build a minimal perfect hash by hashing and displacement.
+    Keys are split into buckets by their base hash, then a seed is found for each bucket which places all of its
+    keys into free slots. The largest buckets are placed first while the table is still sparse. The base hash is
+    seeded with the first seed for which no keys collide.
+    Returns the base hash seed, the bucket seeds and the keys ordered by their slot.
+    """
+    for hash_seed in range(MAX_HASH_SEED):
+        base_hashes = {key: hash(key, hash_seed) for key in keys}
+        if len(set(base_hashes.values())) == len(keys):
+            break
+    else:
+        raise Exception("Failed to find perfect hash: keys have colliding base hashes for every seed")
+
+    num_keys = len(keys)
+    num_buckets = max(1, ceil(num_keys / KEYS_PER_BUCKET))
+    buckets = [[] for _ in range(num_buckets)]
+    for key in keys:
+        buckets[mix(base_hashes[key]) % num_buckets].append(key)
 
-    outputs = [
-        Path("../src/forscape_settings.cpp"),
-        Path("../include/forscape_settings.h"),
-        Path("../src/forscape_settings_diff.cpp"),
-        Path("../include/forscape_settings_diff.h"),
-        Path("../src/forscape_settings_diff_dialog.ui")
+    bucket_seeds = [0] * num_buckets
+    slots = [None] * num_keys
+    for bucket_idx in sorted(range(num_buckets), key=lambda idx: len(buckets[idx]), reverse=True):
+        bucket = buckets[bucket_idx]
+        if not bucket:
+            break
+
+        for seed in range(1, MAX_BUCKET_SEED):
+            positions = {mix(base_hashes[key] ^ seed) % num_keys for key in bucket}
+            if len(positions) == len(bucket) and all(slots[pos] is None for pos in positions):
+                break
+        else:
+            raise Exception(f"Failed to find perfect hash: no seed places bucket {bucket}")
+
+        bucket_seeds[bucket_idx] = seed
+        for key in bucket:
+            slots[mix(base_hashes[key] ^ seed) % num_keys] = key
+
+    return hash_seed, bucket_seeds, slots
+
+
+def output_paths(root=Path("..")):
+    return [
+        root / "src" / "forscape_settings.cpp",
+        root / "include" / "forscape_settings.h",
+        root / "src" / "forscape_settings_diff.cpp",
+        root / "include" / "forscape_settings_diff.h",
     ]
 
-    if all([path.is_file() for path in outputs]) and max([os.path.getmtime(path) for path in inputs]) < min([os.path.getmtime(path) for path in outputs]):
-        print("Skipping settings code generation since outputs are more recent than source files")
-        return
 
-    settings_def = get_definition()
-    options = OrderedDict(sorted(settings_def["options"].items()))
-    settings = OrderedDict(sorted(settings_def["compiler_settings"].items()))
-    errors = []
+def emit_settings(model, root):
+    """Emit the settings library sources, returning the unwritten files"""
+    options = model.options
+    settings = model.settings
+    num_settings_bits = model.num_settings_bits
+    num_options_bits = model.num_options_bits
+    setting_typedef = model.setting_typedef
+    options_typedef = model.options_typedef
+    outputs = output_paths(root)
 
-    for idx, option in enumerate(options):
-        options[option]["index"] = idx
+    # Pack the local option index of each setting into bit fields, without straddling words
+    setting_widths = [max(1, ceil(log2(len(vals["options"])))) for vals in settings.values()]
+    word_bits = 32 if sum(setting_widths) <= 32 else 64
+    word_typedef = f"uint{word_bits}_t"
+    fields = []
+    word_idx = 0
+    shift = 0
+    for width in setting_widths:
+        if shift + width > word_bits:
+            word_idx += 1
+            shift = 0
+        fields.append((word_idx, shift, width))
+        shift += width
+    num_words = word_idx + 1
 
-    num_settings_bits = ceil(log2(len(settings)))
-    num_options_bits = ceil(log2(len(options)))
-    setting_typedef = "uint8_t" if num_settings_bits <= 8 else "uint16_t"
-    options_typedef = "uint8_t" if num_options_bits <= 8 else "uint16_t"
+    first_options = []
+    global_options = []
+    for compiler_setting_vals in settings.values():
+        first_options.append(len(global_options))
+        global_options += [options[option]["index"] for option in compiler_setting_vals["options"] if option in options]
 
-    settings_header = (
-        "#ifndef FORSCAPE_SETTINGS_H\n"
-        "#define FORSCAPE_SETTINGS_H\n"
-        "\n"
-        "#include <array>\n"
-        "#include <stddef.h>\n"
-        "#include <stdint.h>\n"
-        "#include <vector>\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-        "struct ScopedSettings;\n"
-        "struct SettingsDiffView;\n"
-        "\n"
-        f"typedef {options_typedef} SettingsOption;\n"
-        "\n"
-    )
+    # The compact binary format encodes each update with fixed-width setting and option indices. The version is
+    # derived from the widths and the index assignments, so buffers written with a different definition are rejected.
+    compact_setting_bits = max(1, num_settings_bits)
+    compact_option_bits = max(1, num_options_bits)
+    compact_format_version = 1 + fnv1a(f"{compact_setting_bits},{compact_option_bits},{list(settings)},{list(options)}") % 255
 
-    settings_src = (
-        "#include \"forscape_settings.h\"\n"
-        "\n"
-        "#include <cassert>\n"
-        "#include \"forscape_settings_diff.h\"\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-    )
+    settings_header = CodeWriter()
+    settings_header.lines([
+        "struct PackedSettingsDiff;",
+        "struct ResolvedSettingsCache;",
+        "struct SettingsContext;",
+        "",
+        "/// How BasicScopedSettings restores the settings when leaving a scope",
+    ])
+    with settings_header.block("enum class ScopeStrategy {", "};"):
+        settings_header.line("UNDO_LOG,  ///< Record the previous values overwritten by each diff, and revert them in reverse order")
+        settings_header.line("SNAPSHOT,  ///< Record the full packed settings on entering each scope, and restore them")
+    settings_header.lines([
+        "",
+        "template<ScopeStrategy strategy> struct BasicScopedSettings;",
+        "",
+        f"typedef {options_typedef} SettingsOption;",
+        "",
+        "/// A machine word holding the packed option indices of several settings",
+        f"typedef {word_typedef} SettingsWord;",
+        "",
+        "/// A set of settings, with a bit per setting",
+        f"typedef std::bitset<{len(settings)}> SettingsSet;",
+        "",
+    ])
 
-    diff_header = (
-        "#ifndef FORSCAPE_SETTINGS_DIFF_H\n"
-        "#define FORSCAPE_SETTINGS_DIFF_H\n"
-        "\n"
-        "#include <stdint.h>\n"
-        "#include <string>\n"
-        "#include <string_view>\n"
-        "#include <vector>\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-        "struct ScopedSettings;\n"
-        "struct SettingsDiff;\n"
-        "class SettingsDiffDialog;\n"
-        "\n"
-        "/// Immutable view of a diff to update settings\n"
-        "struct SettingsDiffView {\n"
-        "    /// Interpret a buffer as a SettingsDiffView.\n"
-        "    /// This allows for reading a SettingsDiffView from a parse node.\n"
-        "    static SettingsDiffView fromBuffer(const size_t* buffer) noexcept;\n"
-        "\n"
-        "private:\n"
-        f"    typedef {setting_typedef} SettingsId;\n"
-        f"    typedef {options_typedef} SettingsOption;\n"
-        "\n"
-        "    size_t num_settings;\n"
-        "    const std::pair<SettingsId, SettingsOption>* settings;\n"
-        "\n"
-        "    friend ScopedSettings;\n"
-        "    friend SettingsDiff;\n"
-        "};\n"
-        "\n"
-        "/// Specifications to override a subset of settings\n"
-        "struct SettingsDiff {\n"
-        "    /// Append a serialised representation of the SettingsDiff to a string.\n"
-        "    void writeString(std::string& out) const;\n"
-        "\n"
-        "    /// Determine if a string is a valid serialised representation of a SettingsDiff.\n"
-        "    static bool isValidSerial(std::string_view str) noexcept;\n"
-        "\n"
-        "    /// Deserialise a SettingsDiff from a string, writing errors for any invalidly specified settings.\n"
-        "    /// Asserts if the argument is not valid serial.\n"
-        "    static SettingsDiff fromString(std::string_view str);\n"
-        "\n"
-        "    /// Get a view of the diff.\n"
-        "    /// This is invalidated when the diff changes.\n"
-        "    SettingsDiffView view() const noexcept;\n"
-        "\n"
-        "    operator SettingsDiffView() const noexcept;\n"
-        "\n"
-        "    /// Write the diff to a buffer, which can be interpreted as a SettingsDiffView.\n"
-        "    /// This allows for copying the diff to a parse node.\n"
-        "    void writeToBuffer(std::vector<size_t>& buffer) const;\n"
-        "\n"
-        "protected:\n"
-        f"    typedef {setting_typedef} SettingsId;\n"
-        f"    typedef {options_typedef} SettingsOption;\n"
-        "    std::vector<std::pair<SettingsId, SettingsOption>> updates;\n"
-        "\n"
-        "    friend SettingsDiffDialog;\n"
-        "};\n"
-        "\n"
-        "}  // namespace Forscape\n"
-        "\n"
-        "#endif // FORSCAPE_SETTINGS_DIFF_H\n"
-    )
+    settings_src = CodeWriter()
 
-    diff_src = (
-        "#include \"forscape_settings_diff.h\"\n" \
-        "\n"
-        "#include <array>\n"
-        "#include <cassert>\n"
-        "#include <cstring>\n"
-        "#include <string_view>\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-    )
+    diff_header = CodeWriter()
+    diff_header.lines([
+        "struct PackedSettingsDiff;",
+        "struct Settings;",
+        "struct SettingsInstrumentation;",
+        "struct SettingsDiff;",
+        "struct SettingsDiffPool;",
+        "struct SettingsDiffBuffer;",
+        "struct SettingsDiffBatch;",
+        "template<size_t N> struct SettingsDiffLiteral;",
+        "class SettingsDiffDialog;",
+        "",
+        "/// Version of the compact binary format written by SettingsDiff::writeCompact.",
+        "/// This changes whenever the settings definition changes the encoding of settings or options.",
+        f"static constexpr uint8_t SETTINGS_DIFF_FORMAT_VERSION = {compact_format_version};",
+        "",
+        "/// Immutable view of a diff to update settings",
+    ])
+    with diff_header.block("struct SettingsDiffView {", "};"):
+        diff_header.lines([
+            "/// Interpret a buffer as a SettingsDiffView.",
+            "/// This allows for reading a SettingsDiffView from a parse node.",
+            "static SettingsDiffView fromBuffer(const size_t* buffer) noexcept;",
+            "",
+            "SettingsDiffView() noexcept = default;",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "constexpr SettingsDiffView(size_t num_settings, const std::pair<SettingsId, SettingsOption>* settings) noexcept",
+            "    : num_settings(num_settings), settings(settings) {}",
+            "",
+            "size_t num_settings;",
+            "const std::pair<SettingsId, SettingsOption>* settings;",
+            "",
+            "friend PackedSettingsDiff;",
+            "friend SettingsDiff;",
+            "friend SettingsDiffBuffer;",
+            "friend SettingsDiffPool;",
+            "friend SettingsDiffBatch;",
+            "friend SettingsInstrumentation;",
+            "template<size_t N> friend struct SettingsDiffLiteral;",
+        ])
+    diff_header.lines([
+        "",
+        "/// Immutable view of a diff in the compact binary format, which is read in place without copying.",
+        "/// The format is a version byte, the number of updates as a LEB128 varint, then each update as a setting",
+        "/// and option index bit-packed with no padding until the end of the final byte.",
+    ])
+    with diff_header.block("struct CompactSettingsDiffView {", "};"):
+        diff_header.lines([
+            "/// Interpret bytes written by SettingsDiff::writeCompact, which may be followed by other data.",
+            "/// Returns false if the bytes are not a valid diff of the current format version.",
+            "static bool fromBytes(const uint8_t* data, size_t size, CompactSettingsDiffView& out) noexcept;",
+            "",
+            "/// The number of updates in the diff",
+            "size_t size() const noexcept;",
+            "",
+            "/// The number of bytes occupied by the diff, including the version and length prefix",
+            "size_t numBytes() const noexcept;",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "std::pair<SettingsId, SettingsOption> get(size_t index) const noexcept;",
+            "",
+            "const uint8_t* packed_updates = nullptr;",
+            "size_t num_settings = 0;",
+            "size_t num_bytes = 0;",
+            "",
+            "friend PackedSettingsDiff;",
+            "friend SettingsDiff;",
+        ])
+    diff_header.line()
+    diff_header.line("/// Reason a string is not a valid serialised representation of a SettingsDiff")
+    with diff_header.block("struct SettingsDiffError {", "};"):
+        with diff_header.block("enum Code : uint8_t {", "};"):
+            diff_header.lines([
+                "NONE,  ///< The string is valid",
+                "EMPTY_PAIR,  ///< A pair is empty, e.g. due to a trailing comma",
+                "UNKNOWN_PAIR,  ///< A pair is not a known setting=option combination",
+                "DUPLICATE_SETTING,  ///< A setting is specified more than once",
+            ])
+        diff_header.lines([
+            "",
+            "Code code = NONE;",
+            "size_t offset = 0;  ///< Byte offset of the offending pair",
+            "size_t length = 0;  ///< Byte length of the offending pair",
+            "",
+            "explicit operator bool() const noexcept { return code != NONE; }",
+        ])
+    diff_header.line()
+    diff_header.line("/// Fixed-capacity diff which holds any valid diff without allocating")
+    with diff_header.block("struct SettingsDiffBuffer {", "};"):
+        diff_header.lines([
+            "/// The maximum number of updates, since a valid diff specifies each setting at most once",
+            f"static constexpr size_t CAPACITY = {len(settings)};",
+            "",
+            "size_t size() const noexcept;",
+            "",
+            "/// Get a view of the diff.",
+            "/// This is invalidated when the buffer changes.",
+            "SettingsDiffView view() const noexcept;",
+            "",
+            "operator SettingsDiffView() const noexcept;",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "size_t num_settings = 0;",
+            "std::array<std::pair<SettingsId, SettingsOption>, CAPACITY> settings;",
+            "",
+            "friend SettingsDiff;",
+        ])
+    diff_header.lines([
+        "",
+        "/// Replacement of a range of a serialised diff, which transforms the serialisation before a change to the diff",
+        "/// into the serialisation after it",
+    ])
+    with diff_header.block("struct SettingsDiffEdit {", "};"):
+        diff_header.lines([
+            "size_t offset = 0;  ///< Start of the replaced range",
+            "size_t length = 0;  ///< Number of characters replaced",
+            "std::string replacement;",
+            "",
+            "/// Determine if the edit leaves the serialisation unchanged",
+            "bool empty() const noexcept;",
+            "",
+            "/// Apply the edit to the serialisation from before the change",
+            "void apply(std::string& str) const;",
+        ])
+    diff_header.line()
+    diff_header.line("/// Specifications to override a subset of settings")
+    with diff_header.block("struct SettingsDiff {", "};"):
+        diff_header.lines([
+            "/// Append a serialised representation of the SettingsDiff to a string.",
+            "void writeString(std::string& out) const;",
+            "",
+            "/// Determine if a string is a valid serialised representation of a SettingsDiff.",
+            "static bool isValidSerial(std::string_view str) noexcept;",
+            "",
+            "/// Validate and deserialise a string in a single pass without allocating.",
+            "/// On error, the buffer holds the pairs preceding the offending pair.",
+            "static SettingsDiffError parse(std::string_view str, SettingsDiffBuffer& out) noexcept;",
+            "",
+            "/// Deserialise a SettingsDiff from a string, writing errors for any invalidly specified settings.",
+            "/// Asserts if the argument is not valid serial.",
+            "static SettingsDiff fromString(std::string_view str);",
+            "",
+            "/// Deserialise a SettingsDiff from a string, reporting the first invalidly specified setting.",
+            "/// On error, the diff holds the settings preceding the offending pair.",
+            "static SettingsDiff fromString(std::string_view str, SettingsDiffError& error);",
+            "",
+            "/// Get a view of the diff.",
+            "/// This is invalidated when the diff changes.",
+            "SettingsDiffView view() const noexcept;",
+            "",
+            "operator SettingsDiffView() const noexcept;",
+            "",
+            "/// Write the diff to a buffer, which can be interpreted as a SettingsDiffView.",
+            "/// This allows for copying the diff to a parse node.",
+            "void writeToBuffer(std::vector<size_t>& buffer) const;",
+            "",
+            "/// Append the diff to a buffer in the compact binary format, which can be read by CompactSettingsDiffView.",
+            "void writeCompact(std::vector<uint8_t>& buffer) const;",
+            "",
+            "/// Copy a diff from the compact binary format",
+            "static SettingsDiff fromCompact(const CompactSettingsDiffView& compact);",
+            "",
+            "/// Set a setting to an option given as a setting=option pair, reporting the edit to the serialisation.",
+            "/// A setting already in the diff keeps its position, and a new setting is inserted before the first setting",
+            "/// after it, so a diff sorted by setting stays sorted. Returns false if the pair is invalid.",
+            "bool set(std::string_view setting_pair, SettingsDiffEdit& edit);",
+            "",
+            "/// Stop specifying a setting given by name, reporting the edit to the serialisation.",
+            "/// Returns false if there is no such setting.",
+            "bool remove(std::string_view setting, SettingsDiffEdit& edit);",
+            "",
+            "/// Put the diff in canonical form, where each setting appears once with its last option, sorted by setting.",
+            "/// Applying the canonical diff has the same effect as applying the original.",
+            "void canonicalise();",
+            "",
+            "/// Get the canonical diff with the same effect as applying the first diff, then the second",
+            "static SettingsDiff compose(const SettingsDiffView& first, const SettingsDiffView& second);",
+            "",
+            "/// Get the canonical diff with the fewest settings which transforms one set of settings into another",
+            "static SettingsDiff between(const Settings& from, const Settings& to);",
+            "",
+        ])
+        diff_header.label("protected:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "std::vector<std::pair<SettingsId, SettingsOption>> updates;",
+            "",
+            "/// Set a setting to an option, returning the edit to the serialisation",
+            "SettingsDiffEdit setUpdate(SettingsId setting, SettingsOption option);",
+            "",
+            "/// Stop specifying a setting, returning the edit to the serialisation",
+            "SettingsDiffEdit removeUpdate(SettingsId setting);",
+            "",
+            "/// Parse a diff into an array with room for every pair, counting the pairs decoded before any error",
+            "static SettingsDiffError parsePairs(",
+            "    std::string_view str, std::pair<SettingsId, SettingsOption>* out, size_t& num_settings) noexcept;",
+            "",
+            "friend SettingsDiffBatch;",
+            "friend SettingsDiffDialog;",
+        ])
+    diff_header.lines([
+        "",
+        "/// Handle to a diff interned in a SettingsDiffPool. Handles from the same pool are equal iff their diffs are equal.",
+        "typedef uint32_t SettingsDiffHandle;",
+        "",
+        "/// Storage of canonical diffs, so that a diff repeated throughout a program is stored once and compared by handle",
+    ])
+    with diff_header.block("struct SettingsDiffPool {", "};"):
+        diff_header.lines([
+            "/// Intern the canonical form of a diff, which is sorted by setting with later updates of a setting overriding",
+            "/// earlier ones. Returns the existing handle if an equal diff was already interned.",
+            "SettingsDiffHandle intern(const SettingsDiffView& diff);",
+            "",
+            "/// Get a view of an interned diff.",
+            "/// This is invalidated when another diff is interned.",
+            "SettingsDiffView view(SettingsDiffHandle handle) const noexcept;",
+            "",
+            "/// The number of distinct diffs interned",
+            "size_t size() const noexcept;",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "/// The updates of every interned diff, concatenated",
+            "std::vector<std::pair<SettingsId, SettingsOption>> updates;",
+            "",
+            "/// The start of each interned diff in updates, followed by the end of the last diff",
+            "std::vector<uint32_t> offsets = {0};",
+            "",
+            "/// The handle of each interned diff, keyed by the bytes of its updates",
+            "std::unordered_map<std::string, SettingsDiffHandle> handles;",
+            "",
+            "/// Reusable storage for canonicalising a diff",
+            "std::vector<std::pair<SettingsId, SettingsOption>> scratch;",
+        ])
+    diff_header.lines([
+        "",
+        "/// Many serialised diffs parsed at once, with the pairs of every diff stored contiguously in one arena.",
+        "/// Storage is reused, so parsing batches of a similar size repeatedly does not allocate.",
+    ])
+    with diff_header.block("struct SettingsDiffBatch {", "};"):
+        diff_header.lines([
+            "/// The minimum number of strings for each thread, below which threads cost more than they save",
+            "static constexpr size_t MIN_STRINGS_PER_THREAD = 1024;",
+            "",
+            "/// Parse every string, replacing the previous contents.",
+            "/// Large batches are split into contiguous ranges which are parsed concurrently by up to num_threads threads.",
+            "void parse(const std::string_view* strs, size_t num_strs, size_t num_threads = 1);",
+            "",
+            "void parse(const std::vector<std::string_view>& strs, size_t num_threads = 1);",
+            "",
+            "/// The number of strings parsed",
+            "size_t size() const noexcept;",
+            "",
+            "/// The diff of a string, which holds the pairs preceding the offending pair if the string is invalid.",
+            "/// This is invalidated when the batch is parsed again.",
+            "SettingsDiffView view(size_t index) const noexcept;",
+            "",
+            "/// The first error of a string",
+            "const SettingsDiffError& error(size_t index) const noexcept;",
+            "",
+            "/// The number of invalid strings",
+            "size_t numErrors() const noexcept;",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "/// The pairs of every string, concatenated",
+            "std::vector<std::pair<SettingsId, SettingsOption>> updates;",
+            "",
+            "/// The start of the pairs of each string in updates, followed by the end of the last string",
+            "std::vector<size_t> offsets;",
+            "",
+            "std::vector<SettingsDiffError> errors;",
+            "size_t num_errors = 0;",
+            "",
+            "/// The number of pairs parsed from each string, before the arena is compacted",
+            "std::vector<size_t> sizes;",
+        ])
+    diff_header.line()
+
+    diff_src = CodeWriter()
 
     # Write compiler settings enums
     for compiler_setting, compiler_setting_vals in settings.items():
-        settings_header += (
-            f"/// {compiler_setting_vals['brief']}.\n"
-            f"enum class {vartitle(compiler_setting)}Option : SettingsOption {{\n"
-        )
-        for option in compiler_setting_vals["options"]:
-            settings_header += f"    {varupper(option)} = {options[option]['index']},"
-            if option in options:
-                settings_header += f"  ///< {options[option]['description']}"
-            else:
-                errors += f"Option {option} was not found (from setting {compiler_setting})"
-            settings_header += "\n"
-        settings_header += "};\n\n"
+        settings_header.line(f"/// {compiler_setting_vals['brief']}.")
+        with settings_header.block(f"enum class {vartitle(compiler_setting)}Option : SettingsOption {{", "};"):
+            for option in compiler_setting_vals["options"]:
+                settings_header.line(f"{varupper(option)} = {options[option]['index']},  ///< {options[option]['description']}")
+        settings_header.line()
 
     # Write compiler settings struct
-    settings_header += (
-        "/// Compiler options which change the evaluation of Forscape code and IDE interactions\n"
-        "struct Settings {\n"
-        "    /// Get default settings before any user overrides\n"
-        "    static const Settings& getDefaults() noexcept;\n"
-        "\n"
-    )
-    for compiler_setting, compiler_setting_vals in settings.items():
-        settings_header += (
-            f"    /// {compiler_setting_vals['brief']}.\n"
-            f"    {vartitle(compiler_setting)}Option get{vartitle(compiler_setting)}Option() const noexcept;\n"
-            "\n"
-        )
-    settings_header += (
-        "private:\n"
-        "    friend ScopedSettings;\n"
-        f"    typedef {setting_typedef} SettingsId;\n"
-        f"    std::array<SettingsId, {len(settings)}> compiler_settings;\n"
-        f"    static const Settings DEFAULT_SETTINGS;\n"
-        f"    Settings(const std::array<SettingsId, {len(settings)}>& compiler_settings) noexcept;\n"
-        "};\n"
-        "\n"
-    )
+    settings_header.line("/// Compiler options which change the evaluation of Forscape code and IDE interactions")
+    with settings_header.block("struct Settings {", "};"):
+        settings_header.lines([
+            "/// Get default settings before any user overrides",
+            "static const Settings& getDefaults() noexcept;",
+            "",
+        ])
+        for compiler_setting, compiler_setting_vals in settings.items():
+            settings_header.lines([
+                f"/// {compiler_setting_vals['brief']}.",
+                f"{vartitle(compiler_setting)}Option get{vartitle(compiler_setting)}Option() const noexcept;",
+                "",
+            ])
+        settings_header.lines([
+            "bool operator==(const Settings& other) const noexcept;",
+            "bool operator!=(const Settings& other) const noexcept;",
+            "",
+            "/// Get the settings whose options differ from other settings, e.g. to find the settings a diff changed",
+            "SettingsSet differences(const Settings& other) const noexcept;",
+            "",
+        ])
+        settings_header.label("private:")
+        settings_header.lines([
+            "template<ScopeStrategy strategy> friend struct BasicScopedSettings;",
+            "friend ResolvedSettingsCache;",
+            "friend SettingsContext;",
+            "friend SettingsDiff;",
+            f"typedef {setting_typedef} SettingsId;",
+            f"static constexpr size_t NUM_WORDS = {num_words};",
+            "",
+            "/// The local option index of every setting, packed into bit fields",
+            "std::array<SettingsWord, NUM_WORDS> compiler_settings;",
+            "static const Settings DEFAULT_SETTINGS;",
+            "Settings(const std::array<SettingsWord, NUM_WORDS>& compiler_settings) noexcept;",
+            "",
+            "/// Overwrite the masked fields with the diff values",
+            "void apply(const PackedSettingsDiff& diff) noexcept;",
+        ])
+    settings_header.line()
 
-    settings_header += (
-        "/// Locally-scoped compiler options which change the evaluation of Forscape code and IDE interactions\n"
-        "struct ScopedSettings {\n"
-        "    /// Mutate the settings in place with a diff\n"
-        "    void applyDiff(const SettingsDiffView& diff);\n"
-        "\n"
-        "    /// Perform necessary bookkeeping when entering a new scope\n"
-        "    void enterScope();\n"
-        "\n"
-        "    /// Revert any setting updates made in the scope\n"
-        "    void leaveScope() noexcept;\n"
-        "\n"
-    )
-    for compiler_setting, compiler_setting_vals in settings.items():
-        settings_header += (
-            f"    /// {compiler_setting_vals['brief']}.\n"
-            f"    {vartitle(compiler_setting)}Option get{vartitle(compiler_setting)}Option() const noexcept;\n"
-            "\n"
-        )
-    settings_header += (
-        "    const Settings& getSettings() const noexcept;\n"
-        "\n"
-        "    operator const Settings&() const noexcept;\n"
-        "private:\n"
-        f"    typedef {setting_typedef} SettingsId;\n"
-        "\n"
-        "    Settings settings = Settings::getDefaults();\n"
-        "    std::vector<size_t> num_settings_modified_per_scope;\n"
-        "    std::vector<std::pair<SettingsId, SettingsOption>> modified_settings;\n"
-        "\n"
-        "    #ifndef NDEBUG\n"
-        "    bool isScopeNested() const noexcept;\n"
-        "    #endif\n"
-        "};\n"
-        "\n"
-    )
+    settings_header.line("/// A diff expressed as masks over the packed settings words, so applying it is a couple of bitwise operations")
+    with settings_header.block("struct PackedSettingsDiff {", "};"):
+        settings_header.lines([
+            "/// Construct an empty diff",
+            "PackedSettingsDiff() noexcept;",
+            "",
+            "/// Precompute the packed form of a diff. Later updates of a setting override earlier updates.",
+            "explicit PackedSettingsDiff(const SettingsDiffView& diff) noexcept;",
+            "",
+            "/// Precompute the packed form of a diff in the compact binary format",
+            "explicit PackedSettingsDiff(const CompactSettingsDiffView& diff) noexcept;",
+            "",
+        ])
+        settings_header.label("private:")
+        settings_header.lines([
+            f"std::array<SettingsWord, {num_words}> mask;",
+            f"std::array<SettingsWord, {num_words}> value;",
+            "",
+            "template<ScopeStrategy strategy> friend struct BasicScopedSettings;",
+            "friend Settings;",
+            "friend SettingsContext;",
+            "friend SettingsInstrumentation;",
+        ])
+    settings_header.line()
+
+    settings_header.line("/// Locally-scoped compiler options which change the evaluation of Forscape code and IDE interactions")
+    settings_header.line("template<ScopeStrategy strategy>")
+    with settings_header.block("struct BasicScopedSettings {", "};"):
+        settings_header.lines([
+            "/// Mutate the settings in place with a diff",
+            "void applyDiff(const SettingsDiffView& diff);",
+            "",
+            "/// Mutate the settings in place with a precomputed diff",
+            "void applyDiff(const PackedSettingsDiff& diff);",
+            "",
+            "/// Mutate the settings in place with a diff in the compact binary format",
+            "void applyDiff(const CompactSettingsDiffView& diff);",
+            "",
+            "/// Mutate the settings in place with an interned diff, reusing the result of previous applications to the",
+            "/// same settings",
+            "void applyDiff(SettingsDiffHandle diff, const SettingsDiffPool& pool, ResolvedSettingsCache& cache);",
+            "",
+            "/// Perform necessary bookkeeping when entering a new scope",
+            "void enterScope();",
+            "",
+            "/// Revert any setting updates made in the scope",
+            "void leaveScope() noexcept;",
+            "",
+        ])
+        for compiler_setting, compiler_setting_vals in settings.items():
+            settings_header.lines([
+                f"/// {compiler_setting_vals['brief']}.",
+                f"{vartitle(compiler_setting)}Option get{vartitle(compiler_setting)}Option() const noexcept;",
+                "",
+            ])
+        settings_header.lines([
+            "const Settings& getSettings() const noexcept;",
+            "",
+            "operator const Settings&() const noexcept;",
+        ])
+        settings_header.label("private:")
+        settings_header.lines([
+            "Settings settings = Settings::getDefaults();",
+            "",
+            "/// The state to restore when leaving each scope: either a snapshot of the settings, or the undo log size",
+            "std::vector<std::conditional_t<strategy == ScopeStrategy::SNAPSHOT, Settings, size_t>> scopes;",
+            "",
+            "/// The previous values of the fields overwritten by each applied diff, which is unused by snapshots",
+            "std::vector<PackedSettingsDiff> undo_log;",
+            "",
+            "#ifndef NDEBUG",
+            "bool isScopeNested() const noexcept;",
+            "#endif",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "/// The bytes of the scope stack and undo log, which measures the scope state of either strategy",
+            "size_t scopeBytes() const noexcept;",
+            "#endif",
+        ])
+    settings_header.line()
+    settings_header.line("/// Memoised results of applying interned diffs to settings, with least-recently-used eviction")
+    with settings_header.block("struct ResolvedSettingsCache {", "};"):
+        settings_header.lines([
+            "/// Construct a cache holding at most capacity results. The result of resolve is held by the cache,",
+            "/// so a capacity of 0 holds 1 result.",
+            "explicit ResolvedSettingsCache(size_t capacity = 1024);",
+            "",
+            "/// Get the settings resulting from applying an interned diff to the parent settings.",
+            "/// The reference is invalidated by the next call to resolve.",
+            "const Settings& resolve(const Settings& parent, SettingsDiffHandle diff, const SettingsDiffPool& pool);",
+            "",
+            "/// Remove all results, e.g. when the pool is replaced",
+            "void clear() noexcept;",
+            "",
+            "size_t size() const noexcept;",
+            "size_t hits() const noexcept;",
+            "size_t misses() const noexcept;",
+            "",
+        ])
+        settings_header.label("private:")
+        with settings_header.block("struct Key {", "};"):
+            settings_header.lines([
+                "std::array<SettingsWord, Settings::NUM_WORDS> parent;",
+                "SettingsDiffHandle diff;",
+                "",
+                "bool operator==(const Key& other) const noexcept;",
+            ])
+        settings_header.line()
+        with settings_header.block("struct KeyHash {", "};"):
+            settings_header.line("size_t operator()(const Key& key) const noexcept;")
+        settings_header.lines([
+            "",
+            "/// Results ordered from most to least recently used",
+            "typedef std::list<std::pair<Key, Settings>> Entries;",
+            "Entries entries;",
+            "std::unordered_map<Key, Entries::iterator, KeyHash> index;",
+            "size_t capacity;",
+            "size_t num_hits = 0;",
+            "size_t num_misses = 0;",
+        ])
+    settings_header.lines([
+        "",
+        "/// The settings in effect over ranges of source offsets, recorded while driving ScopedSettings through a parse.",
+        "/// Finding the settings at an offset is a binary search, and re-parsing a range replaces only its boundaries.",
+    ])
+    with settings_header.block("struct SettingsIntervalIndex {", "};"):
+        settings_header.lines([
+            "/// Record that settings take effect at an offset, until the next recorded offset.",
+            "/// Offsets are recorded in non-decreasing order, e.g. after entering and after leaving each scope.",
+            "void record(size_t offset, const Settings& settings);",
+            "",
+            "/// Get the settings in effect at an offset, which are the defaults before the first recorded offset",
+            "const Settings& at(size_t offset) const noexcept;",
+            "",
+            "/// Replace the settings of a re-parsed range, where the old range [start, end) now holds length characters",
+            "/// with the settings of replacement over [start, start + length). The settings at end resume after the",
+            "/// range, and later offsets shift by the change in length.",
+            "void replaceRange(size_t start, size_t end, size_t length, const SettingsIntervalIndex& replacement);",
+            "",
+            "/// Remove every recorded offset",
+            "void clear() noexcept;",
+            "",
+            "/// The number of offsets where the settings change",
+            "size_t size() const noexcept;",
+            "",
+        ])
+        settings_header.label("private:")
+        settings_header.lines([
+            "/// The offsets where the settings change, in increasing order",
+            "std::vector<size_t> boundaries;",
+            "",
+            "/// The settings from each boundary until the next",
+            "std::vector<Settings> values;",
+            "",
+            "/// Remove the boundaries in [first, last) whose settings are the same as the settings before them",
+            "void coalesce(size_t first, size_t last);",
+        ])
+    settings_header.lines([
+        "",
+        "/// Settings scoped by recording undo information for each applied diff",
+        "struct ScopedSettings : BasicScopedSettings<ScopeStrategy::UNDO_LOG> {};",
+        "",
+        "typedef ScopedSettings UndoLogScopedSettings;",
+        "",
+        "/// Settings scoped by recording a snapshot of the packed settings for each scope, which is opt-in. This can be",
+        "/// faster than the undo log when the packed settings are small and scopes apply several diffs.",
+        "typedef BasicScopedSettings<ScopeStrategy::SNAPSHOT> SnapshotScopedSettings;",
+        "",
+        "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+        "/// Counts of settings events across all threads, which are recorded when the library is built with",
+        "/// FORSCAPE_SETTINGS_INSTRUMENTATION defined",
+    ])
+    with settings_header.block("struct SettingsCounters {", "};"):
+        settings_header.lines([
+            "size_t diffs_applied = 0;  ///< Diffs applied to ScopedSettings",
+            "size_t settings_applied = 0;  ///< Settings specified by the applied diffs, counting each setting once per diff",
+            "size_t scopes_entered = 0;",
+            "size_t max_scope_depth = 0;  ///< The most scopes of ScopedSettings nested at once",
+            "size_t max_scope_bytes = 0;  ///< The most bytes of scope stack and undo log of a ScopedSettings at once",
+            "size_t parse_failures = 0;  ///< Strings which SettingsDiff::fromString failed to parse",
+            "",
+            "/// The average number of settings specified by an applied diff",
+            "double meanDiffLength() const noexcept;",
+        ])
+    settings_header.line()
+    settings_header.line("/// Functions called on each settings event, which are null if unused")
+    with settings_header.block("struct SettingsHooks {", "};"):
+        settings_header.lines([
+            "void (*diff_applied)(size_t num_settings, size_t scope_depth) = nullptr;",
+            "void (*scope_entered)(size_t scope_depth) = nullptr;",
+            "void (*scope_left)(size_t scope_depth) = nullptr;",
+            "void (*parse_failed)(std::string_view str, const SettingsDiffError& error) = nullptr;",
+        ])
+    settings_header.lines([
+        "",
+        "/// Get the counts of settings events since the counters were last reset",
+        "SettingsCounters getSettingsCounters() noexcept;",
+        "",
+        "void resetSettingsCounters() noexcept;",
+        "",
+        "/// Set the hooks called on settings events.",
+        "/// This is not synchronised with the events, so it is set before settings are used on other threads.",
+        "void setSettingsHooks(const SettingsHooks& hooks) noexcept;",
+        "",
+        "/// Recording of settings events by the runtime",
+    ])
+    with settings_header.block("struct SettingsInstrumentation {", "};"):
+        settings_header.label("private:")
+        settings_header.lines([
+            "static void diffApplied(size_t num_settings, size_t scope_depth, size_t scope_bytes) noexcept;",
+            "static void scopeEntered(size_t scope_depth, size_t scope_bytes) noexcept;",
+            "static void scopeLeft(size_t scope_depth) noexcept;",
+            "static void parseFailed(std::string_view str, const SettingsDiffError& error) noexcept;",
+            "",
+            "/// The number of settings specified by a diff",
+            "static size_t numSettings(const PackedSettingsDiff& diff) noexcept;",
+            "static size_t numSettings(const SettingsDiffView& diff) noexcept;",
+            "",
+            "template<ScopeStrategy strategy> friend struct BasicScopedSettings;",
+            "friend SettingsDiff;",
+        ])
+    settings_header.lines([
+        "#endif",
+        "",
+        "#ifdef FORSCAPE_SETTINGS_READ_TRACKING",
+        "/// Records the settings read through Settings getters on this thread while the tracker is alive, so a compiled",
+        "/// unit need only be recompiled if a setting it read changes. Trackers may be nested, and the reads of a nested",
+        "/// tracker are also recorded by the enclosing tracker. Reads are not recorded when no tracker is alive.",
+        "/// Only available when the library is built with FORSCAPE_SETTINGS_READ_TRACKING defined.",
+    ])
+    with settings_header.block("struct SettingsReadTracker {", "};"):
+        settings_header.lines([
+            "SettingsReadTracker() noexcept;",
+            "~SettingsReadTracker();",
+            "SettingsReadTracker(const SettingsReadTracker&) = delete;",
+            "SettingsReadTracker& operator=(const SettingsReadTracker&) = delete;",
+            "",
+            "/// The settings read since the tracker was constructed",
+            "const SettingsSet& reads() const noexcept;",
+            "",
+            "/// Determine if any of the changed settings were read",
+            "bool dependsOn(const SettingsSet& changed) const noexcept;",
+            "",
+        ])
+        settings_header.label("private:")
+        settings_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            "",
+            "/// The innermost tracker of the thread",
+            "static thread_local SettingsReadTracker* current;",
+            "",
+            "SettingsSet read_set;",
+            "SettingsReadTracker* enclosing;",
+            "",
+            "static void record(SettingsId setting_id) noexcept;",
+            "",
+            "friend Settings;",
+        ])
+    settings_header.lines([
+        "#endif",
+        "",
+        "/// Immutable settings of a scope, which share their enclosing scopes. Copying a context is O(1), and contexts",
+        "/// may be shared between threads without locks, e.g. to compile function bodies in parallel.",
+    ])
+    with settings_header.block("struct SettingsContext {", "};"):
+        settings_header.lines([
+            "/// Construct the context of the default settings",
+            "SettingsContext() noexcept = default;",
+            "",
+            "/// Get the context of a nested scope with a diff applied, leaving this context unchanged",
+            "SettingsContext withDiff(const SettingsDiffView& diff) const;",
+            "",
+            "/// Get the context of a nested scope with a precomputed diff applied, leaving this context unchanged",
+            "SettingsContext withDiff(const PackedSettingsDiff& diff) const;",
+            "",
+            "/// Get the context of a nested scope with a diff in the compact binary format applied",
+            "SettingsContext withDiff(const CompactSettingsDiffView& diff) const;",
+            "",
+            "/// Get the context of a nested scope with an interned diff applied.",
+            "/// The pool must not be interning concurrently.",
+            "SettingsContext withDiff(SettingsDiffHandle diff, const SettingsDiffPool& pool) const;",
+            "",
+            "/// Get the context of the enclosing scope",
+            "SettingsContext parent() const noexcept;",
+            "",
+            "/// The number of scopes nested in the default context",
+            "size_t depth() const noexcept;",
+            "",
+            "/// Construct mutable settings with a scope for each nested scope of the context, so leaving scopes restores",
+            "/// the settings of the enclosing contexts",
+            "ScopedSettings toScopedSettings() const;",
+            "",
+        ])
+        for compiler_setting, compiler_setting_vals in settings.items():
+            settings_header.lines([
+                f"/// {compiler_setting_vals['brief']}.",
+                f"{vartitle(compiler_setting)}Option get{vartitle(compiler_setting)}Option() const noexcept;",
+                "",
+            ])
+        settings_header.lines([
+            "const Settings& getSettings() const noexcept;",
+            "",
+            "operator const Settings&() const noexcept;",
+        ])
+        settings_header.label("private:")
+        with settings_header.block("struct Scope {", "};"):
+            settings_header.lines([
+                "std::shared_ptr<const Scope> parent;",
+                "PackedSettingsDiff diff;  ///< The diff applied to the parent settings",
+                "Settings settings;  ///< The resolved settings of the scope",
+                "size_t depth;",
+            ])
+        settings_header.lines([
+            "",
+            "/// The innermost scope, which is null for the default context",
+            "std::shared_ptr<const Scope> scope;",
+            "",
+            "explicit SettingsContext(std::shared_ptr<const Scope> scope) noexcept;",
+        ])
+    settings_header.line()
+
+    # Write packing tables
+    settings_src.lines([
+        f"typedef {setting_typedef} SettingsId;",
+        "",
+        "/// The location of a setting's local option index in the packed words",
+    ])
+    with settings_src.block("struct SettingsField {", "};"):
+        settings_src.lines([
+            "uint16_t word;",
+            "uint8_t shift;",
+            "SettingsWord mask;  ///< The mask of the field before shifting",
+            "uint32_t first_option;  ///< The index of the setting's first option in global_options",
+            "uint32_t num_options;",
+        ])
+    settings_src.line()
+    with settings_src.block(f"static constexpr std::array<SettingsField, {len(settings)}> fields {{{{", "}};"):
+        for idx, (word, shift, width) in enumerate(fields):
+            num_setting_options = len(global_options) - first_options[idx] if idx+1 == len(fields) else first_options[idx+1] - first_options[idx]
+            settings_src.line(f"{{{word}, {shift}, 0x{(1 << width) - 1:X}u, {first_options[idx]}, {num_setting_options}}},")
+    settings_src.line()
+    settings_src.line("/// The global option of each local option index, with the options of each setting concatenated")
+    with settings_src.block(
+        f"static constexpr std::array<SettingsOption, {len(global_options)}> global_options {{",
+        "};",
+    ):
+        for option_idx in global_options:
+            settings_src.line(f"{option_idx},")
+    settings_src.lines([
+        "",
+        "/// The first setting packed into each word, followed by the number of settings.",
+        "/// Fields are packed in order of setting, so the settings of each word are contiguous.",
+    ])
+    with settings_src.block(f"static constexpr std::array<SettingsId, {num_words + 1}> word_first_setting {{", "};"):
+        for word in range(num_words):
+            settings_src.line(f"{next(idx for idx, field in enumerate(fields) if field[0] == word)},")
+        settings_src.line(f"{len(fields)},")
+    settings_src.line()
+    with settings_src.block("static SettingsWord localOption(SettingsId setting_id, SettingsOption option) noexcept {"):
+        settings_src.lines([
+            "const SettingsField& field = fields[setting_id];",
+            "for(SettingsWord local_option = 0; local_option < field.num_options; local_option++)",
+            "    if(global_options[field.first_option + local_option] == option) return local_option;",
+            "",
+            "assert(false);",
+            "return 0;",
+        ])
+    settings_src.line()
 
     # Write defaults
-    settings_src += (
-        f"Settings::Settings(const std::array<SettingsId, {len(settings)}>& compiler_settings) noexcept\n"
-        "    : compiler_settings(compiler_settings) {}\n"
-        "\n"
-        "const Settings Settings::DEFAULT_SETTINGS {{\n"
-    )
-    for compiler_setting, compiler_setting_vals in settings.items():
-        if compiler_setting_vals["default"] in compiler_setting_vals["options"]:
-            settings_src += f"        static_cast<SettingsOption>({vartitle(compiler_setting)}Option::{varupper(compiler_setting_vals['default'])}),\n"
-        else:
-            errors += f"Default {compiler_setting_vals['default']} is not an option of {compiler_setting}"
-    settings_src += (
-        "}};\n"
-        "\n"
-        "const Settings& Settings::getDefaults() noexcept { return DEFAULT_SETTINGS; }\n"
-        "\n"
-    )
+    default_words = [0] * num_words
+    for (word, shift, width), (compiler_setting, compiler_setting_vals) in zip(fields, settings.items()):
+        default_words[word] |= compiler_setting_vals["options"].index(compiler_setting_vals["default"]) << shift
+    settings_src.lines([
+        "Settings::Settings(const std::array<SettingsWord, NUM_WORDS>& compiler_settings) noexcept",
+        "    : compiler_settings(compiler_settings) {}",
+        "",
+    ])
+    with settings_src.block("const Settings Settings::DEFAULT_SETTINGS {{", "}};"):
+        for word in default_words:
+            settings_src.line(f"0x{word:X}u,")
+    settings_src.lines([
+        "",
+        "const Settings& Settings::getDefaults() noexcept { return DEFAULT_SETTINGS; }",
+        "",
+    ])
+
+    # Write read tracking, which is recorded by the getters when enabled
+    settings_src.lines([
+        "#ifdef FORSCAPE_SETTINGS_READ_TRACKING",
+        "thread_local SettingsReadTracker* SettingsReadTracker::current = nullptr;",
+        "",
+        "SettingsReadTracker::SettingsReadTracker() noexcept",
+    ])
+    with settings_src.block("    : enclosing(current) {"):
+        settings_src.line("current = this;")
+    settings_src.line()
+    with settings_src.block("SettingsReadTracker::~SettingsReadTracker() {"):
+        settings_src.lines([
+            "assert(current == this);  // Trackers are destroyed in the reverse order of construction",
+            "current = enclosing;",
+            "if(enclosing != nullptr) enclosing->read_set |= read_set;",
+        ])
+    settings_src.line()
+    with settings_src.block("const SettingsSet& SettingsReadTracker::reads() const noexcept {"):
+        settings_src.line("return read_set;")
+    settings_src.line()
+    with settings_src.block("bool SettingsReadTracker::dependsOn(const SettingsSet& changed) const noexcept {"):
+        settings_src.line("return (read_set & changed).any();")
+    settings_src.line()
+    with settings_src.block("inline void SettingsReadTracker::record(SettingsId setting_id) noexcept {"):
+        settings_src.line("SettingsReadTracker* tracker = current;")
+        settings_src.line("if(tracker != nullptr) tracker->read_set.set(setting_id);")
+    settings_src.line("#endif")
+    settings_src.line()
 
     # Write getter functions
     for idx, (compiler_setting, compiler_setting_vals) in enumerate(settings.items()):
-        settings_src += (
-            f"{vartitle(compiler_setting)}Option Settings::get{vartitle(compiler_setting)}Option() const noexcept {{\n"
-            f"    return static_cast<{vartitle(compiler_setting)}Option>(compiler_settings[{idx}]);\n"
-            "}\n\n"
-        )
-
-    settings_src += (
-        "void ScopedSettings::applyDiff(const SettingsDiffView& diff) {\n"
-        "    for(size_t i = diff.num_settings; i-->0;){\n"
-        "        const auto [setting_id, setting_value] = diff.settings[i];\n"
-        "        modified_settings.push_back({setting_id, settings.compiler_settings[setting_id]});\n"
-        "        settings.compiler_settings[setting_id] = setting_value;\n"
-        "    }\n"
-        "}\n"
-        "\n"
-        "void ScopedSettings::enterScope() {\n"
-        "    num_settings_modified_per_scope.push_back(modified_settings.size());\n"
-        "}\n"
-        "\n"
-        "void ScopedSettings::leaveScope() noexcept {\n"
-        "    assert(isScopeNested());\n"
-        "    const size_t num_settings_modified = num_settings_modified_per_scope.back();\n"
-        "    num_settings_modified_per_scope.pop_back();\n"
-        "    for(size_t i = modified_settings.size(); i --> num_settings_modified;){\n"
-        "        const auto [setting_id, setting_value] = modified_settings[i];\n"
-        "        settings.compiler_settings[setting_id] = setting_value;\n"
-        "    }\n"
-        "    modified_settings.resize(num_settings_modified);\n"
-        "}\n"
-        "\n"
-        "const Settings& ScopedSettings::getSettings() const noexcept {\n"
-        "    return settings;\n"
-        "}\n"
-        "\n"
-        "ScopedSettings::operator const Settings&() const noexcept {\n"
-        "    return getSettings();\n"
-        "}\n"
-        "\n"
-    )
+        word, shift, width = fields[idx]
+        with settings_src.block(
+            f"{vartitle(compiler_setting)}Option Settings::get{vartitle(compiler_setting)}Option() const noexcept {{",
+        ):
+            settings_src.lines([
+                "#ifdef FORSCAPE_SETTINGS_READ_TRACKING",
+                f"SettingsReadTracker::record({idx});",
+                "#endif",
+                f"const SettingsWord local_option = (compiler_settings[{word}] >> {shift}) & 0x{(1 << width) - 1:X}u;",
+                f"return static_cast<{vartitle(compiler_setting)}Option>(global_options[{first_options[idx]} + local_option]);",
+            ])
+        settings_src.line()
+
+    with settings_src.block("bool Settings::operator==(const Settings& other) const noexcept {"):
+        settings_src.line("return compiler_settings == other.compiler_settings;")
+    settings_src.line()
+    with settings_src.block("bool Settings::operator!=(const Settings& other) const noexcept {"):
+        settings_src.line("return compiler_settings != other.compiler_settings;")
+    settings_src.line()
+    with settings_src.block("SettingsSet Settings::differences(const Settings& other) const noexcept {"):
+        settings_src.line("SettingsSet changed;")
+        with settings_src.block("for(size_t i = 0; i < NUM_WORDS; i++){"):
+            settings_src.line("const SettingsWord changed_bits = compiler_settings[i] ^ other.compiler_settings[i];")
+            settings_src.line("if(changed_bits == 0) continue;")
+            with settings_src.block(
+                "for(SettingsId setting_id = word_first_setting[i]; setting_id < word_first_setting[i+1]; setting_id++){",
+            ):
+                settings_src.line("const SettingsField& field = fields[setting_id];")
+                settings_src.line("if((changed_bits >> field.shift) & field.mask) changed.set(setting_id);")
+        settings_src.line()
+        settings_src.line("return changed;")
+    settings_src.line()
+    with settings_src.block("void Settings::apply(const PackedSettingsDiff& diff) noexcept {"):
+        settings_src.line("for(size_t i = 0; i < NUM_WORDS; i++)")
+        settings_src.line("    compiler_settings[i] = (compiler_settings[i] & ~diff.mask[i]) | diff.value[i];")
+    settings_src.lines([
+        "",
+        "PackedSettingsDiff::PackedSettingsDiff() noexcept",
+        "    : mask{}, value{} {}",
+        "",
+        "PackedSettingsDiff::PackedSettingsDiff(const SettingsDiffView& diff) noexcept",
+    ])
+    with settings_src.block("    : mask{}, value{} {"):
+        with settings_src.block("for(size_t i = 0; i < diff.num_settings; i++){"):
+            settings_src.lines([
+                "const auto [setting_id, setting_value] = diff.settings[i];",
+                "const SettingsField& field = fields[setting_id];",
+                "const SettingsWord field_mask = field.mask << field.shift;",
+                "mask[field.word] |= field_mask;",
+                "value[field.word] = (value[field.word] & ~field_mask) | (localOption(setting_id, setting_value) << field.shift);",
+            ])
+    settings_src.line()
+    settings_src.line("PackedSettingsDiff::PackedSettingsDiff(const CompactSettingsDiffView& diff) noexcept")
+    with settings_src.block("    : mask{}, value{} {"):
+        with settings_src.block("for(size_t i = 0; i < diff.size(); i++){"):
+            settings_src.lines([
+                "const auto [setting_id, setting_value] = diff.get(i);",
+                "const SettingsField& field = fields[setting_id];",
+                "const SettingsWord field_mask = field.mask << field.shift;",
+                "mask[field.word] |= field_mask;",
+                "value[field.word] = (value[field.word] & ~field_mask) | (localOption(setting_id, setting_value) << field.shift);",
+            ])
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("void BasicScopedSettings<strategy>::applyDiff(const SettingsDiffView& diff) {"):
+        settings_src.line("applyDiff(PackedSettingsDiff(diff));")
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("void BasicScopedSettings<strategy>::applyDiff(const CompactSettingsDiffView& diff) {"):
+        settings_src.line("applyDiff(PackedSettingsDiff(diff));")
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("void BasicScopedSettings<strategy>::applyDiff(const PackedSettingsDiff& diff) {"):
+        with settings_src.block("if constexpr(strategy == ScopeStrategy::UNDO_LOG){"):
+            settings_src.line("PackedSettingsDiff& undo = undo_log.emplace_back();")
+            with settings_src.block("for(size_t i = 0; i < Settings::NUM_WORDS; i++){"):
+                settings_src.line("undo.mask[i] = diff.mask[i];")
+                settings_src.line("undo.value[i] = settings.compiler_settings[i] & diff.mask[i];")
+        settings_src.lines([
+            "settings.apply(diff);",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "SettingsInstrumentation::diffApplied(SettingsInstrumentation::numSettings(diff), scopes.size(), scopeBytes());",
+            "#endif",
+        ])
+    settings_src.lines([
+        "",
+        "template<ScopeStrategy strategy>",
+        "void BasicScopedSettings<strategy>::applyDiff(",
+    ])
+    with settings_src.block(
+        "        SettingsDiffHandle diff, const SettingsDiffPool& pool, ResolvedSettingsCache& cache) {",
+    ):
+        settings_src.line("const Settings& resolved = cache.resolve(settings, diff, pool);")
+        with settings_src.block("if constexpr(strategy == ScopeStrategy::UNDO_LOG){"):
+            settings_src.line("PackedSettingsDiff& undo = undo_log.emplace_back();")
+            with settings_src.block("for(size_t i = 0; i < Settings::NUM_WORDS; i++){"):
+                settings_src.line("undo.mask[i] = settings.compiler_settings[i] ^ resolved.compiler_settings[i];")
+                settings_src.line("undo.value[i] = settings.compiler_settings[i] & undo.mask[i];")
+        settings_src.lines([
+            "settings = resolved;",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "SettingsInstrumentation::diffApplied(",
+            "    SettingsInstrumentation::numSettings(pool.view(diff)), scopes.size(), scopeBytes());",
+            "#endif",
+        ])
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("void BasicScopedSettings<strategy>::enterScope() {"):
+        settings_src.lines([
+            "if constexpr(strategy == ScopeStrategy::SNAPSHOT) scopes.push_back(settings);",
+            "else scopes.push_back(undo_log.size());",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "SettingsInstrumentation::scopeEntered(scopes.size(), scopeBytes());",
+            "#endif",
+        ])
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("void BasicScopedSettings<strategy>::leaveScope() noexcept {"):
+        settings_src.line("assert(isScopeNested());")
+        settings_src.line("if constexpr(strategy == ScopeStrategy::SNAPSHOT){")
+        with settings_src.indent():
+            settings_src.line("settings = scopes.back();")
+        settings_src.line("}else{")
+        with settings_src.indent():
+            settings_src.lines([
+                "const size_t undo_log_size = scopes.back();",
+                "for(size_t i = undo_log.size(); i --> undo_log_size;)",
+                "    settings.apply(undo_log[i]);",
+                "undo_log.resize(undo_log_size);",
+            ])
+        settings_src.line("}")
+        settings_src.lines([
+            "scopes.pop_back();",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "SettingsInstrumentation::scopeLeft(scopes.size());",
+            "#endif",
+        ])
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("const Settings& BasicScopedSettings<strategy>::getSettings() const noexcept {"):
+        settings_src.line("return settings;")
+    settings_src.line()
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("BasicScopedSettings<strategy>::operator const Settings&() const noexcept {"):
+        settings_src.line("return getSettings();")
+    settings_src.line()
     for idx, (compiler_setting, compiler_setting_vals) in enumerate(settings.items()):
-        settings_src += (
-            f"{vartitle(compiler_setting)}Option ScopedSettings::get{vartitle(compiler_setting)}Option() const noexcept {{\n"
-            f"    return settings.get{vartitle(compiler_setting)}Option();\n"
-            "}\n\n"
-        )
-    settings_src += (
-        "#ifndef NDEBUG\n"
-        "bool ScopedSettings::isScopeNested() const noexcept {\n"
-        "    return !num_settings_modified_per_scope.empty();\n"
-        "}\n"
-        "#endif\n"
-        "\n"
-    )
+        settings_src.line("template<ScopeStrategy strategy>")
+        with settings_src.block(
+            f"{vartitle(compiler_setting)}Option BasicScopedSettings<strategy>::get{vartitle(compiler_setting)}Option() const noexcept {{",
+        ):
+            settings_src.line(f"return settings.get{vartitle(compiler_setting)}Option();")
+        settings_src.line()
+    settings_src.line("#ifndef NDEBUG")
+    settings_src.line("template<ScopeStrategy strategy>")
+    with settings_src.block("bool BasicScopedSettings<strategy>::isScopeNested() const noexcept {"):
+        settings_src.line("return !scopes.empty();")
+    settings_src.lines([
+        "#endif",
+        "",
+        "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+        "template<ScopeStrategy strategy>",
+    ])
+    with settings_src.block("size_t BasicScopedSettings<strategy>::scopeBytes() const noexcept {"):
+        settings_src.line("return scopes.size() * sizeof(scopes[0]) + undo_log.size() * sizeof(PackedSettingsDiff);")
+    settings_src.lines([
+        "#endif",
+        "",
+        "template struct BasicScopedSettings<ScopeStrategy::UNDO_LOG>;",
+        "template struct BasicScopedSettings<ScopeStrategy::SNAPSHOT>;",
+        "",
+        "ResolvedSettingsCache::ResolvedSettingsCache(size_t capacity)",
+        "    : capacity(capacity == 0 ? 1 : capacity) {}",
+        "",
+        "const Settings& ResolvedSettingsCache::resolve(",
+    ])
+    with settings_src.block("        const Settings& parent, SettingsDiffHandle diff, const SettingsDiffPool& pool) {"):
+        settings_src.line("const Key key = {parent.compiler_settings, diff};")
+        settings_src.line("const auto lookup = index.find(key);")
+        with settings_src.block("if(lookup != index.end()){"):
+            settings_src.lines([
+                "num_hits++;",
+                "entries.splice(entries.begin(), entries, lookup->second);",
+                "return lookup->second->second;",
+            ])
+        settings_src.line()
+        settings_src.line("num_misses++;")
+        with settings_src.block("if(entries.size() == capacity){"):
+            settings_src.line("index.erase(entries.back().first);")
+            settings_src.line("entries.pop_back();")
+        settings_src.lines([
+            "",
+            "Settings resolved = parent;",
+            "resolved.apply(PackedSettingsDiff(pool.view(diff)));",
+            "entries.emplace_front(key, resolved);",
+            "index.emplace(key, entries.begin());",
+            "",
+            "return entries.front().second;",
+        ])
+    settings_src.line()
+    with settings_src.block("void ResolvedSettingsCache::clear() noexcept {"):
+        settings_src.line("entries.clear();")
+        settings_src.line("index.clear();")
+    settings_src.line()
+    with settings_src.block("size_t ResolvedSettingsCache::size() const noexcept {"):
+        settings_src.line("return entries.size();")
+    settings_src.line()
+    with settings_src.block("size_t ResolvedSettingsCache::hits() const noexcept {"):
+        settings_src.line("return num_hits;")
+    settings_src.line()
+    with settings_src.block("size_t ResolvedSettingsCache::misses() const noexcept {"):
+        settings_src.line("return num_misses;")
+    settings_src.line()
+    with settings_src.block("bool ResolvedSettingsCache::Key::operator==(const Key& other) const noexcept {"):
+        settings_src.line("return diff == other.diff && parent == other.parent;")
+    settings_src.line()
+    with settings_src.block("size_t ResolvedSettingsCache::KeyHash::operator()(const Key& key) const noexcept {"):
+        settings_src.lines([
+            "size_t hash = key.diff;",
+            "for(const SettingsWord word : key.parent)",
+            "    hash ^= std::hash<SettingsWord>()(word) + 0x9E3779B9u + (hash << 6) + (hash >> 2);",
+            "return hash;",
+        ])
+    settings_src.line()
+    with settings_src.block("void SettingsIntervalIndex::record(size_t offset, const Settings& settings) {"):
+        settings_src.line("assert(boundaries.empty() || offset >= boundaries.back());")
+        settings_src.line()
+        settings_src.line("if(!boundaries.empty() && boundaries.back() == offset){")
+        with settings_src.indent():
+            settings_src.line("values.back() = settings;")
+            settings_src.line("coalesce(boundaries.size() - 1, boundaries.size());")
+        settings_src.line("}else if(settings != (values.empty() ? Settings::getDefaults() : values.back())){")
+        with settings_src.indent():
+            settings_src.line("boundaries.push_back(offset);")
+            settings_src.line("values.push_back(settings);")
+        settings_src.line("}")
+    settings_src.line()
+    with settings_src.block("const Settings& SettingsIntervalIndex::at(size_t offset) const noexcept {"):
+        settings_src.lines([
+            "const auto next = std::upper_bound(boundaries.cbegin(), boundaries.cend(), offset);",
+            "if(next == boundaries.cbegin()) return Settings::getDefaults();",
+            "return values[next - boundaries.cbegin() - 1];",
+        ])
+    settings_src.line()
+    settings_src.line("void SettingsIntervalIndex::replaceRange(")
+    with settings_src.block(
+        "        size_t start, size_t end, size_t length, const SettingsIntervalIndex& replacement) {",
+    ):
+        settings_src.lines([
+            "assert(start <= end);",
+            "const Settings after = at(end);",
+            "const size_t new_end = start + length;",
+            "",
+            "// Remove the boundaries of the old range, and shift the boundaries after it",
+            "const size_t first = std::lower_bound(boundaries.cbegin(), boundaries.cend(), start) - boundaries.cbegin();",
+            "const size_t last = std::lower_bound(boundaries.cbegin(), boundaries.cend(), end) - boundaries.cbegin();",
+            "boundaries.erase(boundaries.begin() + first, boundaries.begin() + last);",
+            "values.erase(values.begin() + first, values.begin() + last);",
+            "for(size_t i = first; i < boundaries.size(); i++) boundaries[i] = boundaries[i] - end + new_end;",
+            "",
+            "// The settings at the old end resume at the new end",
+        ])
+        with settings_src.block("if(first == boundaries.size() || boundaries[first] != new_end){"):
+            settings_src.line("boundaries.insert(boundaries.begin() + first, new_end);")
+            settings_src.line("values.insert(values.begin() + first, after);")
+        settings_src.lines([
+            "",
+            "// The new range begins with the settings of the replacement at its start, followed by its later boundaries",
+            "size_t num_inserted = 0;",
+        ])
+        with settings_src.block("if(length != 0){"):
+            settings_src.lines([
+                "const auto& inserted = replacement.boundaries;",
+                "const size_t inserted_begin = std::upper_bound(inserted.cbegin(), inserted.cend(), start) - inserted.cbegin();",
+                "const size_t inserted_end = std::lower_bound(inserted.cbegin(), inserted.cend(), new_end) - inserted.cbegin();",
+                "boundaries.insert(boundaries.begin() + first, start);",
+                "values.insert(values.begin() + first, replacement.at(start));",
+                "boundaries.insert(boundaries.begin() + first + 1,",
+                "    inserted.cbegin() + inserted_begin, inserted.cbegin() + inserted_end);",
+                "values.insert(values.begin() + first + 1,",
+                "    replacement.values.cbegin() + inserted_begin, replacement.values.cbegin() + inserted_end);",
+                "num_inserted = 1 + inserted_end - inserted_begin;",
+            ])
+        settings_src.line()
+        settings_src.line("coalesce(first, first + num_inserted + 1);")
+    settings_src.line()
+    with settings_src.block("void SettingsIntervalIndex::coalesce(size_t first, size_t last) {"):
+        settings_src.line("size_t kept = first;")
+        with settings_src.block("for(size_t i = first; i < last; i++){"):
+            settings_src.lines([
+                "const Settings& previous = (kept == 0) ? Settings::getDefaults() : values[kept - 1];",
+                "if(values[i] == previous) continue;",
+                "boundaries[kept] = boundaries[i];",
+                "values[kept] = values[i];",
+                "kept++;",
+            ])
+        settings_src.line("boundaries.erase(boundaries.begin() + kept, boundaries.begin() + last);")
+        settings_src.line("values.erase(values.begin() + kept, values.begin() + last);")
+    settings_src.line()
+    with settings_src.block("void SettingsIntervalIndex::clear() noexcept {"):
+        settings_src.line("boundaries.clear();")
+        settings_src.line("values.clear();")
+    settings_src.line()
+    with settings_src.block("size_t SettingsIntervalIndex::size() const noexcept {"):
+        settings_src.line("return boundaries.size();")
+    settings_src.line()
+    with settings_src.block("SettingsDiff SettingsDiff::between(const Settings& from, const Settings& to) {"):
+        settings_src.line("SettingsDiff diff;")
+        with settings_src.block("for(size_t i = 0; i < Settings::NUM_WORDS; i++){"):
+            settings_src.lines([
+                "// Only the settings of words which differ are compared",
+                "const SettingsWord changed = from.compiler_settings[i] ^ to.compiler_settings[i];",
+                "if(changed == 0) continue;",
+            ])
+            with settings_src.block(
+                "for(SettingsId setting_id = word_first_setting[i]; setting_id < word_first_setting[i+1]; setting_id++){",
+            ):
+                settings_src.lines([
+                    "const SettingsField& field = fields[setting_id];",
+                    "if(((changed >> field.shift) & field.mask) == 0) continue;",
+                    "const SettingsWord local_option = (to.compiler_settings[i] >> field.shift) & field.mask;",
+                    "diff.updates.emplace_back(setting_id, global_options[field.first_option + local_option]);",
+                ])
+        settings_src.line()
+        settings_src.line("return diff;")
+    settings_src.line()
+
+    settings_src.lines([
+        "SettingsContext::SettingsContext(std::shared_ptr<const Scope> scope) noexcept",
+        "    : scope(std::move(scope)) {}",
+        "",
+    ])
+    with settings_src.block("SettingsContext SettingsContext::withDiff(const SettingsDiffView& diff) const {"):
+        settings_src.line("return withDiff(PackedSettingsDiff(diff));")
+    settings_src.line()
+    with settings_src.block("SettingsContext SettingsContext::withDiff(const CompactSettingsDiffView& diff) const {"):
+        settings_src.line("return withDiff(PackedSettingsDiff(diff));")
+    settings_src.line()
+    with settings_src.block(
+        "SettingsContext SettingsContext::withDiff(SettingsDiffHandle diff, const SettingsDiffPool& pool) const {",
+    ):
+        settings_src.line("return withDiff(PackedSettingsDiff(pool.view(diff)));")
+    settings_src.line()
+    with settings_src.block("SettingsContext SettingsContext::withDiff(const PackedSettingsDiff& diff) const {"):
+        settings_src.lines([
+            "Settings settings = getSettings();",
+            "settings.apply(diff);",
+            "return SettingsContext(std::make_shared<const Scope>(Scope{scope, diff, settings, depth() + 1}));",
+        ])
+    settings_src.line()
+    with settings_src.block("SettingsContext SettingsContext::parent() const noexcept {"):
+        settings_src.line("assert(scope != nullptr);")
+        settings_src.line("return SettingsContext(scope->parent);")
+    settings_src.line()
+    with settings_src.block("size_t SettingsContext::depth() const noexcept {"):
+        settings_src.line("return scope == nullptr ? 0 : scope->depth;")
+    settings_src.line()
+    with settings_src.block("ScopedSettings SettingsContext::toScopedSettings() const {"):
+        settings_src.lines([
+            "std::vector<const Scope*> nested(depth());",
+            "const Scope* s = scope.get();",
+            "for(size_t i = nested.size(); i --> 0; s = s->parent.get()) nested[i] = s;",
+            "",
+            "ScopedSettings scoped;",
+        ])
+        with settings_src.block("for(const Scope* nested_scope : nested){"):
+            settings_src.line("scoped.enterScope();")
+            settings_src.line("scoped.applyDiff(nested_scope->diff);")
+        settings_src.line()
+        settings_src.line("return scoped;")
+    settings_src.line()
+    with settings_src.block("const Settings& SettingsContext::getSettings() const noexcept {"):
+        settings_src.line("return scope == nullptr ? Settings::getDefaults() : scope->settings;")
+    settings_src.line()
+    with settings_src.block("SettingsContext::operator const Settings&() const noexcept {"):
+        settings_src.line("return getSettings();")
+    settings_src.line()
+    for idx, (compiler_setting, compiler_setting_vals) in enumerate(settings.items()):
+        with settings_src.block(
+            f"{vartitle(compiler_setting)}Option SettingsContext::get{vartitle(compiler_setting)}Option() const noexcept {{",
+        ):
+            settings_src.line(f"return getSettings().get{vartitle(compiler_setting)}Option();")
+        settings_src.line()
+
+    # Write instrumentation, which is compiled only when enabled
+    settings_src.line("#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION")
+    settings_src.line("/// The counts of every thread, which are only ordered relative to each other by getSettingsCounters")
+    with settings_src.block("static struct {", "} totals;"):
+        settings_src.lines([
+            "std::atomic<size_t> diffs_applied = 0;",
+            "std::atomic<size_t> settings_applied = 0;",
+            "std::atomic<size_t> scopes_entered = 0;",
+            "std::atomic<size_t> max_scope_depth = 0;",
+            "std::atomic<size_t> max_scope_bytes = 0;",
+            "std::atomic<size_t> parse_failures = 0;",
+        ])
+    settings_src.line("static SettingsHooks hooks;")
+    settings_src.line()
+    with settings_src.block("static void raiseMax(std::atomic<size_t>& max, size_t value) noexcept {"):
+        settings_src.line("size_t previous = max.load(std::memory_order_relaxed);")
+        settings_src.line("while(previous < value && !max.compare_exchange_weak(previous, value, std::memory_order_relaxed));")
+    settings_src.line()
+    with settings_src.block("double SettingsCounters::meanDiffLength() const noexcept {"):
+        settings_src.line("return diffs_applied == 0 ? 0.0 : static_cast<double>(settings_applied) / diffs_applied;")
+    settings_src.line()
+    with settings_src.block("SettingsCounters getSettingsCounters() noexcept {"):
+        settings_src.lines([
+            "SettingsCounters counters;",
+            "counters.diffs_applied = totals.diffs_applied.load(std::memory_order_relaxed);",
+            "counters.settings_applied = totals.settings_applied.load(std::memory_order_relaxed);",
+            "counters.scopes_entered = totals.scopes_entered.load(std::memory_order_relaxed);",
+            "counters.max_scope_depth = totals.max_scope_depth.load(std::memory_order_relaxed);",
+            "counters.max_scope_bytes = totals.max_scope_bytes.load(std::memory_order_relaxed);",
+            "counters.parse_failures = totals.parse_failures.load(std::memory_order_relaxed);",
+            "return counters;",
+        ])
+    settings_src.line()
+    with settings_src.block("void resetSettingsCounters() noexcept {"):
+        settings_src.lines([
+            "for(std::atomic<size_t>* counter : {&totals.diffs_applied, &totals.settings_applied, &totals.scopes_entered,",
+            "    &totals.max_scope_depth, &totals.max_scope_bytes, &totals.parse_failures})",
+            "    counter->store(0, std::memory_order_relaxed);",
+        ])
+    settings_src.line()
+    with settings_src.block("void setSettingsHooks(const SettingsHooks& new_hooks) noexcept {"):
+        settings_src.line("hooks = new_hooks;")
+    settings_src.line()
+    with settings_src.block(
+        "void SettingsInstrumentation::diffApplied(size_t num_settings, size_t scope_depth, size_t scope_bytes) noexcept {",
+    ):
+        settings_src.lines([
+            "totals.diffs_applied.fetch_add(1, std::memory_order_relaxed);",
+            "totals.settings_applied.fetch_add(num_settings, std::memory_order_relaxed);",
+            "raiseMax(totals.max_scope_bytes, scope_bytes);",
+            "if(hooks.diff_applied != nullptr) hooks.diff_applied(num_settings, scope_depth);",
+        ])
+    settings_src.line()
+    with settings_src.block(
+        "void SettingsInstrumentation::scopeEntered(size_t scope_depth, size_t scope_bytes) noexcept {",
+    ):
+        settings_src.lines([
+            "totals.scopes_entered.fetch_add(1, std::memory_order_relaxed);",
+            "raiseMax(totals.max_scope_depth, scope_depth);",
+            "raiseMax(totals.max_scope_bytes, scope_bytes);",
+            "if(hooks.scope_entered != nullptr) hooks.scope_entered(scope_depth);",
+        ])
+    settings_src.line()
+    with settings_src.block("void SettingsInstrumentation::scopeLeft(size_t scope_depth) noexcept {"):
+        settings_src.line("if(hooks.scope_left != nullptr) hooks.scope_left(scope_depth);")
+    settings_src.line()
+    with settings_src.block(
+        "void SettingsInstrumentation::parseFailed(std::string_view str, const SettingsDiffError& error) noexcept {",
+    ):
+        settings_src.line("totals.parse_failures.fetch_add(1, std::memory_order_relaxed);")
+        settings_src.line("if(hooks.parse_failed != nullptr) hooks.parse_failed(str, error);")
+    settings_src.line()
+    with settings_src.block("size_t SettingsInstrumentation::numSettings(const PackedSettingsDiff& diff) noexcept {"):
+        settings_src.lines([
+            "size_t num_settings = 0;",
+            "for(const SettingsField& field : fields)",
+            "    num_settings += ((diff.mask[field.word] >> field.shift) & field.mask) != 0;",
+            "return num_settings;",
+        ])
+    settings_src.line()
+    with settings_src.block("size_t SettingsInstrumentation::numSettings(const SettingsDiffView& diff) noexcept {"):
+        settings_src.line("return diff.num_settings;")
+    settings_src.line("#endif")
+    settings_src.line()
 
     # Write diff serialisation
-    diff_src += (
-        f"typedef {setting_typedef} SettingsId;\n"
-        f"typedef {options_typedef} SettingsOption;\n"
-        "\n"
-        f"static constexpr std::array<std::string_view, {len(settings)}> setting_str {{\n"
-    )
-    for setting in settings:
-        diff_src += f"    \"{vartitle(setting)}\",\n"
-    diff_src += (
-        "};\n"
-        "\n"
-        f"static constexpr std::array<std::string_view, {len(options)}> option_str {{\n"
-    )
-    for option in options:
-        diff_src += f"    \"{vartitle(option)}\",\n"
-    diff_src += (
-        "};\n"
-        "\n"
-        "void SettingsDiff::writeString(std::string& out) const {\n"
-        "    bool subsequent = false;\n"
-        "    for(const auto [setting_id, setting_value] : updates){\n"
-        "        if(subsequent) out += ',';\n"
-        "        subsequent = true;\n"
-        "\n"
-        "        out += setting_str[setting_id];\n"
-        "        out += '=';\n"
-        "        out += option_str[setting_value];\n"
-        "    }\n"
-        "}\n"
-        "\n"
-    )
+    diff_src.lines([
+        f"typedef {setting_typedef} SettingsId;",
+        f"typedef {options_typedef} SettingsOption;",
+        "",
+    ])
+    with diff_src.block(f"static constexpr std::array<std::string_view, {len(settings)}> setting_str {{", "};"):
+        for setting in settings:
+            diff_src.line(f"{cpp_string(vartitle(setting))},")
+    diff_src.line()
+    with diff_src.block(f"static constexpr std::array<std::string_view, {len(options)}> option_str {{", "};"):
+        for option in options:
+            diff_src.line(f"{cpp_string(vartitle(option))},")
+    diff_src.line()
+    with diff_src.block("void SettingsDiff::writeString(std::string& out) const {"):
+        diff_src.line("bool subsequent = false;")
+        with diff_src.block("for(const auto [setting_id, setting_value] : updates){"):
+            diff_src.lines([
+                "if(subsequent) out += ',';",
+                "subsequent = true;",
+                "",
+                "out += setting_str[setting_id];",
+                "out += '=';",
+                "out += option_str[setting_value];",
+            ])
+    diff_src.line()
+    with diff_src.block("bool SettingsDiffEdit::empty() const noexcept {"):
+        diff_src.line("return length == 0 && replacement.empty();")
+    diff_src.line()
+    with diff_src.block("void SettingsDiffEdit::apply(std::string& str) const {"):
+        diff_src.line("str.replace(offset, length, replacement);")
+    diff_src.line()
+    with diff_src.block("static size_t pairLength(SettingsId setting, SettingsOption option) noexcept {"):
+        diff_src.line("return setting_str[setting].size() + 1 + option_str[option].size();")
+    diff_src.line()
+    diff_src.line("/// The offset of an update in the serialisation, or one past the end of the serialisation for the end index")
+    with diff_src.block(
+        "static size_t serialOffset(const std::vector<std::pair<SettingsId, SettingsOption>>& updates, size_t index) noexcept {",
+    ):
+        diff_src.lines([
+            "size_t offset = 0;",
+            "for(size_t i = 0; i < index; i++) offset += pairLength(updates[i].first, updates[i].second) + 1;",
+            "return offset;",
+        ])
+    diff_src.line()
+    with diff_src.block("SettingsDiffEdit SettingsDiff::setUpdate(SettingsId setting, SettingsOption option) {"):
+        diff_src.line("SettingsDiffEdit edit;")
+        diff_src.line()
+        with diff_src.block("for(size_t i = 0; i < updates.size(); i++){"):
+            diff_src.lines([
+                "if(updates[i].first != setting) continue;",
+                "",
+                "// Replace only the option of the existing pair",
+                "edit.offset = serialOffset(updates, i) + setting_str[setting].size() + 1;",
+            ])
+            with diff_src.block("if(updates[i].second != option){"):
+                diff_src.lines([
+                    "edit.length = option_str[updates[i].second].size();",
+                    "edit.replacement = option_str[option];",
+                    "updates[i].second = option;",
+                ])
+            diff_src.line("return edit;")
+        diff_src.lines([
+            "",
+            "size_t index = 0;",
+            "while(index < updates.size() && updates[index].first < setting) index++;",
+            "edit.offset = serialOffset(updates, index);",
+            "edit.replacement = setting_str[setting];",
+            "edit.replacement += '=';",
+            "edit.replacement += option_str[option];",
+        ])
+        diff_src.line("if(index < updates.size()){")
+        with diff_src.indent():
+            diff_src.line("edit.replacement += ',';")
+        diff_src.line("}else if(index != 0){")
+        with diff_src.indent():
+            diff_src.line("edit.offset--;")
+            diff_src.line("edit.replacement.insert(edit.replacement.begin(), ',');")
+        diff_src.line("}")
+        diff_src.lines([
+            "updates.insert(updates.begin() + index, std::make_pair(setting, option));",
+            "",
+            "return edit;",
+        ])
+    diff_src.line()
+    with diff_src.block("SettingsDiffEdit SettingsDiff::removeUpdate(SettingsId setting) {"):
+        diff_src.line("SettingsDiffEdit edit;")
+        diff_src.line()
+        with diff_src.block("for(size_t i = 0; i < updates.size(); i++){"):
+            diff_src.lines([
+                "if(updates[i].first != setting) continue;",
+                "",
+                "// Remove the pair with one of the commas beside it",
+                "edit.offset = serialOffset(updates, i);",
+                "edit.length = pairLength(setting, updates[i].second);",
+            ])
+            diff_src.line("if(i + 1 < updates.size()){")
+            with diff_src.indent():
+                diff_src.line("edit.length++;")
+            diff_src.line("}else if(i != 0){")
+            with diff_src.indent():
+                diff_src.line("edit.offset--;")
+                diff_src.line("edit.length++;")
+            diff_src.line("}")
+            diff_src.line("updates.erase(updates.begin() + i);")
+            diff_src.line("return edit;")
+        diff_src.lines([
+            "",
+            "edit.offset = updates.empty() ? 0 : serialOffset(updates, updates.size()) - 1;",
+            "return edit;",
+        ])
+    diff_src.line()
+    with diff_src.block("bool SettingsDiff::remove(std::string_view setting, SettingsDiffEdit& edit) {"):
+        with diff_src.block("for(size_t i = 0; i < setting_str.size(); i++){"):
+            diff_src.lines([
+                "if(setting_str[i] != setting) continue;",
+                "edit = removeUpdate(static_cast<SettingsId>(i));",
+                "return true;",
+            ])
+        diff_src.line()
+        diff_src.line("return false;")
+    diff_src.line()
 
     # Write diff deserialisation
     keys = []
-    for compiler_setting, compiler_setting_vals in settings.items():
-        for option in compiler_setting_vals["options"]:
-            key = f"{vartitle(compiler_setting)}={vartitle(option)}"
-            keys.append(key)
-
-    hash_fn, hash_str = build_perfect_hash(keys)
-    diff_src += hash_str + "\n"
-
-    perfect_hash = dict()
+    pairs = dict()
     for setting_id, (compiler_setting, compiler_setting_vals) in enumerate(settings.items()):
         for option in compiler_setting_vals["options"]:
             key = f"{vartitle(compiler_setting)}={vartitle(option)}"
-            perfect_hash[hash_fn(key)] = {"key": key, "pair": f"std::make_pair({setting_id},{options[option]['index']})"}
-
-    diff_src += (
-        "/// Combine SettingId and SettingsOption to use only 1 dictionary lookup\n"
-        "static constexpr std::array<std::string_view, 255> decoding_str_map {\n"
-    )
-    for i in range(255):
-        diff_src += f"    \"{perfect_hash[i]['key'] if i in perfect_hash else ''}\",\n"
-    diff_src += "};\n\n"
-
-    diff_src += (
-        "bool isValidSettingOptionPair(std::string_view str) noexcept {\n"
-        "    const uint8_t index = hash(str);\n"
-        "    const std::string_view lookup = decoding_str_map[index];\n"
-        "    return !lookup.empty() && lookup == str;\n"
-        "}\n"
-        "\n"
-    )
-
-    diff_src += "static constexpr std::array<std::pair<SettingsId, SettingsOption>, 255> decoding_pair {\n"
-    for i in range(255):
-        diff_src += f"    {perfect_hash[i]['pair'] if i in perfect_hash else 'std::make_pair(0,0)'},\n"
-    diff_src += "};\n\n"
-
-    diff_src += (
-        "bool SettingsDiff::isValidSerial(std::string_view str) noexcept {\n"
-        "    size_t tail = str.size();\n"
-        "    size_t index = tail-1;\n"
-        "    for(;;) {\n"
-        "        if(index == 0){\n"
-        "            return isValidSettingOptionPair(str.substr(index, tail-index));\n"
-        "        }else if(str[index] == ','){\n"
-        "            if(!isValidSettingOptionPair(str.substr(index+1, tail-(index+1)))) return false;\n"
-        "            tail = index;\n"
-        "        }\n"
-        "\n"
-        "        index--;\n"
-        "    }\n"
-        "}\n"
-        "\n"
-    )
-
-    diff_src += (
-        "SettingsDiff SettingsDiff::fromString(std::string_view str){\n"
-        "    SettingsDiff diff;\n"
-        "\n"
-        "    size_t index = 0;\n"
-        "    while(index < str.size()){\n"
-        "        const size_t start = index;\n"
-        "        while(index < str.size() && str[index] != ',') index++;\n"
-        "        const std::string_view setting_pair = str.substr(start, index-start);\n"
-        "        assert(isValidSettingOptionPair(setting_pair));\n"
-        "        diff.updates.push_back( decoding_pair[hash(setting_pair)] );\n"
-        "        index++;\n"
-        "    }\n"
-        "\n"
-        "    return diff;\n"
-        "}\n"
-        "\n"
-    )
-
-    diff_src += (
-        "SettingsDiffView SettingsDiff::view() const noexcept {\n"
-        "    SettingsDiffView v;\n"
-        "    v.num_settings = updates.size();\n"
-        "    v.settings = updates.data();\n"
-        "    return v;\n"
-        "}\n"
-        "\n"
-        "SettingsDiff::operator SettingsDiffView() const noexcept {\n"
-        "    return view();\n"
-        "}\n"
-        "\n"
-    )
-
-    diff_src += (
-        "void SettingsDiff::writeToBuffer(std::vector<size_t>& buffer) const {\n"
-        "    const size_t start = buffer.size();\n"
-        "    const size_t num_setting_updates = updates.size();\n"
-        "    const size_t num_setting_bytes = num_setting_updates * sizeof(std::pair<SettingsId, SettingsOption>);\n"
-        "    const size_t num_setting_words = num_setting_bytes / sizeof(size_t) + num_setting_bytes % sizeof(size_t) != 0;\n"
-        "    buffer.resize(start + 1 + num_setting_words);\n"
-        "    buffer[start] = num_setting_updates;\n"
-        "    std::memcpy(&buffer[start+1], updates.data(), num_setting_bytes);\n"
-        "}\n"
-        "\n"
-    )
-
-    diff_src += (
-        "SettingsDiffView SettingsDiffView::fromBuffer(const size_t* buffer) noexcept {\n"
-        "    SettingsDiffView v;\n"
-        "    v.num_settings = *buffer;\n"
-        "    v.settings = reinterpret_cast<const std::pair<SettingsId, SettingsOption>*>(buffer+1);\n"
-        "    return v;\n"
-        "}\n"
-        "\n"
-    )
+            keys.append(key)
+            pairs[key] = f"std::make_pair({setting_id},{options[option]['index']})"
 
-    settings_header += (
-        "}  // namespace Forscape\n"
-        "\n"
-        "#endif  // #ifndef FORSCAPE_SETTINGS_H\n"
-    )
+    hash_seed, bucket_seeds, slots = build_perfect_hash(keys)
+    diff_header += lookup_str(hash_seed, bucket_seeds, slots, pairs, setting_typedef, options_typedef)
+    diff_header.line("/// The number of setting=option pairs in a serialised diff")
+    with diff_header.block("constexpr size_t settingsDiffLiteralSize(std::string_view str) noexcept {"):
+        diff_header.lines([
+            "if(str.empty()) return 0;",
+            "",
+            "size_t size = 1;",
+            "for(char ch : str) size += (ch == ',');",
+            "return size;",
+        ])
+    diff_header.lines([
+        "",
+        "/// Reached when parsing an invalid diff literal. These are not constexpr, so that parsing an invalid literal",
+        "/// at compile time fails with an error naming the problem. At runtime they assert.",
+        "void settingsDiffLiteralHasEmptyPair() noexcept;",
+        "void settingsDiffLiteralHasUnknownPair() noexcept;",
+        "void settingsDiffLiteralHasDuplicateSetting() noexcept;",
+        "",
+        "/// Diff parsed from a string literal at compile time, which converts to a SettingsDiffView.",
+        "/// Create with FORSCAPE_SETTINGS_DIFF, which fails to compile if the literal is not a valid diff.",
+        "template<size_t N>",
+    ])
+    with diff_header.block("struct SettingsDiffLiteral {", "};"):
+        diff_header.line("/// Parse a serialised diff of N pairs, which is a compile error in a constant expression if the diff is invalid")
+        with diff_header.block("static constexpr SettingsDiffLiteral parse(std::string_view str) noexcept {"):
+            diff_header.lines([
+                "SettingsDiffLiteral literal;",
+                "std::array<bool, SettingsDiffBuffer::CAPACITY> specified {};",
+                "size_t start = 0;",
+            ])
+            with diff_header.block("for(size_t i = 0; i < N; i++){"):
+                diff_header.line("const size_t end = SettingsDiffScan::findDelimiterBytewise(str, start);")
+                diff_header.line("const std::string_view setting_pair = str.substr(start, end-start);")
+                with diff_header.block("if(setting_pair.empty()){"):
+                    diff_header.line("settingsDiffLiteralHasEmptyPair();")
+                    diff_header.line("return SettingsDiffLiteral();")
+                diff_header.line()
+                diff_header.line("const size_t index = SettingsPairLookup::find(setting_pair);")
+                with diff_header.block("if(index == SettingsPairLookup::NOT_FOUND){"):
+                    diff_header.line("settingsDiffLiteralHasUnknownPair();")
+                    diff_header.line("return SettingsDiffLiteral();")
+                diff_header.line()
+                diff_header.line("const auto decoded = SettingsPairLookup::decoding_pair[index];")
+                with diff_header.block("if(specified[decoded.first]){"):
+                    diff_header.line("settingsDiffLiteralHasDuplicateSetting();")
+                    diff_header.line("return SettingsDiffLiteral();")
+                diff_header.lines([
+                    "specified[decoded.first] = true;",
+                    "literal.settings[i].first = decoded.first;",
+                    "literal.settings[i].second = decoded.second;",
+                    "start = end+1;",
+                ])
+            diff_header.line()
+            diff_header.line("return literal;")
+        diff_header.lines([
+            "",
+            "constexpr size_t size() const noexcept { return N; }",
+            "",
+            "constexpr SettingsDiffView view() const noexcept { return SettingsDiffView(N, settings.data()); }",
+            "",
+            "constexpr operator SettingsDiffView() const noexcept { return view(); }",
+            "",
+        ])
+        diff_header.label("private:")
+        diff_header.lines([
+            f"typedef {setting_typedef} SettingsId;",
+            f"typedef {options_typedef} SettingsOption;",
+            "",
+            "std::array<std::pair<SettingsId, SettingsOption>, N> settings {};",
+        ])
+    diff_header.lines([
+        "",
+        "/// The diff literal of a string given by Literal::text(), which is a static constant so views of it never dangle",
+        "template<typename Literal>",
+        "inline constexpr auto settings_diff_literal =",
+        "    SettingsDiffLiteral<settingsDiffLiteralSize(Literal::text())>::parse(Literal::text());",
+        "",
+        "/// Parse a string literal into a SettingsDiffLiteral at compile time, failing to compile if it is not a valid diff.",
+        "/// The result is a reference to a static constant, so it may be kept as a SettingsDiffView.",
+        "#define FORSCAPE_SETTINGS_DIFF(str) \\",
+        "    ([]() -> const auto& { \\",
+        "        struct Literal { static constexpr std::string_view text() noexcept { return str; } }; \\",
+        "        return Forscape::settings_diff_literal<Literal>; \\",
+        "    }())",
+        "",
+    ])
 
-    if len(errors) != 0:
-        msg = "#error The codegen process had errors\n"
-        for error in errors:
-            msg += error + "\n"
-        settings_header = msg + '\n' + settings_header
+    diff_src.line("#ifdef FORSCAPE_SETTINGS_SSE2")
+    with diff_src.block("static unsigned countTrailingZeros(uint32_t x) noexcept {"):
+        diff_src.lines([
+            "assert(x != 0);",
+            "#ifdef _MSC_VER",
+            "unsigned long index;",
+            "_BitScanForward(&index, x);",
+            "return index;",
+            "#else",
+            "return __builtin_ctz(x);",
+            "#endif",
+        ])
+    diff_src.lines([
+        "#endif",
+        "",
+        "#ifdef FORSCAPE_SETTINGS_NEON",
+    ])
+    with diff_src.block("static unsigned countTrailingZeros(uint64_t x) noexcept {"):
+        diff_src.lines([
+            "assert(x != 0);",
+            "#ifdef _MSC_VER",
+            "unsigned long index;",
+            "_BitScanForward64(&index, x);",
+            "return index;",
+            "#else",
+            "return __builtin_ctzll(x);",
+            "#endif",
+        ])
+    diff_src.line("#endif")
+    diff_src.line()
+    with diff_src.block("size_t SettingsDiffScan::findDelimiter(std::string_view str, size_t start) noexcept {"):
+        diff_src.lines([
+            "const char* data = str.data();",
+            "const size_t size = str.size();",
+            "",
+            "#if defined(FORSCAPE_SETTINGS_SSE2)",
+            "const __m128i delimiters = _mm_set1_epi8(',');",
+        ])
+        with diff_src.block("for(; start + 16 <= size; start += 16){"):
+            diff_src.lines([
+                "const __m128i chunk = _mm_loadu_si128(reinterpret_cast<const __m128i*>(data + start));",
+                "const int matches = _mm_movemask_epi8(_mm_cmpeq_epi8(chunk, delimiters));",
+                "if(matches != 0) return start + countTrailingZeros(static_cast<uint32_t>(matches));",
+            ])
+        diff_src.line("#elif defined(FORSCAPE_SETTINGS_NEON)")
+        diff_src.line("const uint8x16_t delimiters = vdupq_n_u8(',');")
+        with diff_src.block("for(; start + 16 <= size; start += 16){"):
+            diff_src.lines([
+                "const uint8x16_t chunk = vld1q_u8(reinterpret_cast<const uint8_t*>(data + start));",
+                "const uint16x8_t matches = vreinterpretq_u16_u8(vceqq_u8(chunk, delimiters));",
+                "",
+                "// Narrow each byte comparison to 4 bits, since NEON lacks a byte movemask",
+                "const uint64_t mask = vget_lane_u64(vreinterpret_u64_u8(vshrn_n_u16(matches, 4)), 0);",
+                "if(mask != 0) return start + countTrailingZeros(mask) / 4;",
+            ])
+        diff_src.lines([
+            "#endif",
+            "",
+            "// Skip words without a delimiter, using the bit trick which detects a zero byte",
+        ])
+        with diff_src.block("for(; start + 8 <= size; start += 8){"):
+            diff_src.lines([
+                "uint64_t word;",
+                "memcpy(&word, data + start, sizeof(word));",
+                "const uint64_t zeroed = word ^ 0x2C2C2C2C2C2C2C2Cull;",
+                "if((zeroed - 0x0101010101010101ull) & ~zeroed & 0x8080808080808080ull) break;",
+            ])
+        diff_src.line()
+        diff_src.line("return findDelimiterBytewise(str, start);")
+    diff_src.line()
+    with diff_src.block("void settingsDiffLiteralHasEmptyPair() noexcept {"):
+        diff_src.line("assert(false);")
+    diff_src.line()
+    with diff_src.block("void settingsDiffLiteralHasUnknownPair() noexcept {"):
+        diff_src.line("assert(false);")
+    diff_src.line()
+    with diff_src.block("void settingsDiffLiteralHasDuplicateSetting() noexcept {"):
+        diff_src.line("assert(false);")
+    diff_src.line()
 
-    settings_src += (
-        "}  // namespace Forscape\n"
-    )
+    with diff_src.block(
+        "static SettingsDiffError parseError(SettingsDiffError::Code code, size_t start, size_t end) noexcept {",
+    ):
+        diff_src.lines([
+            "SettingsDiffError error;",
+            "error.code = code;",
+            "error.offset = start;",
+            "error.length = end - start;",
+            "return error;",
+        ])
+    diff_src.line()
+    diff_src.line("SettingsDiffError SettingsDiff::parsePairs(")
+    with diff_src.block(
+        "        std::string_view str, std::pair<SettingsId, SettingsOption>* out, size_t& num_settings) noexcept {",
+    ):
+        diff_src.lines([
+            "num_settings = 0;",
+            "if(str.empty()) return SettingsDiffError();",
+            "",
+            f"std::bitset<{len(settings)}> specified;",
+            "size_t start = 0;",
+        ])
+        with diff_src.block("for(;;){"):
+            diff_src.lines([
+                "const size_t end = SettingsDiffScan::findDelimiter(str, start);",
+                "const std::string_view setting_pair = str.substr(start, end-start);",
+                "if(setting_pair.empty()) return parseError(SettingsDiffError::EMPTY_PAIR, start, end);",
+                "",
+                "const size_t index = SettingsPairLookup::find(setting_pair);",
+                "if(index == SettingsPairLookup::NOT_FOUND) return parseError(SettingsDiffError::UNKNOWN_PAIR, start, end);",
+                "",
+                "const auto decoded = SettingsPairLookup::decoding_pair[index];",
+                "if(specified[decoded.first]) return parseError(SettingsDiffError::DUPLICATE_SETTING, start, end);",
+                "specified.set(decoded.first);",
+                "out[num_settings++] = decoded;",
+                "",
+                "if(end == str.size()) return SettingsDiffError();",
+                "start = end+1;",
+            ])
+    diff_src.line()
+    with diff_src.block(
+        "SettingsDiffError SettingsDiff::parse(std::string_view str, SettingsDiffBuffer& out) noexcept {",
+    ):
+        diff_src.line("return parsePairs(str, out.settings.data(), out.num_settings);")
+    diff_src.line()
+    with diff_src.block("bool SettingsDiff::isValidSerial(std::string_view str) noexcept {"):
+        diff_src.line("SettingsDiffBuffer buffer;")
+        diff_src.line("return !parse(str, buffer);")
+    diff_src.line()
+    with diff_src.block("SettingsDiff SettingsDiff::fromString(std::string_view str){"):
+        diff_src.lines([
+            "SettingsDiffError error;",
+            "SettingsDiff diff = fromString(str, error);",
+            "assert(!error);",
+            "return diff;",
+        ])
+    diff_src.line()
+    with diff_src.block("SettingsDiff SettingsDiff::fromString(std::string_view str, SettingsDiffError& error){"):
+        diff_src.lines([
+            "SettingsDiffBuffer buffer;",
+            "error = parse(str, buffer);",
+            "",
+            "#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION",
+            "if(error) SettingsInstrumentation::parseFailed(str, error);",
+            "#endif",
+            "",
+            "SettingsDiff diff;",
+            "diff.updates.assign(buffer.settings.cbegin(), buffer.settings.cbegin() + buffer.num_settings);",
+            "return diff;",
+        ])
+    diff_src.line()
+    with diff_src.block("bool SettingsDiff::set(std::string_view setting_pair, SettingsDiffEdit& edit){"):
+        diff_src.lines([
+            "const size_t index = SettingsPairLookup::find(setting_pair);",
+            "if(index == SettingsPairLookup::NOT_FOUND) return false;",
+            "",
+            "const auto [setting_id, option] = SettingsPairLookup::decoding_pair[index];",
+            "edit = setUpdate(setting_id, option);",
+            "return true;",
+        ])
+    diff_src.line()
+    diff_src.line("/// Keep the last update of each setting, sorted by setting")
+    with diff_src.block("static void canonicalUpdates(std::vector<std::pair<SettingsId, SettingsOption>>& updates) {"):
+        diff_src.lines([
+            "std::stable_sort(updates.begin(), updates.end(), [](const auto& a, const auto& b){ return a.first < b.first; });",
+            "size_t num_canonical = 0;",
+            "for(size_t i = 0; i < updates.size(); i++)",
+            "    if(i+1 == updates.size() || updates[i].first != updates[i+1].first)",
+            "        updates[num_canonical++] = updates[i];",
+            "updates.resize(num_canonical);",
+        ])
+    diff_src.line()
+    with diff_src.block("void SettingsDiff::canonicalise() {"):
+        diff_src.line("canonicalUpdates(updates);")
+    diff_src.line()
+    with diff_src.block(
+        "SettingsDiff SettingsDiff::compose(const SettingsDiffView& first, const SettingsDiffView& second) {",
+    ):
+        diff_src.lines([
+            "SettingsDiff composed;",
+            "composed.updates.reserve(first.num_settings + second.num_settings);",
+            "composed.updates.assign(first.settings, first.settings + first.num_settings);",
+            "composed.updates.insert(composed.updates.end(), second.settings, second.settings + second.num_settings);",
+            "composed.canonicalise();",
+            "return composed;",
+        ])
+    diff_src.line()
 
-    diff_src += (
-        "}  // namespace Forscape\n"
-    )
+    with diff_src.block("SettingsDiffView SettingsDiff::view() const noexcept {"):
+        diff_src.lines([
+            "SettingsDiffView v;",
+            "v.num_settings = updates.size();",
+            "v.settings = updates.data();",
+            "return v;",
+        ])
+    diff_src.line()
+    with diff_src.block("SettingsDiff::operator SettingsDiffView() const noexcept {"):
+        diff_src.line("return view();")
+    diff_src.line()
+    with diff_src.block("size_t SettingsDiffBuffer::size() const noexcept {"):
+        diff_src.line("return num_settings;")
+    diff_src.line()
+    with diff_src.block("SettingsDiffView SettingsDiffBuffer::view() const noexcept {"):
+        diff_src.lines([
+            "SettingsDiffView v;",
+            "v.num_settings = num_settings;",
+            "v.settings = settings.data();",
+            "return v;",
+        ])
+    diff_src.line()
+    with diff_src.block("SettingsDiffBuffer::operator SettingsDiffView() const noexcept {"):
+        diff_src.line("return view();")
+    diff_src.line()
 
-    os.makedirs(os.path.dirname("../src/forscape_settings.cpp"), exist_ok=True)
-    with open(f"../src/forscape_settings.cpp", "w", encoding="utf-8") as settings_src_file:
-        settings_src_file.write(settings_src)
+    with diff_src.block("void SettingsDiff::writeToBuffer(std::vector<size_t>& buffer) const {"):
+        diff_src.lines([
+            "const size_t start = buffer.size();",
+            "const size_t num_setting_updates = updates.size();",
+            "const size_t num_setting_bytes = num_setting_updates * sizeof(std::pair<SettingsId, SettingsOption>);",
+            "const size_t num_setting_words = (num_setting_bytes + sizeof(size_t) - 1) / sizeof(size_t);",
+            "buffer.resize(start + 1 + num_setting_words);",
+            "buffer[start] = num_setting_updates;",
+            "if(num_setting_bytes != 0) std::memcpy(buffer.data() + start + 1, updates.data(), num_setting_bytes);",
+        ])
+    diff_src.line()
 
-    os.makedirs(os.path.dirname("../include/forscape_settings.h"), exist_ok=True)
-    with open(f"../include/forscape_settings.h", "w", encoding="utf-8") as settings_header_file:
-        settings_header_file.write(settings_header)
+    with diff_src.block("SettingsDiffView SettingsDiffView::fromBuffer(const size_t* buffer) noexcept {"):
+        diff_src.lines([
+            "SettingsDiffView v;",
+            "v.num_settings = *buffer;",
+            "v.settings = reinterpret_cast<const std::pair<SettingsId, SettingsOption>*>(buffer+1);",
+            "return v;",
+        ])
+    diff_src.line()
 
-    with open(f"../include/forscape_settings_diff.h", "w", encoding="utf-8") as diff_header_file:
-        diff_header_file.write(diff_header)
+    # Write compact binary format
+    diff_src.lines([
+        f"static constexpr size_t COMPACT_SETTING_BITS = {compact_setting_bits};",
+        f"static constexpr size_t COMPACT_OPTION_BITS = {compact_option_bits};",
+        "static constexpr size_t COMPACT_UPDATE_BITS = COMPACT_SETTING_BITS + COMPACT_OPTION_BITS;",
+        "",
+        "/// The start of each setting's options in setting_options, followed by the end of the last setting's options",
+    ])
+    with diff_src.block(f"static constexpr std::array<uint32_t, {len(settings)+1}> setting_option_offsets {{", "};"):
+        for first_option in first_options + [len(global_options)]:
+            diff_src.line(f"{first_option},")
+    diff_src.line()
+    diff_src.line("/// The options of each setting, concatenated")
+    with diff_src.block(f"static constexpr std::array<SettingsOption, {len(global_options)}> setting_options {{", "};"):
+        for option_idx in global_options:
+            diff_src.line(f"{option_idx},")
+    diff_src.line()
+    with diff_src.block("static bool isValidUpdate(uint32_t setting_id, uint32_t option) noexcept {"):
+        diff_src.lines([
+            f"if(setting_id >= {len(settings)}) return false;",
+            "for(size_t i = setting_option_offsets[setting_id]; i < setting_option_offsets[setting_id+1]; i++)",
+            "    if(setting_options[i] == option) return true;",
+            "",
+            "return false;",
+        ])
+    diff_src.line()
+    with diff_src.block("static uint32_t readBits(const uint8_t* data, size_t bit_offset, size_t num_bits) noexcept {"):
+        diff_src.line("uint32_t value = 0;")
+        with diff_src.block("for(size_t num_read = 0; num_read < num_bits;){"):
+            diff_src.lines([
+                "const size_t bit = bit_offset + num_read;",
+                "const size_t num_chunk_bits = std::min(8 - bit % 8, num_bits - num_read);",
+                "const uint32_t chunk = (data[bit / 8] >> (bit % 8)) & ((1u << num_chunk_bits) - 1);",
+                "value |= chunk << num_read;",
+                "num_read += num_chunk_bits;",
+            ])
+        diff_src.line()
+        diff_src.line("return value;")
+    diff_src.line()
+    with diff_src.block(
+        "static void writeBits(uint8_t* data, size_t bit_offset, size_t num_bits, uint32_t value) noexcept {",
+    ):
+        with diff_src.block("for(size_t num_written = 0; num_written < num_bits;){"):
+            diff_src.lines([
+                "const size_t bit = bit_offset + num_written;",
+                "const size_t num_chunk_bits = std::min(8 - bit % 8, num_bits - num_written);",
+                "const uint32_t chunk = (value >> num_written) & ((1u << num_chunk_bits) - 1);",
+                "data[bit / 8] |= static_cast<uint8_t>(chunk << (bit % 8));",
+                "num_written += num_chunk_bits;",
+            ])
+    diff_src.line()
+    with diff_src.block("void SettingsDiff::writeCompact(std::vector<uint8_t>& buffer) const {"):
+        diff_src.lines([
+            "buffer.push_back(SETTINGS_DIFF_FORMAT_VERSION);",
+            "size_t length = updates.size();",
+            "for(; length >= 0x80; length >>= 7) buffer.push_back(static_cast<uint8_t>(length | 0x80));",
+            "buffer.push_back(static_cast<uint8_t>(length));",
+            "",
+            "const size_t start = buffer.size();",
+            "buffer.resize(start + (updates.size() * COMPACT_UPDATE_BITS + 7) / 8, 0);",
+        ])
+        with diff_src.block("for(size_t i = 0; i < updates.size(); i++){"):
+            diff_src.lines([
+                "const auto [setting_id, setting_value] = updates[i];",
+                "const uint32_t update = setting_id | (static_cast<uint32_t>(setting_value) << COMPACT_SETTING_BITS);",
+                "writeBits(buffer.data() + start, i * COMPACT_UPDATE_BITS, COMPACT_UPDATE_BITS, update);",
+            ])
+    diff_src.line()
+    with diff_src.block("SettingsDiff SettingsDiff::fromCompact(const CompactSettingsDiffView& compact) {"):
+        diff_src.lines([
+            "SettingsDiff diff;",
+            "diff.updates.resize(compact.size());",
+            "for(size_t i = 0; i < compact.size(); i++) diff.updates[i] = compact.get(i);",
+            "",
+            "return diff;",
+        ])
+    diff_src.line()
+    with diff_src.block(
+        "bool CompactSettingsDiffView::fromBytes(const uint8_t* data, size_t size, CompactSettingsDiffView& out) noexcept {",
+    ):
+        diff_src.lines([
+            "if(size == 0 || data[0] != SETTINGS_DIFF_FORMAT_VERSION) return false;",
+            "",
+            "size_t index = 1;",
+            "size_t num_settings = 0;",
+        ])
+        with diff_src.block("for(size_t shift = 0;; shift += 7){"):
+            diff_src.lines([
+                "if(index == size || shift >= 8*sizeof(size_t)) return false;",
+                "const uint8_t byte = data[index++];",
+                "num_settings |= static_cast<size_t>(byte & 0x7F) << shift;",
+                "if(byte & 0x80) continue;",
+                "if(byte == 0 && shift != 0) return false;  // Reject non-minimal lengths so the encoding is unique",
+                "break;",
+            ])
+        diff_src.lines([
+            "",
+            "const size_t num_available_bytes = size - index;",
+            "if(num_settings > num_available_bytes * 8 / COMPACT_UPDATE_BITS) return false;",
+            "const size_t num_update_bits = num_settings * COMPACT_UPDATE_BITS;",
+            "const size_t num_update_bytes = (num_update_bits + 7) / 8;",
+            "if(num_update_bits % 8 != 0 && (data[index + num_update_bytes - 1] >> (num_update_bits % 8)) != 0) return false;",
+            "",
+        ])
+        with diff_src.block("for(size_t i = 0; i < num_settings; i++){"):
+            diff_src.lines([
+                "const uint32_t update = readBits(data + index, i * COMPACT_UPDATE_BITS, COMPACT_UPDATE_BITS);",
+                "const uint32_t setting_id = update & ((1u << COMPACT_SETTING_BITS) - 1);",
+                "if(!isValidUpdate(setting_id, update >> COMPACT_SETTING_BITS)) return false;",
+            ])
+        diff_src.lines([
+            "",
+            "out.packed_updates = data + index;",
+            "out.num_settings = num_settings;",
+            "out.num_bytes = index + num_update_bytes;",
+            "return true;",
+        ])
+    diff_src.line()
+    with diff_src.block("size_t CompactSettingsDiffView::size() const noexcept {"):
+        diff_src.line("return num_settings;")
+    diff_src.line()
+    with diff_src.block("size_t CompactSettingsDiffView::numBytes() const noexcept {"):
+        diff_src.line("return num_bytes;")
+    diff_src.line()
+    diff_src.line("std::pair<CompactSettingsDiffView::SettingsId, CompactSettingsDiffView::SettingsOption>")
+    with diff_src.block("CompactSettingsDiffView::get(size_t index) const noexcept {"):
+        diff_src.lines([
+            "assert(index < num_settings);",
+            "const uint32_t update = readBits(packed_updates, index * COMPACT_UPDATE_BITS, COMPACT_UPDATE_BITS);",
+            "return std::make_pair(",
+            "    static_cast<SettingsId>(update & ((1u << COMPACT_SETTING_BITS) - 1)),",
+            "    static_cast<SettingsOption>(update >> COMPACT_SETTING_BITS));",
+        ])
+    diff_src.line()
 
-    with open(f"../src/forscape_settings_diff.cpp", "w", encoding="utf-8") as diff_src_file:
-        diff_src_file.write(diff_src)
+    with diff_src.block("SettingsDiffHandle SettingsDiffPool::intern(const SettingsDiffView& diff) {"):
+        diff_src.lines([
+            "scratch.assign(diff.settings, diff.settings + diff.num_settings);",
+            "canonicalUpdates(scratch);",
+            "",
+            "std::string key(scratch.size() * sizeof(scratch[0]), '\\0');",
+            "if(!scratch.empty()) std::memcpy(key.data(), scratch.data(), key.size());",
+            "const auto [entry, inserted] = handles.try_emplace(std::move(key), static_cast<SettingsDiffHandle>(size()));",
+        ])
+        with diff_src.block("if(inserted){"):
+            diff_src.line("updates.insert(updates.end(), scratch.cbegin(), scratch.cend());")
+            diff_src.line("offsets.push_back(static_cast<uint32_t>(updates.size()));")
+        diff_src.line()
+        diff_src.line("return entry->second;")
+    diff_src.line()
+    with diff_src.block("SettingsDiffView SettingsDiffPool::view(SettingsDiffHandle handle) const noexcept {"):
+        diff_src.lines([
+            "assert(handle < size());",
+            "SettingsDiffView v;",
+            "v.num_settings = offsets[handle+1] - offsets[handle];",
+            "v.settings = updates.data() + offsets[handle];",
+            "return v;",
+        ])
+    diff_src.line()
+    with diff_src.block("size_t SettingsDiffPool::size() const noexcept {"):
+        diff_src.line("return offsets.size() - 1;")
+    diff_src.line()
 
-    if len(errors) != 0:
-        raise Exception(f"Codegen had errors: {errors}")
+    # Write batch parsing
+    diff_src.lines([
+        "/// The length of the shortest valid setting=option pair",
+        f"static constexpr size_t MIN_PAIR_LENGTH = {min(len(key) for key in keys)};",
+        "",
+        "/// An upper bound of the pairs decoded from a string, since each is at least as long as the shortest pair",
+    ])
+    with diff_src.block("static size_t maxPairs(std::string_view str) noexcept {"):
+        diff_src.line("return std::min(SettingsDiffBuffer::CAPACITY, (str.size() + 1) / (MIN_PAIR_LENGTH + 1));")
+    diff_src.line()
+    with diff_src.block(
+        "void SettingsDiffBatch::parse(const std::string_view* strs, size_t num_strs, size_t num_threads) {",
+    ):
+        diff_src.lines([
+            "// Reserve the worst case for each string, so that ranges of strings are parsed independently",
+            "offsets.resize(num_strs + 1);",
+            "offsets[0] = 0;",
+            "for(size_t i = 0; i < num_strs; i++) offsets[i+1] = offsets[i] + maxPairs(strs[i]);",
+            "updates.resize(offsets[num_strs]);",
+            "errors.resize(num_strs);",
+            "sizes.resize(num_strs);",
+            "",
+        ])
+        with diff_src.block("const auto parseRange = [this, strs](size_t begin, size_t end) noexcept {", "};"):
+            diff_src.line("for(size_t i = begin; i < end; i++)")
+            diff_src.line("    errors[i] = SettingsDiff::parsePairs(strs[i], updates.data() + offsets[i], sizes[i]);")
+        diff_src.line()
+        diff_src.line("num_threads = std::min(num_threads, num_strs / MIN_STRINGS_PER_THREAD);")
+        diff_src.line("if(num_threads <= 1){")
+        with diff_src.indent():
+            diff_src.line("parseRange(0, num_strs);")
+        diff_src.line("}else{")
+        with diff_src.indent():
+            diff_src.lines([
+                "const size_t strs_per_thread = (num_strs + num_threads - 1) / num_threads;",
+                "std::vector<std::thread> threads;",
+                "threads.reserve(num_threads - 1);",
+                "size_t begin = strs_per_thread;",
+            ])
+            diff_src.line("try{")
+            with diff_src.indent():
+                diff_src.line("for(; begin < num_strs; begin += strs_per_thread)")
+                diff_src.line("    threads.emplace_back(parseRange, begin, std::min(begin + strs_per_thread, num_strs));")
+            diff_src.line("}catch(const std::exception&){")
+            with diff_src.indent():
+                diff_src.line("// A thread could not be started, so parse the remaining ranges on this thread")
+                diff_src.line("parseRange(begin, num_strs);")
+            diff_src.line("}")
+            diff_src.line("parseRange(0, strs_per_thread);")
+            diff_src.line("for(std::thread& thread : threads) thread.join();")
+        diff_src.line("}")
+        diff_src.lines([
+            "",
+            "// Compact the arena, so that the pairs of consecutive strings are adjacent",
+            "size_t end = 0;",
+            "num_errors = 0;",
+        ])
+        with diff_src.block("for(size_t i = 0; i < num_strs; i++){"):
+            with diff_src.block("if(offsets[i] != end){"):
+                diff_src.line("const auto start = updates.cbegin() + offsets[i];")
+                diff_src.line("std::copy(start, start + sizes[i], updates.begin() + end);")
+            diff_src.lines([
+                "offsets[i] = end;",
+                "end += sizes[i];",
+                "num_errors += static_cast<bool>(errors[i]);",
+            ])
+        diff_src.line("offsets[num_strs] = end;")
+        diff_src.line("updates.resize(end);")
+    diff_src.line()
+    with diff_src.block(
+        "void SettingsDiffBatch::parse(const std::vector<std::string_view>& strs, size_t num_threads) {",
+    ):
+        diff_src.line("parse(strs.data(), strs.size(), num_threads);")
+    diff_src.line()
+    with diff_src.block("size_t SettingsDiffBatch::size() const noexcept {"):
+        diff_src.line("return errors.size();")
+    diff_src.line()
+    with diff_src.block("SettingsDiffView SettingsDiffBatch::view(size_t index) const noexcept {"):
+        diff_src.line("assert(index < size());")
+        diff_src.line("return SettingsDiffView(offsets[index+1] - offsets[index], updates.data() + offsets[index]);")
+    diff_src.line()
+    with diff_src.block("const SettingsDiffError& SettingsDiffBatch::error(size_t index) const noexcept {"):
+        diff_src.line("assert(index < size());")
+        diff_src.line("return errors[index];")
+    diff_src.line()
+    with diff_src.block("size_t SettingsDiffBatch::numErrors() const noexcept {"):
+        diff_src.line("return num_errors;")
+    diff_src.line()
 
+    files = GeneratedFiles()
+    files.add(outputs[0], cpp_file(settings_src, includes=[["\"forscape_settings.h\""], ["<algorithm>", "<atomic>", "<cassert>"]]))
+    files.add(outputs[1], cpp_file(settings_header, guard="FORSCAPE_SETTINGS_H", includes=[[
+        "<array>", "<bitset>", "<list>", "<memory>", "<stddef.h>", "<stdint.h>", "<type_traits>", "<unordered_map>", "<vector>",
+        "\"forscape_settings_diff.h\""]]))
+    files.add(outputs[2], cpp_file(diff_src, includes=[
+        ["\"forscape_settings_diff.h\""],
+        ["\"forscape_settings.h\""],
+        ["<algorithm>", "<array>", "<bitset>", "<cassert>", "<cstring>", "<exception>", "<string_view>", "<thread>"]], preamble=(
+        "#if defined(__SSE2__) || defined(_M_X64) || (defined(_M_IX86_FP) && _M_IX86_FP >= 2)\n"
+        "#include <emmintrin.h>\n"
+        "#define FORSCAPE_SETTINGS_SSE2\n"
+        "#elif defined(__aarch64__) || defined(_M_ARM64)\n"
+        "#include <arm_neon.h>\n"
+        "#define FORSCAPE_SETTINGS_NEON\n"
+        "#endif\n"
+        "\n"
+        "#ifdef _MSC_VER\n"
+        "#include <intrin.h>\n"
+        "#endif\n"
+    )))
+    files.add(outputs[3], cpp_file(diff_header, guard="FORSCAPE_SETTINGS_DIFF_H", includes=[[
+        "<array>", "<stdint.h>", "<string>", "<string_view>", "<unordered_map>", "<vector>"]]))
 
-if __name__ == "__main__":
-    main()
+    return files
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_DIR = Path(".codegen_cache")
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    try:
+        with open(path, "rb") as file:
+            return digest(file.read())
+    except FileNotFoundError:
+        return None
+
+
+def manifest_path(name):
+    return MANIFEST_DIR / f"{name}.json"
+
+
+def load_manifest(name):
+    try:
+        with open(manifest_path(name), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_manifest(name, manifest):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with open(manifest_path(name), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+
+def input_digests(inputs):
+    return {str(path): file_digest(path) for path in inputs}
+
+
+def is_up_to_date(name, inputs, outputs):
+    """
+    Check that the inputs hash to the same values as the last generation, and that the outputs still hold the
+    content which was generated. File timestamps are irrelevant, so checkouts and cache restores don't trigger work.
+    """
+    manifest = load_manifest(name)
+    if manifest is None or manifest["inputs"] != input_digests(inputs):
+        return False
+
+    return all(file_digest(path) == manifest["outputs"].get(str(path)) for path in outputs)
+
+
+def write_outputs(name, inputs, files):
+    """
+    Write the buffered generated files, where only files whose bytes changed are touched so that dependent
+    translation units are not rebuilt. Records the manifest afterwards.
+    """
+    files.write()
+    output_digests = {str(path): digest(data) for path, data in files.items()}
+    save_manifest(name, {"inputs": input_digests(inputs), "outputs": output_digests})
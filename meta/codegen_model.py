@@ -0,0 +1,53 @@
+from collections import OrderedDict
+import json
+from math import ceil, log2
+
+
+def get_definition(path="settings_definition.json"):
+    with open(path, encoding='utf-8') as settings_def_file:
+        settings_def = json.load(settings_def_file)
+        return settings_def
+
+
+def to_snake(val):
+    return val.strip().replace(' ', '_').replace('-', '_').lower()
+
+
+class SettingsModel:
+    """
+    The settings definition with its sorted orderings, indices and typedefs, built once and shared by every emitter.
+    Only holds plain data so that it can be sent to emitters running in other processes.
+    """
+
+    def __init__(self, settings_def):
+        self.options = OrderedDict(sorted(settings_def["options"].items()))
+        self.settings = OrderedDict(sorted(settings_def["compiler_settings"].items()))
+
+        for idx, option in enumerate(self.options):
+            self.options[option]["index"] = idx
+
+        self.num_settings_bits = ceil(log2(len(self.settings)))
+        self.num_options_bits = ceil(log2(len(self.options)))
+        self.setting_typedef = "uint8_t" if self.num_settings_bits <= 8 else "uint16_t"
+        self.options_typedef = "uint8_t" if self.num_options_bits <= 8 else "uint16_t"
+
+        filters = set()
+        for setting_values in self.settings.values():
+            for category in setting_values["categories"]:
+                filters.add(category.strip().title())
+        self.filters = {filter: idx for idx, filter in enumerate(sorted(filters))}
+
+        self.colour_roles = sorted({to_snake(option_vals["colour_role"]) for option_vals in self.options.values()})
+
+        self.errors = []
+        for compiler_setting, compiler_setting_vals in self.settings.items():
+            for option in compiler_setting_vals["options"]:
+                if option not in self.options:
+                    self.errors.append(f"Option {option} was not found (from setting {compiler_setting})")
+            if compiler_setting_vals["default"] not in compiler_setting_vals["options"]:
+                self.errors.append(
+                    f"Default {compiler_setting_vals['default']} is not an option of {compiler_setting}")
+
+    def check(self):
+        if len(self.errors) != 0:
+            raise Exception(f"Codegen had errors: {self.errors}")
@@ -0,0 +1,68 @@
+import os
+import stat
+import tempfile
+
+
+def read_bytes(path):
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def default_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_atomic(path, data):
+    """
+    Write to a temporary file in the destination directory, then rename it over the destination.
+    Readers such as a concurrent compiler never observe a partially written file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.write(data)
+        mode = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else default_file_mode()
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_if_changed(path, data):
+    """Write the data unless the file already holds these exact bytes. Returns whether the file was written."""
+    if read_bytes(path) == data:
+        return False
+
+    write_atomic(path, data)
+    return True
+
+
+class GeneratedFiles:
+    """Buffer of generated file contents which are only written to disk where they differ"""
+
+    def __init__(self):
+        self.files = dict()
+
+    def add(self, path, text):
+        assert path not in self.files, f"{path} was generated twice"
+        self.files[path] = text.encode("utf-8")
+
+    def merge(self, other):
+        for path, data in other.files.items():
+            assert path not in self.files, f"{path} was generated twice"
+            self.files[path] = data
+
+    def items(self):
+        return self.files.items()
+
+    def write(self):
+        """Write all files whose content changed, preserving the timestamps of the rest. Returns the written paths."""
+        return [path for path, data in self.files.items() if write_if_changed(path, data)]
@@ -1,18 +1,15 @@
-from collections import OrderedDict
-import json
-from math import ceil, log2
-import os
+from codegen_model import to_snake
+from codegen_output import GeneratedFiles
+from codegen_writer import CodeWriter, cpp_file, cpp_string
+from math import ceil
 from pathlib import Path
 import re
 from textwrap import wrap
 import xml.etree.ElementTree as ET
 
 
-def get_definition():
-    with open('settings_definition.json', encoding='utf-8') as settings_def_file:
-        settings_def = json.load(settings_def_file)
-        return settings_def
-    
+UI_TEMPLATE = Path("forscape_settings_diff_dialog.ui")
+
 
 def grammatically_correct_title(val):
     return val.title(
@@ -20,42 +17,16 @@ def grammatically_correct_title(val):
         ).replace("To ", "to ")
 
 
-def to_snake(val):
-    return val.strip().replace(' ', '_').replace('-', '_').lower()
-
-
 def vartitle(val):
     return re.sub(r'\W+', '', val.title())
 
 
-def generate_settings(root, settings):
-    override_form = root.findall('.//layout[@name="overriddenFormLayout"]')[0]
-    for child in list(override_form):
-        override_form.remove(child)
-
-    settings_form = root.findall('.//layout[@name="inheritedFormLayout"]')[0]
-    for child in list(settings_form):
-        settings_form.remove(child)
-
-    for idx, (setting, setting_values) in enumerate(settings.items()):
-        # Label
-        label_item = ET.SubElement(settings_form, "item", {"row": f"{idx}", "column": "0"})
-        label = ET.SubElement(label_item, "widget", {"class": "QLabel", "name": f"settingLabel{idx}"})
-        label_tooltip = ET.SubElement(label, "property", {"name": "toolTip"})
-        label_tooltip_str = ET.SubElement(label_tooltip, "string")
-        label_tooltip_str.text = setting_values["brief"] + "\n\n" + '\n'.join(wrap(setting_values["long"], width=60)) + "\n\nCategories: " + str(setting_values["categories"])
-        label_text = ET.SubElement(label, "property", {"name": "text"})
-        label_text_str = ET.SubElement(label_text, "string")
-        label_text_str.text = grammatically_correct_title(setting) + ": "
-
-        # ComboBox
-        box_item = ET.SubElement(settings_form, "item", {"row": f"{idx}", "column": "1"})
-        box = ET.SubElement(box_item, "widget", {"class": "QComboBox", "name": f"settingComboBox{idx}"})
-        for option in ["Inherit", *setting_values["options"]]:
-            option_item = ET.SubElement(box, "item")
-            option_text = ET.SubElement(option_item, "property", {"name": "text"})
-            option_text_str = ET.SubElement(option_text, "string")
-            option_text_str.text = grammatically_correct_title(option)
+def clear_setting_rows(root):
+    """Remove the placeholder rows of the form, since the dialog builds a row for each setting when it is needed"""
+    for layout_name in ["overriddenFormLayout", "inheritedFormLayout"]:
+        form = root.findall(f'.//layout[@name="{layout_name}"]')[0]
+        for child in list(form):
+            form.remove(child)
 
 
 def generate_filters(root, filters):
@@ -74,20 +45,133 @@ def generate_filters(root, filters):
     filter_layout.append(spacer)
 
 
+def write_form(ui_template, filters):
+    ui = ET.parse(ui_template)
+    root = ui.getroot()
+
+    clear_setting_rows(root)
+    generate_filters(root, filters)
+
+    ET.indent(ui, space=" ", level=0)
+
+    return ET.tostring(root, encoding="UTF-8", xml_declaration=True).decode("utf-8")
+
+
+def label_tooltip(setting_values):
+    return (setting_values["brief"] + "\n\n" + '\n'.join(wrap(setting_values["long"], width=60)) +
+            "\n\nCategories: " + str(setting_values["categories"]))
+
+
+def search_words(text):
+    """Split text into lower-case words, the same way the dialog splits a search term"""
+    return re.findall(r"[^\W_]+", text.lower())
+
+
+def search_index(settings):
+    """
+    Index every suffix of the words of the title and descriptions of each setting, so that a search term matching the
+    prefix of a suffix matches anywhere within a word. Tokens are sorted by their UTF-8 bytes so the dialog can find
+    every token with a given prefix by binary search, and the settings containing the token at index i are
+    postings[posting_offsets[i]:posting_offsets[i+1]].
+    """
+    token_settings = dict()
+    for setting_idx, (setting, setting_values) in enumerate(settings.items()):
+        text = " ".join([grammatically_correct_title(setting), setting_values["brief"], setting_values["long"]])
+        for word in search_words(text):
+            for start in range(len(word)):
+                token_settings.setdefault(word[start:], set()).add(setting_idx)
+
+    tokens = sorted(token_settings, key=lambda token: token.encode("utf-8"))
+    posting_offsets = [0]
+    postings = []
+    for token in tokens:
+        postings += sorted(token_settings[token])
+        posting_offsets.append(len(postings))
+
+    return tokens, posting_offsets, postings
+
+
 def write_source_files(settings, options, categories, setting_typedef, options_typedef):
-    source_file = (
-        "#include \"forscape_settings_diff_dialog.h\"\n"
-        "#include \"ui_forscape_settings_diff_dialog.h\"\n"
-        "\n"
-        "#include \"forscape_settings.h\"\n"
-        "#include \"forscape_settings_colour_palette.h\"\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-    )
+    source_file = CodeWriter()
 
     max_options = max([len(setting["options"]) for setting in settings.values()])
 
+    # Text of the rows, which are built when first needed
+    with source_file.block(f"inline constexpr std::array<const char*, {len(settings)}> setting_labels {{", "};"):
+        for setting in settings:
+            source_file.line(f"{cpp_string(grammatically_correct_title(setting) + ': ')},")
+    source_file.line()
+
+    with source_file.block(f"inline constexpr std::array<const char*, {len(settings)}> setting_label_tooltips {{", "};"):
+        for setting_values in settings.values():
+            source_file.line(f"{cpp_string(label_tooltip(setting_values))},")
+    source_file.line()
+
+    with source_file.block(f"inline constexpr std::array<const char*, {len(options)}> option_labels {{", "};"):
+        for option in options:
+            source_file.line(f"{cpp_string(grammatically_correct_title(option))},")
+    source_file.line()
+
+    with source_file.block(f"inline constexpr std::array<const char*, {len(options)}> option_tooltips {{", "};"):
+        for option_values in options.values():
+            tooltip = cpp_string('\n'.join(wrap(option_values['description'], width=60)))
+            source_file.line(f"{tooltip},")
+    source_file.line()
+
+    with source_file.block(
+            f"inline constexpr std::array<{options_typedef}, {len(settings)}> num_setting_options {{", "};"):
+        for setting_values in settings.values():
+            source_file.line(f"{len(setting_values['options'])},")
+    source_file.line()
+
+    # Categories of each row as a bitmask of filters, split into words when there are many categories
+    category_word_bits = 32 if len(categories) <= 32 else 64
+    num_category_words = max(1, ceil(len(categories) / category_word_bits))
+    source_file.line(f"typedef uint{category_word_bits}_t SettingsCategoryWord;")
+    source_file.line(f"inline constexpr size_t SETTINGS_CATEGORY_WORD_BITS = {category_word_bits};")
+    source_file.line(f"typedef std::array<SettingsCategoryWord, {num_category_words}> SettingsCategoryMask;")
+    source_file.line()
+    with source_file.block(
+            f"inline constexpr std::array<SettingsCategoryMask, {len(settings)}> setting_categories {{{{", "}};"):
+        word_mask = (1 << category_word_bits) - 1
+        for setting_values in settings.values():
+            titles = sorted({category.strip().title() for category in setting_values["categories"]})
+            mask = sum(1 << categories[title] for title in titles)
+            words = ", ".join(f"0x{(mask >> (category_word_bits * i)) & word_mask:x}" for i in range(num_category_words))
+            source_file.line(f"{{{{{words}}}}},  // {', '.join(titles)}")
+    source_file.line()
+
+    # Search index of the words in the title and descriptions of each row
+    tokens, posting_offsets, postings = search_index(settings)
+    with source_file.block(f"inline constexpr std::array<std::string_view, {len(tokens)}> search_tokens {{", "};"):
+        for token in tokens:
+            source_file.line(f"{cpp_string(token)},")
+    source_file.line()
+
+    with source_file.block(
+            f"inline constexpr std::array<uint32_t, {len(posting_offsets)}> search_posting_offsets {{", "};"):
+        for offset in posting_offsets:
+            source_file.line(f"{offset},")
+    source_file.line()
+
+    with source_file.block(
+            f"inline constexpr std::array<{setting_typedef}, {len(postings)}> search_postings {{", "};"):
+        for setting_idx in postings:
+            source_file.line(f"{setting_idx},")
+    source_file.line()
+
+    # Palette of each option, as the member of its colour role
+    with source_file.block(f"inline constexpr std::array<SettingOptionPalette SettingsPalettes::*, {len(options)}> "
+                           "option_palettes {", "};"):
+        for option_values in options.values():
+            source_file.line(f"&SettingsPalettes::{to_snake(option_values['colour_role'])},")
+    source_file.line()
+    with source_file.block(f"static const SettingOptionPalette& optionPalette("
+                           f"const SettingsPalettes& palette, {options_typedef} option) noexcept {{"):
+        source_file.line("assert(option < option_palettes.size());")
+        source_file.line("return palette.*option_palettes[option];")
+    source_file.line()
+
     # Constructor
     source_file += (
         "SettingsDiffDialog::SettingsDiffDialog(QWidget* parent)\n"
@@ -95,21 +179,7 @@ def write_source_files(settings, options, categories, setting_typedef, options_t
         "    ui->setupUi(this);\n"
         "\n"
     )
-    for idx, setting_values in enumerate(settings.values()):
-        source_file += f"    rows[{idx}].box = ui->settingComboBox{idx};\n"
-        source_file += f"    rows[{idx}].label = ui->settingLabel{idx};\n"
-        source_file += f"    rows[{idx}].categories = {{{','.join([str(categories[category.strip().title()]) for category in setting_values['categories']])}}};\n"
-        # source_file += f"    ui->settingComboBox{idx}->setItemData(0, \"Maintain the previous setting.\", Qt::ToolTipRole);\n"
-        for option_idx, option in enumerate(setting_values["options"]):
-            option = options[option]
-            tooltip = '\\n'.join(wrap(option['description'], width=60)).replace('"', '\\"')
-            source_file += f"    ui->settingComboBox{idx}->setItemData({option_idx+1}, \"{{}}\", Qt::ToolTipRole);\n".format(tooltip)
-    source_file += '\n'
-    for idx, setting_values in enumerate(settings.values()):
-        source_file += f"    connect(ui->settingComboBox{idx}, SIGNAL(currentIndexChanged(int)), this, SLOT(updateChosenSetting()));\n"
-
     source_file += (
-        "\n"
         "    connect(ui->filterEdit, SIGNAL(textChanged(const QString&)), this, SLOT(updateFilters()));\n"
     )
     for idx in range(len(categories)):
@@ -121,25 +191,6 @@ def write_source_files(settings, options, categories, setting_typedef, options_t
         "\n"
     )
 
-    # Palette update
-    source_file += (
-        "void SettingsDiffDialog::updatePalette() {\n"
-        "    const SettingsPalettes& palette = getSettingsColourPalette();\n"
-    )
-    for setting_idx, setting_values in enumerate(settings.values()):
-        for option_idx, option in enumerate(setting_values["options"]):
-            colour = to_snake(options[option]["colour_role"])
-            source_file += (
-                f"    assert(palette.{colour}.foreground.alpha());  // Verify the palette was initialised\n"
-                f"    assert(palette.{colour}.background.alpha());  // Verify the palette was initialised\n"
-                f"    ui->settingComboBox{setting_idx}->setItemData({option_idx+1}, palette.{colour}.foreground, Qt::ItemDataRole::ForegroundRole);\n"
-                f"    ui->settingComboBox{setting_idx}->setItemData({option_idx+1}, palette.{colour}.background, Qt::ItemDataRole::BackgroundRole);\n"
-            )
-    source_file += (
-        "}\n"
-        "\n"
-    )
-
     # Maps
     source_file += (
         f"inline constexpr std::array<std::array<{options_typedef}, {max_options}>, {len(settings)}> option_local_to_global {{\n"
@@ -179,68 +230,31 @@ def write_source_files(settings, options, categories, setting_typedef, options_t
     )
 
     # Inherited settings update
-    source_file += (
-        "void SettingsDiffDialog::updateInherited(const Settings& inherited) {\n"
-    )
-    for setting_idx, (setting, setting_values) in enumerate(settings.items()):
-        source_file += (
-            f"    const int inherited{setting_idx} = 1 + optionGlobalToLocal<{setting_idx}>(static_cast<int>(inherited.get{vartitle(setting)}Option()));\n"
-            # f"    const QColor foreground_colour{setting_idx} = ui->settingComboBox{setting_idx}->itemData(inherited{setting_idx}, Qt::ItemDataRole::ForegroundRole).value<QColor>();\n"
-            # f"    ui->settingComboBox{setting_idx}->setItemData(0, foreground_colour{setting_idx}.darker(110), Qt::ItemDataRole::ForegroundRole);\n"
-            f"    const QColor background_colour{setting_idx} = ui->settingComboBox{setting_idx}->itemData(inherited{setting_idx}, Qt::ItemDataRole::BackgroundRole).value<QColor>();\n"
-            f"    ui->settingComboBox{setting_idx}->setItemData(0, background_colour{setting_idx}.lighter(150), Qt::ItemDataRole::BackgroundRole);\n"
-            f"    const QString tooltip{setting_idx} = \"Maintain the previous setting:\\n\" + \n"
-            f"        ui->settingComboBox{setting_idx}->itemData(inherited{setting_idx}, Qt::ItemDataRole::ToolTipRole).toString();\n"
-            f"    ui->settingComboBox{setting_idx}->setItemData(0, tooltip{setting_idx}, Qt::ItemDataRole::ToolTipRole);\n"
-            f"    ui->settingComboBox{setting_idx}->setItemText(0, \"Inherit - \" + ui->settingComboBox{setting_idx}->itemText(inherited{setting_idx}));\n"
-        )
-    source_file += (
-        "}\n"
-        "\n"
-    )
+    with source_file.block("void SettingsDiffDialog::updateInherited(const Settings& inherited) {"):
+        for setting_idx, setting in enumerate(settings):
+            source_file.line(f"setInherited({setting_idx}, optionGlobalToLocal<{setting_idx}>("
+                             f"static_cast<{options_typedef}>(inherited.get{vartitle(setting)}Option())));")
+    source_file.line()
 
-    source_file += (
-        "}  // namespace Forscape\n"
-    )
-
-    with open(f"../src/forscape_settings_diff_dialog_codegen.cpp", "w", encoding="utf-8") as ui_src_file:
-        ui_src_file.write(source_file)
+    return cpp_file(source_file, includes=[
+        ["\"forscape_settings_diff_dialog.h\"", "\"ui_forscape_settings_diff_dialog.h\""],
+        ["\"forscape_settings.h\"", "\"forscape_settings_colour_palette.h\""]])
 
 
 def write_header_file(settings, options, filters):
-    header_file = (
-        "#ifndef FORSCAPE_SETTING_DIFF_DIALOG_CODEGEN_H\n"
-        "#define FORSCAPE_SETTING_DIFF_DIALOG_CODEGEN_H\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-    )
+    header_file = CodeWriter()
+    header_file.lines([
+        f"#define FORSCAPE_NUM_SETTINGS {len(settings)}",
+        f"#define FORSCAPE_NUM_SETTING_FILTERS {len(filters)}",
+        "",
+    ])
 
-    header_file += (
-        f"#define FORSCAPE_NUM_SETTINGS {len(settings)}\n"
-        f"#define FORSCAPE_NUM_SETTING_FILTERS {len(filters)}\n"
-        "\n"
-    )
-
-    header_file += (
-        "}  // namespace Forscape\n"
-        "\n"
-        "#endif  // #ifndef FORSCAPE_SETTING_DIFF_DIALOG_CODEGEN_H\n"
-    )
-
-    with open(f"../include/forscape_settings_diff_dialog_codegen.h", "w", encoding="utf-8") as ui_src_file:
-        ui_src_file.write(header_file)
+    return cpp_file(header_file, guard="FORSCAPE_SETTING_DIFF_DIALOG_CODEGEN_H")
 
 
 def write_palette_header(colour_roles):
-    header_file = (
-        "#ifndef FORSCAPE_SETTING_COLOUR_PALETTE_H\n"
-        "#define FORSCAPE_SETTING_COLOUR_PALETTE_H\n"
-        "\n"
-        "#include <QColor>\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
+    header_file = CodeWriter()
+    header_file += (
         "#ifndef NDEBUG\n"
         "#define DEBUG_INIT_SETTING_OPTION_PALETTE =QColor(0, 0, 0, 0)  /* Allow detection of unitialised palettes */\n"
         "#else\n"
@@ -256,16 +270,11 @@ def write_palette_header(colour_roles):
     )
 
     # Write colour definitions
-    header_file += (
-        "/// Colours of all settings\n"
-        "struct SettingsPalettes {\n"
-    )
-    for colour_role in colour_roles:
-        header_file += f"    SettingOptionPalette {colour_role};\n"
-    header_file += (
-        "};\n"
-        "\n"
-    )
+    header_file.line("/// Colours of all settings")
+    with header_file.block("struct SettingsPalettes {", "};"):
+        for colour_role in colour_roles:
+            header_file.line(f"SettingOptionPalette {colour_role};")
+    header_file.line()
 
     header_file += (
         "/// Change the colours used to display settings\n"
@@ -274,177 +283,132 @@ def write_palette_header(colour_roles):
         "/// Get the colours used to display settings\n"
         "const SettingsPalettes& getSettingsColourPalette() noexcept;\n"
         "\n"
-    )
-
-    header_file += (
-        "}  // namespace Forscape\n"
+        "/// Get the revision of the colours, which increments whenever setSettingsColourPalette changes them.\n"
+        "/// Displays can compare revisions to skip reapplying an unchanged palette.\n"
+        "uint32_t getSettingsColourPaletteRevision() noexcept;\n"
         "\n"
-        "#endif  // #ifndef FORSCAPE_SETTING_COLOUR_PALETTE_H\n"
     )
 
-    with open(f"../include/forscape_settings_colour_palette.h", "w", encoding="utf-8") as ui_src_file:
-        ui_src_file.write(header_file)
+    return cpp_file(header_file, guard="FORSCAPE_SETTING_COLOUR_PALETTE_H", includes=[["<QColor>", "<stdint.h>"]])
 
 
-def write_palette_source(settings, options):
-    src = (
-        "#include \"forscape_settings_colour_palette.h\"\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-        "static SettingsPalettes global_palette;\n"
-        "\n"
-    )
+def write_palette_source(colour_roles):
+    src = CodeWriter()
+    src.lines(["static SettingsPalettes global_palette;", "static uint32_t global_palette_revision = 0;", ""])
 
-    src += (
-        "void setSettingsColourPalette(const SettingsPalettes& palette) noexcept {\n"
-        "    global_palette = palette;\n"
-    )
-    for setting_values in settings.values():
-        for option in setting_values["options"]:
-            colour = to_snake(options[option]["colour_role"])
-            src += (
-                f"    assert(palette.{colour}.foreground.alpha());  // Verify the palette was initialised\n"
-                f"    assert(palette.{colour}.background.alpha());  // Verify the palette was initialised\n"
-            )
-    src += "}\n\n"
-
-    src += (
-        "const SettingsPalettes& getSettingsColourPalette() noexcept {\n"
-        "    return global_palette;\n"
-        "}\n\n"
-    )
+    with src.block("static bool isSamePalette(const SettingsPalettes& a, const SettingsPalettes& b) noexcept {"):
+        comparisons = [f"a.{colour}.foreground == b.{colour}.foreground && a.{colour}.background == b.{colour}.background"
+                       for colour in colour_roles]
+        for idx, comparison in enumerate(comparisons):
+            terminator = ";" if idx == len(comparisons) - 1 else ""
+            src.line(f"return {comparison}{terminator}" if idx == 0 else f"    && {comparison}{terminator}")
+    src.line()
 
-    src += (
-        "}  // namespace Forscape\n"
-    )
+    with src.block("void setSettingsColourPalette(const SettingsPalettes& palette) noexcept {"):
+        for colour in colour_roles:
+            src.line(f"assert(palette.{colour}.foreground.alpha());  // Verify the palette was initialised")
+            src.line(f"assert(palette.{colour}.background.alpha());  // Verify the palette was initialised")
+        src.line()
+        src.line("if(isSamePalette(palette, global_palette)) return;")
+        src.line("global_palette = palette;")
+        src.line("global_palette_revision++;")
+    src.line()
 
-    with open("../src/forscape_settings_colour_palette.cpp", "w", encoding="utf-8") as ui_src_file:
-        ui_src_file.write(src)
+    with src.block("const SettingsPalettes& getSettingsColourPalette() noexcept {"):
+        src.line("return global_palette;")
+    src.line()
 
+    with src.block("uint32_t getSettingsColourPaletteRevision() noexcept {"):
+        src.line("return global_palette_revision;")
+    src.line()
 
-def write_info(settings, options, colour_roles, setting_typedef, options_typedef):
-    src = (
-        "#include <QString>\n"
-        "\n"
-        "#include \"forscape_settings_colour_palette.h\"\n"
-        "\n"
-        "namespace Forscape {\n"
-        "\n"
-    )
+    return cpp_file(src, includes=[["\"forscape_settings_colour_palette.h\""], ["<cassert>"]])
 
-    src += (
-        f"typedef {setting_typedef} SettingsId;\n"
-        f"typedef {options_typedef} SettingsOption;\n"
-        "\n"
-        f"inline constexpr std::array<QLatin1StringView, {len(settings)}> setting_text {{\n"
-    )
-    for setting in settings:
-        src += f"    QLatin1StringView(\"{grammatically_correct_title(setting)}\"),\n"
-    src += "};\n\n"
-
-    src += f"inline constexpr std::array<QLatin1StringView, {len(options)}> option_text {{\n"
-    for option in options:
-        src += f"    QLatin1StringView(\"{grammatically_correct_title(option)}\"),\n"
-    src += "};\n\n"
-
-    src += (
-        "const SettingOptionPalette& rowPalette(SettingsOption option) noexcept {\n"
-        "    switch(option){\n"
-    )
-    for option_idx, (option, option_vals) in enumerate(options.items()):
-        src += (
-            f"        case {option_idx}: return getSettingsColourPalette().{to_snake(option_vals['colour_role'])};\n"
-        )
-    src += (
-        "    }\n"
-        "}\n"
-        "\n"
-    )
+
+def write_info(settings, options, colour_roles, setting_typedef, options_typedef):
+    src = CodeWriter()
+    src.lines([
+        f"typedef {setting_typedef} SettingsId;",
+        f"typedef {options_typedef} SettingsOption;",
+        "",
+    ])
+
+    with src.block(f"inline constexpr std::array<QLatin1StringView, {len(settings)}> setting_text {{", "};"):
+        for setting in settings:
+            src.line(f"QLatin1StringView({cpp_string(grammatically_correct_title(setting))}),")
+    src.line()
+
+    with src.block(f"inline constexpr std::array<QLatin1StringView, {len(options)}> option_text {{", "};"):
+        for option in options:
+            src.line(f"QLatin1StringView({cpp_string(grammatically_correct_title(option))}),")
+    src.line()
+
+    with src.block("const SettingOptionPalette& rowPalette(SettingsOption option) noexcept {"):
+        with src.block("switch(option){"):
+            for option_idx, (option, option_vals) in enumerate(options.items()):
+                src.line(f"case {option_idx}: return getSettingsColourPalette().{to_snake(option_vals['colour_role'])};")
+    src.line()
 
     # Setting ID tooltip
-    src += (
-        f"inline constexpr std::array<QLatin1StringView, {len(settings)}> setting_tooltips {{\n"
-    )
-    for setting_vals in settings.values():
-        tooltip = setting_vals['brief'].replace('"', '\\"')
-        src += f"    QLatin1StringView(\"{tooltip}\"),\n"
-    src += "};\n\n"
+    with src.block(f"inline constexpr std::array<QLatin1StringView, {len(settings)}> setting_tooltips {{", "};"):
+        for setting_vals in settings.values():
+            src.line(f"QLatin1StringView({cpp_string(setting_vals['brief'])}),")
+    src.line()
 
     # Option tooltip
-    src += (
-        f"inline constexpr std::array<QLatin1StringView, {len(options)}> option_tooltips {{\n"
-    )
-    for option in options.values():
-        tooltip = '\\n'.join(wrap(option['description'], width=60)).replace('"', '\\"')
-        src += f"    QLatin1StringView(\"{tooltip}\"),\n"
-    src += "};\n\n"
-
-    src += (
-        "}  // namespace Forscape\n"
-    )
-
-    with open("../src/forscape_settings_info.hpp", "w", encoding="utf-8") as ui_src_file:
-        ui_src_file.write(src)
-
-
-def main():
-    inputs = [
-        Path("forscape_settings_diff_dialog.ui"),
-        Path("settings_definition.json"),
-        Path("codegen_ui.py"),
-    ]
-
-    outputs = [
-        Path("../src/forscape_settings_diff_dialog_codegen.cpp"),
-        Path("../include/forscape_settings_diff_dialog_codegen.h"),
-        Path("../src/forscape_settings_diff_dialog.ui"),
-        Path("../src/forscape_settings_colour_palette.cpp"),
-        Path("../include/forscape_settings_colour_palette.h"),
-        Path("../src/forscape_settings_info.hpp"),
+    with src.block(f"inline constexpr std::array<QLatin1StringView, {len(options)}> option_tooltips {{", "};"):
+        for option in options.values():
+            tooltip = cpp_string("\n".join(wrap(option['description'], width=60)))
+            src.line(f"QLatin1StringView({tooltip}),")
+    src.line()
+
+    return cpp_file(src, includes=[["<QString>"], ["\"forscape_settings_colour_palette.h\""]])
+
+
+def output_paths(root=Path("..")):
+    return [
+        root / "src" / "forscape_settings_diff_dialog_codegen.cpp",
+        root / "include" / "forscape_settings_diff_dialog_codegen.h",
+        root / "src" / "forscape_settings_diff_dialog.ui",
+        root / "src" / "forscape_settings_colour_palette.cpp",
+        root / "include" / "forscape_settings_colour_palette.h",
+        root / "src" / "forscape_settings_info.hpp",
     ]
 
-    if all([path.is_file() for path in outputs]) and max([os.path.getmtime(path) for path in inputs]) < min([os.path.getmtime(path) for path in outputs]):
-        print("Skipping settings UI code generation since outputs are more recent than source files")
-        return
 
-    settings_def = get_definition()
-    options = OrderedDict(sorted(settings_def["options"].items()))
-    settings = OrderedDict(sorted(settings_def["compiler_settings"].items()))
+def emit_dialog(model, root):
+    """Emit the generated part of the diff dialog, returning the unwritten files"""
+    outputs = output_paths(root)
+    files = GeneratedFiles()
+    files.add(outputs[0], write_source_files(
+        model.settings, model.options, model.filters, model.setting_typedef, model.options_typedef))
+    files.add(outputs[1], write_header_file(model.settings, model.options, model.filters))
 
-    num_settings_bits = ceil(log2(len(settings)))
-    num_options_bits = ceil(log2(len(options)))
-    setting_typedef = "uint8_t" if num_settings_bits <= 8 else "uint16_t"
-    options_typedef = "uint8_t" if num_options_bits <= 8 else "uint16_t"
+    return files
 
-    for idx, option in enumerate(options):
-        options[option]["index"] = idx
 
-    filters = set()
-    for setting_values in settings.values():
-        for category in setting_values["categories"]:
-            filters.add(category.strip().title())
-    filters = {filter: idx for idx, filter in enumerate(sorted(list(filters)))}
+def emit_form(model, root):
+    """Emit the .ui form of the diff dialog with a filter per category, returning the unwritten file"""
+    files = GeneratedFiles()
+    files.add(output_paths(root)[2], write_form(UI_TEMPLATE, model.filters))
 
-    colour_roles = set()
-    for option_vals in options.values():
-        colour_roles.add(to_snake(option_vals["colour_role"]))
+    return files
 
-    ui = ET.parse('forscape_settings_diff_dialog.ui')
-    root = ui.getroot()
 
-    generate_settings(root, settings)
-    generate_filters(root, filters)
+def emit_palette(model, root):
+    """Emit the colour palette of the setting options, returning the unwritten files"""
+    outputs = output_paths(root)
+    files = GeneratedFiles()
+    files.add(outputs[3], write_palette_source(model.colour_roles))
+    files.add(outputs[4], write_palette_header(model.colour_roles))
 
-    ET.indent(ui, space=" ", level=0)
-    ui.write("../src/forscape_settings_diff_dialog.ui", encoding="UTF-8", xml_declaration=True)
+    return files
 
-    write_source_files(settings, options, filters, setting_typedef, options_typedef)
-    write_header_file(settings, options, filters)
-    write_palette_header(colour_roles)
-    write_palette_source(settings, options)
-    write_info(settings, options, colour_roles, setting_typedef, options_typedef)
 
+def emit_info(model, root):
+    """Emit the display text and colour roles of settings, returning the unwritten file"""
+    files = GeneratedFiles()
+    files.add(output_paths(root)[5], write_info(
+        model.settings, model.options, model.colour_roles, model.setting_typedef, model.options_typedef))
 
-if __name__ == "__main__":
-    main()
+    return files
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+
+
+INDENT = "    "
+
+
+class CodeWriter:
+    """
+    Accumulates generated text as a list of chunks which are joined once when the file is complete, so emission time
+    is linear in the size of the output. Text is appended with +=, or as indented lines with line() and block().
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.depth = 0
+
+    def __iadd__(self, text):
+        if isinstance(text, CodeWriter):
+            self.chunks += text.chunks
+        else:
+            self.chunks.append(text)
+        return self
+
+    def line(self, text=""):
+        """Write a line indented to the depth of the enclosing blocks"""
+        self.chunks.append(f"{INDENT * self.depth}{text}\n" if text else "\n")
+
+    def lines(self, texts):
+        for text in texts:
+            self.line(text)
+
+    def label(self, text):
+        """Write a line one level shallower than the enclosing block, such as an access specifier"""
+        self.chunks.append(f"{INDENT * (self.depth - 1)}{text}\n")
+
+    @contextmanager
+    def indent(self):
+        """Indent every line written in the context by one level"""
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+
+    @contextmanager
+    def block(self, opening, closing="}"):
+        """Write the opening line, then indent every line until the closing line"""
+        self.line(opening)
+        with self.indent():
+            yield self
+        self.line(closing)
+
+    def text(self):
+        return "".join(self.chunks)
+
+
+def cpp_string(text):
+    """Quote text as a C++ string literal"""
+    escaped = text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return f"\"{escaped}\""
+
+
+def cpp_file(body, includes=(), guard=None, preamble=None):
+    """
+    Template of a generated C++ file: an optional include guard, groups of includes separated by blank lines,
+    an optional preamble such as conditional includes, and the body inside the Forscape namespace.
+    """
+    out = CodeWriter()
+    if guard is not None:
+        out += f"#ifndef {guard}\n#define {guard}\n\n"
+    for group in includes:
+        for include in group:
+            out += f"#include {include}\n"
+        out += "\n"
+    if preamble is not None:
+        out += preamble
+        out += "\n"
+    out += "namespace Forscape {\n\n"
+    out += body
+    out += "}  // namespace Forscape\n"
+    if guard is not None:
+        out += f"\n#endif  // #ifndef {guard}\n"
+
+    return out.text()
@@ -0,0 +1,69 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import codegen
+import codegen_cache
+from codegen_model import SettingsModel, get_definition
+from codegen_output import GeneratedFiles
+import codegen_ui
+
+
+# Every emitter takes the shared model and the root directory of the outputs, and returns the unwritten files.
+# Emitters are independent of each other, so they may run concurrently.
+EMITTERS = {
+    "settings": codegen.emit_settings,
+    "dialog": codegen_ui.emit_dialog,
+    "form": codegen_ui.emit_form,
+    "palette": codegen_ui.emit_palette,
+    "info": codegen_ui.emit_info,
+}
+
+
+def run_emitters(model, root, jobs):
+    """Run every emitter, in a pool of worker processes when more than one job is allowed"""
+    files = GeneratedFiles()
+    if jobs <= 1:
+        for emitter in EMITTERS.values():
+            files.merge(emitter(model, root))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(EMITTERS))) as executor:
+            futures = [executor.submit(emitter, model, root) for emitter in EMITTERS.values()]
+            for future in futures:
+                files.merge(future.result())
+
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the settings library and its Qt layer")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes running the emitters, which only pays off for large "
+                             "definitions (default: 1, running every emitter in this interpreter)")
+    args = parser.parse_args()
+
+    inputs = [
+        Path("settings_definition.json"),
+        codegen_ui.UI_TEMPLATE,
+        Path("generate.py"),
+        Path("codegen.py"),
+        Path("codegen_ui.py"),
+        Path("codegen_cache.py"),
+        Path("codegen_model.py"),
+        Path("codegen_writer.py"),
+        Path("codegen_output.py"),
+    ]
+
+    outputs = codegen.output_paths() + codegen_ui.output_paths()
+
+    if codegen_cache.is_up_to_date("generate", inputs, outputs):
+        print("Skipping settings code generation since source files and outputs are unchanged")
+        return
+
+    model = SettingsModel(get_definition())
+    model.check()
+    codegen_cache.write_outputs("generate", inputs, run_emitters(model, Path(".."), args.jobs))
+
+
+if __name__ == "__main__":
+    main()
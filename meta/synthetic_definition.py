@@ -0,0 +1,57 @@
+import argparse
+import json
+import random
+
+
+COLOUR_ROLES = ["ignore", "warn", "error", "allow", "semi-allow"]
+
+
+def synthetic_definition(num_settings, num_options, options_per_setting=4, num_categories=None, seed=0):
+    """
+    Generate a settings definition in the format of settings_definition.json with arbitrarily many settings and
+    options, so the generators can be exercised at sizes beyond the real definition.
+    """
+    assert num_options >= options_per_setting >= 2
+    rng = random.Random(seed)
+    if num_categories is None:
+        num_categories = max(1, num_settings // 20)
+    categories = [f"category {i}" for i in range(num_categories)]
+
+    options = dict()
+    for i in range(num_options):
+        options[f"option {i}"] = {
+            "colour_role": rng.choice(COLOUR_ROLES),
+            "description": f"Synthetic option {i} used to benchmark code generation."
+        }
+
+    compiler_settings = dict()
+    option_names = list(options)
+    for i in range(num_settings):
+        setting_options = rng.sample(option_names, options_per_setting)
+        compiler_settings[f"setting {i}"] = {
+            "options": setting_options,
+            "default": rng.choice(setting_options),
+            "brief": f"Synthetic setting {i}",
+            "long": f"Synthetic setting {i} used to benchmark code generation.",
+            "categories": rng.sample(categories, min(len(categories), 1 + rng.randrange(2)))
+        }
+
+    return {"options": options, "compiler_settings": compiler_settings, "runtime_settings": {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic settings definition")
+    parser.add_argument("output", help="path of the JSON file to write")
+    parser.add_argument("--settings", type=int, default=500, help="number of compiler settings")
+    parser.add_argument("--options", type=int, default=2000, help="number of distinct options")
+    parser.add_argument("--options-per-setting", type=int, default=4, help="number of options of each setting")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    args = parser.parse_args()
+
+    settings_def = synthetic_definition(args.settings, args.options, args.options_per_setting, seed=args.seed)
+    with open(args.output, "w", encoding="utf-8") as settings_def_file:
+        json.dump(settings_def, settings_def_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,42 @@
 #include "forscape_settings_diff.h"
 #include "forscape_settings_diff_dialog_codegen.cpp"
 
+#include <QComboBox>
+#include <QFormLayout>
+#include <QLabel>
+#include <QTimer>
+#include <algorithm>
+#include <string_view>
+
 namespace Forscape {
 
+/// The number of rows built at once, so the dialog stays responsive while rows are built
+static constexpr size_t ROWS_PER_BATCH = 32;
+
 SettingsDiffDialog* SettingsDiffDialog::instance = nullptr;
 
 int SettingsDiffDialog::exec(const Settings& inherited, SettingsDiff& diff) {
+    std::vector<SettingsDiffEdit> edits;
+    return exec(inherited, diff, edits);
+}
+
+int SettingsDiffDialog::exec(const Settings& inherited, SettingsDiff& diff, std::vector<SettingsDiffEdit>& edits) {
     SettingsDiffDialog& dialog = getDialog();
     dialog.updatePalette();
     dialog.updateInherited(inherited);
     dialog.updateDiff(diff);
+    if(!dialog.build_scheduled) dialog.buildPendingRows();
 
     const auto user_response = dialog.QDialog::exec();
     if(user_response != QDialog::Accepted) return user_response;
 
-    diff.updates.clear();
+    edits.clear();
     for(size_t i = 0; i < dialog.rows.size(); i++){
-        const auto row = dialog.rows[i];
-        const auto index = row.box->currentIndex();
-        if(index != 0) diff.updates.push_back({i, option_local_to_global[i][index-1]});
+        const auto index = dialog.rows[i].chosen;
+        const SettingsDiffEdit edit = (index == 0) ?
+            diff.removeUpdate(i) :
+            diff.setUpdate(i, option_local_to_global[i][index-1]);
+        if(!edit.empty()) edits.push_back(edit);
     }
 
     return user_response;
@@ -36,31 +54,119 @@ SettingsDiffDialog::~SettingsDiffDialog() {
     delete ui;
 }
 
+void SettingsDiffDialog::updatePalette() {
+    const uint32_t revision = getSettingsColourPaletteRevision();
+    if(revision == palette_revision) return;
+    palette_revision = revision;
+
+    for(size_t i = 0; i < rows.size(); i++){
+        if(rows[i].box == nullptr) continue;
+        applyPalette(i);
+        applyInherited(i);
+        applyStyle(i);
+    }
+}
+
 void SettingsDiffDialog::updateDiff(const SettingsDiff& diff) {
-    for(const auto entry : diff.updates){
-        const auto& row = rows[entry.first];
-        row.box->setCurrentIndex(1 + optionGlobalToLocal(entry.first, entry.second));
+    std::vector<int> chosen(rows.size(), 0);
+    for(const auto entry : diff.updates)
+        chosen[entry.first] = 1 + optionGlobalToLocal(entry.first, entry.second);
+
+    for(size_t i = 0; i < rows.size(); i++){
+        RowInfo& row = rows[i];
+        if(row.chosen == chosen[i]) continue;
+
+        if(row.box != nullptr){
+            row.box->setCurrentIndex(chosen[i]);
+        }else{
+            // Overridden settings are shown first, so they are built immediately
+            row.chosen = chosen[i];
+            if(row.chosen != 0) buildRow(i);
+        }
     }
+}
 
-    for(const auto& row : rows) {
-        row.box->setToolTip(row.box->itemData(row.box->currentIndex(), Qt::ItemDataRole::ToolTipRole).toString());
+void SettingsDiffDialog::setInherited(size_t setting, int option) {
+    RowInfo& row = rows[setting];
+    if(row.inherited == option) return;
+    row.inherited = option;
 
-        QPalette palette = row.box->palette();
+    if(row.box == nullptr) return;
+    applyInherited(setting);
+    if(row.chosen == 0) applyStyle(setting);
+}
+
+void SettingsDiffDialog::buildRow(size_t setting) {
+    RowInfo& row = rows[setting];
+    assert(row.box == nullptr);
+
+    row.label = new QLabel(QString::fromUtf8(setting_labels[setting]), this);
+    row.label->setToolTip(QString::fromUtf8(setting_label_tooltips[setting]));
 
-        const QColor background = row.box->itemData(row.box->currentIndex(), Qt::ItemDataRole::BackgroundRole).value<QColor>();
-        // The commented line is not effective on all platforms; use style sheet
-        // palette.setColor(row.box->backgroundRole(), background);
-        row.box->setStyleSheet("QComboBox { background: " + background.name() + "; }");
+    row.box = new QComboBox(this);
+    row.box->addItem(QString());
+    for(int i = 0; i < num_setting_options[setting]; i++){
+        const auto option = option_local_to_global[setting][i];
+        row.box->addItem(QString::fromUtf8(option_labels[option]));
+        row.box->setItemData(i+1, QString::fromUtf8(option_tooltips[option]), Qt::ToolTipRole);
+    }
+    applyPalette(setting);
+    applyInherited(setting);
+    row.box->setCurrentIndex(row.chosen);
+    applyStyle(setting);
+
+    const bool visible = visible_rows.test(setting);
+    row.label->setVisible(visible);
+    row.box->setVisible(visible);
+    placeRow(setting);
 
-        const QColor foreground = row.box->itemData(row.box->currentIndex(), Qt::ItemDataRole::ForegroundRole).value<QColor>();
-        palette.setColor(QPalette::ColorRole::Text, foreground);
+    connect(row.box, &QComboBox::currentIndexChanged, this, [this, setting](int index){
+        updateChosenSetting(setting, index);
+    });
+}
+
+void SettingsDiffDialog::buildPendingRows() {
+    build_scheduled = false;
+
+    size_t num_built = 0;
+    for(; next_unbuilt < rows.size() && num_built < ROWS_PER_BATCH; next_unbuilt++){
+        if(rows[next_unbuilt].box != nullptr) continue;
+        buildRow(next_unbuilt);
+        num_built++;
+    }
+
+    if(next_unbuilt < rows.size()){
+        build_scheduled = true;
+        QTimer::singleShot(0, this, &SettingsDiffDialog::buildPendingRows);
+    }
+}
 
-        row.box->setPalette(palette);
+void SettingsDiffDialog::applyPalette(size_t setting) {
+    const SettingsPalettes& palette = getSettingsColourPalette();
+    QComboBox* box = rows[setting].box;
+    for(int i = 1; i < box->count(); i++){
+        const SettingOptionPalette& colours = optionPalette(palette, option_local_to_global[setting][i-1]);
+        assert(colours.foreground.alpha());  // Verify the palette was initialised
+        assert(colours.background.alpha());  // Verify the palette was initialised
+        box->setItemData(i, colours.foreground, Qt::ItemDataRole::ForegroundRole);
+        box->setItemData(i, colours.background, Qt::ItemDataRole::BackgroundRole);
     }
 }
 
-void SettingsDiffDialog::updateChosenSetting() {
-    QComboBox* combo_box = reinterpret_cast<QComboBox*>(sender());
+void SettingsDiffDialog::applyInherited(size_t setting) {
+    const RowInfo& row = rows[setting];
+    const int inherited = 1 + row.inherited;
+
+    const QColor background = row.box->itemData(inherited, Qt::ItemDataRole::BackgroundRole).value<QColor>();
+    row.box->setItemData(0, background.lighter(150), Qt::ItemDataRole::BackgroundRole);
+    const QString tooltip = "Maintain the previous setting:\n" +
+        row.box->itemData(inherited, Qt::ItemDataRole::ToolTipRole).toString();
+    row.box->setItemData(0, tooltip, Qt::ItemDataRole::ToolTipRole);
+    row.box->setItemText(0, "Inherit - " + row.box->itemText(inherited));
+}
+
+void SettingsDiffDialog::applyStyle(size_t setting) {
+    QComboBox* combo_box = rows[setting].box;
     const auto current_index = combo_box->currentIndex();
 
     combo_box->setToolTip(combo_box->itemData(current_index, Qt::ItemDataRole::ToolTipRole).toString());
@@ -76,48 +182,96 @@ void SettingsDiffDialog::updateChosenSetting() {
     palette.setColor(QPalette::ColorRole::Text, foreground);
 
     combo_box->setPalette(palette);
+}
 
-    size_t index = 0;
-    ui->inheritedFormLayout->insertRow(index++, ui->overriddenLabel);
-    for(const auto& row : rows){
-        if(row.box->currentIndex() == 0) continue;
-        ui->inheritedFormLayout->insertRow(index++, row.label, row.box);
-        index++;
-    }
-    ui->inheritedFormLayout->insertRow(index++, ui->inheritedLabel);
-    for(const auto& row : rows){
-        if(row.box->currentIndex() != 0) continue;
-        ui->inheritedFormLayout->insertRow(index++, row.label, row.box);
-        index++;
-    }
+void SettingsDiffDialog::placeRow(size_t setting) {
+    const RowInfo& row = rows[setting];
+    const bool overridden = (row.chosen != 0);
+    auto& placed = overridden ? overridden_rows : inherited_rows;
+    QFormLayout* layout = overridden ? ui->overriddenFormLayout : ui->inheritedFormLayout;
+
+    // Sections are sorted by setting, so the row follows every placed row of a lower setting in its section
+    const int position = static_cast<int>((placed << (placed.size() - setting)).count());
+    layout->insertRow(position, row.label, row.box);
+    placed.set(setting);
 }
 
-void SettingsDiffDialog::updateFilters() {
-    for(const auto& row : rows){
-        row.box->setVisible(true);
-        row.label->setVisible(true);
-    }
+void SettingsDiffDialog::unplaceRow(size_t setting) {
+    const RowInfo& row = rows[setting];
+    const bool overridden = overridden_rows.test(setting);
+    QFormLayout* layout = overridden ? ui->overriddenFormLayout : ui->inheritedFormLayout;
+    (overridden ? overridden_rows : inherited_rows).reset(setting);
+
+    // Taking the row releases the layout items without deleting the widgets
+    const QFormLayout::TakeRowResult taken = layout->takeRow(row.box);
+    delete taken.labelItem;
+    delete taken.fieldItem;
+}
 
-    const QString search_term = ui->filterEdit->text();
-    if(!search_term.isEmpty()){
-        for(const auto& row : rows){
-            const bool contains_term = row.label->text().contains(search_term, Qt::CaseInsensitive);
-            row.box->setVisible(contains_term);
-            row.label->setVisible(contains_term);
+void SettingsDiffDialog::updateChosenSetting(size_t setting, int index) {
+    RowInfo& row = rows[setting];
+    const bool was_overridden = (row.chosen != 0);
+    row.chosen = index;
+    applyStyle(setting);
+
+    // Only a row which changes section moves, leaving the other rows in place
+    if(was_overridden == (index != 0)) return;
+    unplaceRow(setting);
+    placeRow(setting);
+}
+
+SettingsDiffDialog::RowSet SettingsDiffDialog::searchRows(const QString& search_term) {
+    RowSet matches;
+    matches.set();
+
+    const QString lower_term = search_term.toLower();
+    for(qsizetype start = 0; start < lower_term.size();){
+        if(!lower_term[start].isLetterOrNumber()){
+            start++;
+            continue;
+        }
+        qsizetype end = start + 1;
+        while(end < lower_term.size() && lower_term[end].isLetterOrNumber()) end++;
+        const QByteArray word = lower_term.sliced(start, end - start).toUtf8();
+        const std::string_view prefix(word.constData(), static_cast<size_t>(word.size()));
+        start = end;
+
+        // Tokens are the sorted suffixes of words, so the tokens starting with the search word follow the first token
+        // not less than it, and they come from every word containing the search word
+        RowSet word_matches;
+        for(auto token = std::lower_bound(search_tokens.cbegin(), search_tokens.cend(), prefix);
+            token != search_tokens.cend() && token->substr(0, prefix.size()) == prefix; token++){
+            const size_t index = static_cast<size_t>(token - search_tokens.cbegin());
+            for(uint32_t i = search_posting_offsets[index]; i < search_posting_offsets[index+1]; i++)
+                word_matches.set(search_postings[i]);
         }
+        matches &= word_matches;
     }
 
-    for(size_t i = 0; i < filters.size(); i++){
-        const QCheckBox* filter = filters[i];
-        if(!filter->isChecked()) continue;
+    return matches;
+}
 
-        for(const auto& row : rows){
-            const bool contains_category = row.categories.cend() !=
-                std::find(row.categories.cbegin(), row.categories.cend(), i);
-            if(contains_category) continue;
-            row.box->setVisible(false);
-            row.label->setVisible(false);
-        }
+void SettingsDiffDialog::updateFilters() {
+    SettingsCategoryMask required {};
+    for(size_t i = 0; i < filters.size(); i++)
+        if(filters[i]->isChecked())
+            required[i / SETTINGS_CATEGORY_WORD_BITS] |= SettingsCategoryWord(1) << (i % SETTINGS_CATEGORY_WORD_BITS);
+
+    RowSet visible = searchRows(ui->filterEdit->text());
+    if(required != SettingsCategoryMask{})
+        for(size_t i = 0; i < rows.size(); i++)
+            for(size_t word = 0; word < required.size(); word++)
+                if((setting_categories[i][word] & required[word]) != required[word]) visible.reset(i);
+
+    // Only rows whose visibility changes are touched
+    const RowSet changed = visible ^ visible_rows;
+    visible_rows = visible;
+    if(changed.none()) return;
+    for(size_t i = 0; i < rows.size(); i++){
+        const auto& row = rows[i];
+        if(!changed.test(i) || row.box == nullptr) continue;
+        row.box->setVisible(visible.test(i));
+        row.label->setVisible(visible.test(i));
     }
 }
 
@@ -0,0 +1,79 @@
+#include <catch2/benchmark/catch_benchmark.hpp>
+#include <catch2/catch_test_macros.hpp>
+
+#include <random>
+#include <string>
+#include "forscape_settings.h"
+#include "forscape_settings_diff.h"
+
+using namespace Forscape;
+
+enum class ScopeEvent : uint8_t { ENTER, APPLY, LEAVE };
+
+/// A walk of a parse tree with nested scopes, where some scopes apply a diff
+static std::vector<ScopeEvent> scopeTrace(size_t max_depth, size_t num_scopes, double diff_probability) {
+    std::mt19937 rng(0);
+    std::bernoulli_distribution descend(0.6);
+    std::bernoulli_distribution apply(diff_probability);
+
+    std::vector<ScopeEvent> trace;
+    size_t depth = 0;
+    for(size_t i = 0; i < num_scopes; i++){
+        while(depth > 0 && (depth == max_depth || !descend(rng))){
+            trace.push_back(ScopeEvent::LEAVE);
+            depth--;
+        }
+        trace.push_back(ScopeEvent::ENTER);
+        depth++;
+        if(apply(rng)) trace.push_back(ScopeEvent::APPLY);
+    }
+    trace.insert(trace.end(), depth, ScopeEvent::LEAVE);
+
+    return trace;
+}
+
+static std::vector<PackedSettingsDiff> benchmarkDiffs() {
+    std::vector<PackedSettingsDiff> diffs;
+    for(const std::string_view diff : {
+            "UnusedVariable=Error",
+            "ImplicitMultiplication=SpaceDelineated,ZeroToZeroPower=One",
+            "IrrationalConversion=FullSymbolic,RationalConversion=ArbitraryPrecision,ImplicitSymbolDeclaration=Allow",
+            "UnusedVariable=Ignore,ScopeShadowing=Warn"})
+        diffs.emplace_back(SettingsDiff::fromString(diff));
+
+    return diffs;
+}
+
+template<typename ScopedSettingsType>
+static size_t replay(const std::vector<ScopeEvent>& trace, const std::vector<PackedSettingsDiff>& diffs) {
+    ScopedSettingsType settings;
+    size_t num_errors = 0;
+    size_t diff_index = 0;
+    for(const ScopeEvent event : trace){
+        switch(event){
+            case ScopeEvent::ENTER: settings.enterScope(); break;
+            case ScopeEvent::APPLY: settings.applyDiff(diffs[diff_index++ % diffs.size()]); break;
+            case ScopeEvent::LEAVE: settings.leaveScope(); break;
+        }
+        num_errors += settings.getUnusedVariableOption() == UnusedVariableOption::ERROR;
+    }
+
+    return num_errors;
+}
+
+TEST_CASE( "Scope strategies" ) {
+    const std::vector<PackedSettingsDiff> diffs = benchmarkDiffs();
+
+    for(const size_t max_depth : {4, 32, 1024}){
+        const std::vector<ScopeEvent> trace = scopeTrace(max_depth, 100000, 0.3);
+        REQUIRE(replay<UndoLogScopedSettings>(trace, diffs) == replay<SnapshotScopedSettings>(trace, diffs));
+
+        BENCHMARK("Undo log, max depth " + std::to_string(max_depth)) {
+            return replay<UndoLogScopedSettings>(trace, diffs);
+        };
+
+        BENCHMARK("Snapshot, max depth " + std::to_string(max_depth)) {
+            return replay<SnapshotScopedSettings>(trace, diffs);
+        };
+    }
+}
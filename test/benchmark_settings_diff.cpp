@@ -0,0 +1,232 @@
+#include <catch2/benchmark/catch_benchmark.hpp>
+#include <catch2/catch_test_macros.hpp>
+
+#include <algorithm>
+#include <random>
+#include <string>
+#include "forscape_settings.h"
+#include "forscape_settings_diff.h"
+
+using namespace Forscape;
+
+/// Every setting with a sample of its options
+static const std::vector<std::vector<std::string_view>> SETTING_PAIRS = {
+    {"AmbiguousInheritance=Ignore", "AmbiguousInheritance=Error"},
+    {"DiamondInheritance=Warn", "DiamondInheritance=Ignore"},
+    {"ImplicitMultiplication=SpaceDelineated", "ImplicitMultiplication=MultiCharacter"},
+    {"ImplicitSymbolDeclaration=Allow", "ImplicitSymbolDeclaration=Error"},
+    {"InheritanceShadowing=Error", "InheritanceShadowing=Warn"},
+    {"IrrationalConversion=FullSymbolic", "IrrationalConversion=ConvertToFloat"},
+    {"LeadingDecimalPlace=Ignore", "LeadingDecimalPlace=Error"},
+    {"RationalConversion=ArbitraryPrecision", "RationalConversion=ConvertToFloat"},
+    {"ScopeShadowing=Warn", "ScopeShadowing=Error"},
+    {"TransposeT=Ignore", "TransposeT=Error"},
+    {"UnexercisedBranch=Ignore", "UnexercisedBranch=Error"},
+    {"UnusedVariable=Error", "UnusedVariable=Ignore"},
+    {"ZeroToZeroPower=One", "ZeroToZeroPower=Zero"},
+};
+
+/// A diff string specifying every setting
+static std::string longDiffString() {
+    std::string str;
+    for(const auto& pairs : SETTING_PAIRS){
+        if(!str.empty()) str += ',';
+        str += pairs.front();
+    }
+
+    return str;
+}
+
+/// Diff strings specifying a few random settings each, as might be found throughout a project
+static std::vector<std::string> randomDiffStrings(size_t num_diffs) {
+    std::mt19937 rng(0);
+    std::vector<size_t> settings(SETTING_PAIRS.size());
+    std::vector<std::string> diffs;
+    for(size_t i = 0; i < num_diffs; i++){
+        for(size_t j = 0; j < settings.size(); j++) settings[j] = j;
+        std::shuffle(settings.begin(), settings.end(), rng);
+
+        std::string str;
+        for(size_t j = 0; j < 1 + rng() % 4; j++){
+            if(!str.empty()) str += ',';
+            const auto& pairs = SETTING_PAIRS[settings[j]];
+            str += pairs[rng() % pairs.size()];
+        }
+        diffs.push_back(str);
+    }
+
+    return diffs;
+}
+
+static std::vector<SettingsDiff> randomDiffs(size_t num_diffs) {
+    std::vector<SettingsDiff> diffs;
+    for(const std::string& str : randomDiffStrings(num_diffs)) diffs.push_back(SettingsDiff::fromString(str));
+
+    return diffs;
+}
+
+TEST_CASE( "Diff deserialisation" ) {
+    const std::string long_str = longDiffString();
+    const std::vector<std::string> random_strs = randomDiffStrings(1000);
+
+    BENCHMARK("isValidSerial, long diff") {
+        return SettingsDiff::isValidSerial(long_str);
+    };
+
+    BENCHMARK("fromString, long diff") {
+        return SettingsDiff::fromString(long_str);
+    };
+
+    BENCHMARK("parse, long diff") {
+        SettingsDiffBuffer buffer;
+        return SettingsDiff::parse(long_str, buffer).code;
+    };
+
+    BENCHMARK("isValidSerial, 1000 random diffs") {
+        size_t num_valid = 0;
+        for(const std::string& str : random_strs) num_valid += SettingsDiff::isValidSerial(str);
+        return num_valid;
+    };
+
+    BENCHMARK("fromString, 1000 random diffs") {
+        std::string out;
+        for(const std::string& str : random_strs) SettingsDiff::fromString(str).writeString(out);
+        return out.size();
+    };
+
+    const std::vector<std::string_view> random_views(random_strs.begin(), random_strs.end());
+    SettingsDiffBatch batch;
+    BENCHMARK("SettingsDiffBatch::parse, 1000 random diffs") {
+        batch.parse(random_views);
+        return batch.numErrors();
+    };
+
+    const std::vector<std::string> project_strs = randomDiffStrings(100000);
+    const std::vector<std::string_view> project_views(project_strs.begin(), project_strs.end());
+    BENCHMARK("isValidSerial, 100000 random diffs") {
+        size_t num_valid = 0;
+        for(std::string_view str : project_views) num_valid += SettingsDiff::isValidSerial(str);
+        return num_valid;
+    };
+
+    BENCHMARK("SettingsDiffBatch::parse, 100000 random diffs") {
+        batch.parse(project_views);
+        return batch.numErrors();
+    };
+
+    BENCHMARK("SettingsDiffBatch::parse, 100000 random diffs, 4 threads") {
+        batch.parse(project_views, 4);
+        return batch.numErrors();
+    };
+}
+
+TEST_CASE( "Diff tokenisation" ) {
+    std::string project;
+    for(const std::string& str : randomDiffStrings(1000)){
+        if(!project.empty()) project += ',';
+        project += str;
+    }
+    std::vector<std::string_view> keys;
+    for(const auto& pairs : SETTING_PAIRS) keys.insert(keys.end(), pairs.begin(), pairs.end());
+
+    BENCHMARK("findDelimiterBytewise, 1000 concatenated diffs") {
+        size_t num_pairs = 0;
+        for(size_t start = 0; start <= project.size(); num_pairs++)
+            start = SettingsDiffScan::findDelimiterBytewise(project, start) + 1;
+        return num_pairs;
+    };
+
+    BENCHMARK("findDelimiter, 1000 concatenated diffs") {
+        size_t num_pairs = 0;
+        for(size_t start = 0; start <= project.size(); num_pairs++)
+            start = SettingsDiffScan::findDelimiter(project, start) + 1;
+        return num_pairs;
+    };
+
+    BENCHMARK("hashBytewise, every sample pair") {
+        uint32_t combined = 0;
+        for(std::string_view key : keys) combined ^= SettingsDiffScan::hashBytewise(key);
+        return combined;
+    };
+
+    BENCHMARK("hash, every sample pair") {
+        uint32_t combined = 0;
+        for(std::string_view key : keys) combined ^= SettingsDiffScan::hash(key);
+        return combined;
+    };
+}
+
+TEST_CASE( "Diff serialisation" ) {
+    const SettingsDiff long_diff = SettingsDiff::fromString(longDiffString());
+    const std::vector<SettingsDiff> random_diffs = randomDiffs(1000);
+
+    BENCHMARK("writeString, long diff") {
+        std::string out;
+        long_diff.writeString(out);
+        return out;
+    };
+
+    BENCHMARK("writeString, 1000 random diffs") {
+        std::string out;
+        for(const SettingsDiff& diff : random_diffs) diff.writeString(out);
+        return out.size();
+    };
+
+    BENCHMARK("writeToBuffer, 1000 random diffs") {
+        std::vector<size_t> buffer;
+        for(const SettingsDiff& diff : random_diffs) diff.writeToBuffer(buffer);
+        return buffer.size();
+    };
+
+    BENCHMARK("writeCompact, 1000 random diffs") {
+        std::vector<uint8_t> buffer;
+        for(const SettingsDiff& diff : random_diffs) diff.writeCompact(buffer);
+        return buffer.size();
+    };
+}
+
+TEST_CASE( "Diff application" ) {
+    const SettingsDiff long_diff = SettingsDiff::fromString(longDiffString());
+    const PackedSettingsDiff long_packed(long_diff);
+    const std::vector<SettingsDiff> random_diffs = randomDiffs(1000);
+    std::vector<PackedSettingsDiff> random_packed;
+    for(const SettingsDiff& diff : random_diffs) random_packed.emplace_back(diff);
+
+    BENCHMARK("applyDiff, long diff") {
+        ScopedSettings settings;
+        settings.enterScope();
+        settings.applyDiff(long_diff);
+        return settings.getZeroToZeroPowerOption();
+    };
+
+    BENCHMARK("applyDiff, long packed diff") {
+        ScopedSettings settings;
+        settings.enterScope();
+        settings.applyDiff(long_packed);
+        return settings.getZeroToZeroPowerOption();
+    };
+
+    BENCHMARK("applyDiff, stream of 1000 random diffs") {
+        ScopedSettings settings;
+        settings.enterScope();
+        for(const SettingsDiff& diff : random_diffs) settings.applyDiff(diff);
+        return settings.getUnusedVariableOption();
+    };
+
+    BENCHMARK("applyDiff, stream of 1000 random packed diffs") {
+        ScopedSettings settings;
+        settings.enterScope();
+        for(const PackedSettingsDiff& diff : random_packed) settings.applyDiff(diff);
+        return settings.getUnusedVariableOption();
+    };
+
+    BENCHMARK("enterScope/leaveScope, nesting depth 1000") {
+        ScopedSettings settings;
+        for(size_t i = 0; i < 1000; i++){
+            settings.enterScope();
+            settings.applyDiff(random_packed[i]);
+        }
+        for(size_t i = 0; i < 1000; i++) settings.leaveScope();
+        return settings.getUnusedVariableOption();
+    };
+}
@@ -0,0 +1,48 @@
+#include <catch2/benchmark/catch_benchmark.hpp>
+#include <catch2/catch_test_macros.hpp>
+
+#include "dialog_test_helpers.h"
+
+#include <QFormLayout>
+#include <QLineEdit>
+
+using namespace Forscape;
+
+TEST_CASE( "Dialog search typing" ) {
+    application();
+    initialisePalette();
+    ScopedSettings settings;
+    SettingsDiff diff;
+
+    whileExecuting(settings.getSettings(), diff, [](SettingsDiffDialog& dialog){
+        QLineEdit* filter_edit = dialog.findChild<QLineEdit*>("filterEdit");
+
+        BENCHMARK("Type a search term") {
+            for(const QString& text : {"s", "sh", "sha", "shad", "shado", "shadow", ""}) filter_edit->setText(text);
+            return numVisibleRows(dialog);
+        };
+    });
+}
+
+TEST_CASE( "Dialog interaction" ) {
+    application();
+    initialisePalette();
+    ScopedSettings settings;
+    SettingsDiff diff = SettingsDiff::fromString("UnusedVariable=Error,ScopeShadowing=Warn,TransposeT=Ignore");
+
+    whileExecuting(settings.getSettings(), diff, [](SettingsDiffDialog& dialog){
+        QFormLayout* inherited = dialog.findChild<QFormLayout*>("inheritedFormLayout");
+        QComboBox* box = qobject_cast<QComboBox*>(inherited->itemAt(0, QFormLayout::FieldRole)->widget());
+
+        BENCHMARK("Override and inherit a setting") {
+            box->setCurrentIndex(1);
+            box->setCurrentIndex(0);
+            return box->currentIndex();
+        };
+
+        BENCHMARK("Change an overridden option") {
+            box->setCurrentIndex(box->currentIndex() == 1 ? 2 : 1);
+            return box->currentIndex();
+        };
+    });
+}
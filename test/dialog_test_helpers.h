@@ -0,0 +1,61 @@
+#ifndef DIALOG_TEST_HELPERS_H
+#define DIALOG_TEST_HELPERS_H
+
+#include "forscape_settings.h"
+#include "forscape_settings_colour_palette.h"
+#include "forscape_settings_diff.h"
+#include "forscape_settings_diff_dialog.h"
+
+#include <QApplication>
+#include <QComboBox>
+#include <QTimer>
+
+namespace Forscape {
+
+/// The application of every test, which runs without a display
+inline QApplication& application() {
+    static int argc = 1;
+    static char name[] = "DialogTests";
+    static char* argv[] = {name, nullptr};
+    if(qEnvironmentVariableIsEmpty("QT_QPA_PLATFORM")) qputenv("QT_QPA_PLATFORM", "offscreen");
+    static QApplication app(argc, argv);
+
+    return app;
+}
+
+inline void initialisePalette() {
+    SettingsPalettes palette;
+    palette.allow.background = QColor("limegreen");
+    palette.allow.foreground = QColor("black");
+    palette.semi_allow.background = QColor("mediumspringgreen");
+    palette.semi_allow.foreground = QColor("black");
+    palette.error.background = QColor("tomato");
+    palette.error.foreground = QColor("white");
+    palette.ignore.background = QColor("gainsboro");
+    palette.ignore.foreground = QColor("black");
+    palette.warn.background = QColor("orange");
+    palette.warn.foreground = QColor("black");
+    setSettingsColourPalette(palette);
+}
+
+/// Run a function while the dialog is executing, then close the dialog
+template<typename Function>
+void whileExecuting(const Settings& inherited, SettingsDiff& diff, Function function) {
+    SettingsDiffDialog& dialog = SettingsDiffDialog::getDialog();
+    QTimer::singleShot(0, &dialog, [&dialog, &function](){
+        function(dialog);
+        dialog.reject();
+    });
+    SettingsDiffDialog::exec(inherited, diff);
+}
+
+/// The number of setting rows which are not hidden
+inline size_t numVisibleRows(SettingsDiffDialog& dialog) {
+    size_t num_visible = 0;
+    for(const QComboBox* box : dialog.findChildren<QComboBox*>()) num_visible += !box->isHidden();
+    return num_visible;
+}
+
+}  // namespace Forscape
+
+#endif // DIALOG_TEST_HELPERS_H
@@ -1,6 +1,10 @@
 #include <catch2/catch_test_macros.hpp>
 
 #include "forscape_settings.h"
+#include "forscape_settings_diff.h"
+
+#include <random>
+#include <thread>
 
 using namespace Forscape;
 
@@ -11,3 +15,344 @@ TEST_CASE( "Defaults" ) {
     REQUIRE(default_settings.getScopeShadowingOption() == ScopeShadowingOption::IGNORE);
     REQUIRE(default_settings.getImplicitSymbolDeclarationOption() == ImplicitSymbolDeclarationOption::ERROR);
 }
+
+TEST_CASE( "Settings comparison" ) {
+    ScopedSettings settings;
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+
+    settings.enterScope();
+    settings.applyDiff(SettingsDiff::fromString("ZeroToZeroPower=One"));
+    REQUIRE(settings.getSettings() != Settings::getDefaults());
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ONE);
+
+    settings.applyDiff(SettingsDiff::fromString("ZeroToZeroPower=Undefined"));
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+    settings.leaveScope();
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+}
+
+TEST_CASE( "Packed diff application" ) {
+    const PackedSettingsDiff diff(SettingsDiff::fromString(
+        "ImplicitSymbolDeclaration=Allow,IrrationalConversion=FullSymbolic,ZeroToZeroPower=Zero"));
+
+    ScopedSettings settings;
+    settings.enterScope();
+    settings.applyDiff(diff);
+    REQUIRE(settings.getImplicitSymbolDeclarationOption() == ImplicitSymbolDeclarationOption::ALLOW);
+    REQUIRE(settings.getIrrationalConversionOption() == IrrationalConversionOption::FULL_SYMBOLIC);
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ZERO);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::WARN);
+
+    settings.enterScope();
+    settings.applyDiff(SettingsDiff::fromString("ZeroToZeroPower=One,UnusedVariable=Ignore"));
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ONE);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::IGNORE);
+    REQUIRE(settings.getIrrationalConversionOption() == IrrationalConversionOption::FULL_SYMBOLIC);
+    settings.leaveScope();
+
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ZERO);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::WARN);
+    settings.leaveScope();
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+}
+
+template<typename ScopedSettingsType>
+static void checkNestedScopes() {
+    const SettingsDiff outer_diff = SettingsDiff::fromString("UnusedVariable=Error,ImplicitMultiplication=Error");
+    const SettingsDiff inner_diff = SettingsDiff::fromString("UnusedVariable=Ignore");
+
+    ScopedSettingsType settings;
+    settings.enterScope();
+    settings.applyDiff(outer_diff);
+    settings.enterScope();
+    settings.enterScope();
+    settings.applyDiff(inner_diff);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::IGNORE);
+    REQUIRE(settings.getImplicitMultiplicationOption() == ImplicitMultiplicationOption::ERROR);
+    settings.leaveScope();
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    settings.leaveScope();
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    settings.leaveScope();
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+}
+
+TEST_CASE( "Scope strategies" ) {
+    checkNestedScopes<UndoLogScopedSettings>();
+    checkNestedScopes<SnapshotScopedSettings>();
+}
+
+TEST_CASE( "Resolved settings cache" ) {
+    SettingsDiffPool pool;
+    const SettingsDiffHandle outer = pool.intern(SettingsDiff::fromString("UnusedVariable=Error"));
+    const SettingsDiffHandle inner = pool.intern(SettingsDiff::fromString("TransposeT=Error,UnusedVariable=Ignore"));
+    ResolvedSettingsCache cache(2);
+
+    for(size_t i = 0; i < 3; i++){
+        ScopedSettings settings;
+        settings.enterScope();
+        settings.applyDiff(outer, pool, cache);
+        REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+        settings.enterScope();
+        settings.applyDiff(inner, pool, cache);
+        REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::IGNORE);
+        REQUIRE(settings.getTransposeTOption() == TransposeTOption::ERROR);
+        settings.leaveScope();
+        REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+        REQUIRE(settings.getTransposeTOption() == TransposeTOption::WARN);
+        settings.leaveScope();
+        REQUIRE(settings.getSettings() == Settings::getDefaults());
+    }
+    REQUIRE(cache.misses() == 2);
+    REQUIRE(cache.hits() == 4);
+
+    // Applying the inner diff directly to the defaults is a new entry, evicting the least recently used
+    UndoLogScopedSettings settings;
+    settings.enterScope();
+    settings.applyDiff(inner, pool, cache);
+    REQUIRE(settings.getTransposeTOption() == TransposeTOption::ERROR);
+    settings.leaveScope();
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+    REQUIRE(cache.misses() == 3);
+    REQUIRE(cache.size() == 2);
+
+    const Settings& resolved = cache.resolve(Settings::getDefaults(), outer, pool);
+    REQUIRE(resolved.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    REQUIRE(cache.misses() == 4);
+}
+
+TEST_CASE( "Resolved settings cache without capacity" ) {
+    SettingsDiffPool pool;
+    const SettingsDiffHandle outer = pool.intern(SettingsDiff::fromString("UnusedVariable=Error"));
+    const SettingsDiffHandle inner = pool.intern(SettingsDiff::fromString("TransposeT=Error"));
+    ResolvedSettingsCache cache(0);
+
+    // Each miss evicts the only result
+    for(size_t i = 0; i < 2; i++){
+        REQUIRE(cache.resolve(Settings::getDefaults(), outer, pool).getUnusedVariableOption() == UnusedVariableOption::ERROR);
+        REQUIRE(cache.resolve(Settings::getDefaults(), inner, pool).getTransposeTOption() == TransposeTOption::ERROR);
+    }
+    REQUIRE(cache.misses() == 4);
+    REQUIRE(cache.size() == 1);
+
+    REQUIRE(cache.resolve(Settings::getDefaults(), inner, pool).getTransposeTOption() == TransposeTOption::ERROR);
+    REQUIRE(cache.hits() == 1);
+}
+
+static const std::vector<std::string_view> SCOPE_DIFFS = {
+    "UnusedVariable=Error",
+    "UnusedVariable=Ignore,TransposeT=Error",
+    "ZeroToZeroPower=One",
+    "ScopeShadowing=Warn,ImplicitMultiplication=Error",
+    "",
+};
+
+/// Drive scoped settings through random nested scopes spanning length characters, recording the settings in the
+/// index and the settings at every character in expected
+static void parseScopes(ScopedSettings& settings, SettingsIntervalIndex& index, std::vector<Settings>& expected,
+                        size_t length, size_t depth, std::mt19937& rng) {
+    const size_t end = expected.size() + length;
+    while(expected.size() < end){
+        const size_t remaining = end - expected.size();
+        const size_t span = std::uniform_int_distribution<size_t>(1, std::min<size_t>(remaining, 20))(rng);
+        if(depth < 4 && rng() % 2 == 0){
+            settings.enterScope();
+            settings.applyDiff(SettingsDiff::fromString(SCOPE_DIFFS[rng() % SCOPE_DIFFS.size()]));
+            index.record(expected.size(), settings.getSettings());
+            parseScopes(settings, index, expected, span, depth + 1, rng);
+            settings.leaveScope();
+            index.record(expected.size(), settings.getSettings());
+        }else{
+            expected.insert(expected.end(), span, settings.getSettings());
+        }
+    }
+}
+
+TEST_CASE( "Settings interval index" ) {
+    std::mt19937 rng(0);
+
+    for(size_t trial = 0; trial < 200; trial++){
+        ScopedSettings settings;
+        SettingsIntervalIndex index;
+        std::vector<Settings> expected;
+        parseScopes(settings, index, expected, 300, 0, rng);
+        for(size_t offset = 0; offset < expected.size(); offset++) REQUIRE(index.at(offset) == expected[offset]);
+        REQUIRE(index.size() <= expected.size());
+
+        // Re-parse a random range with different contents, which may change its length
+        const size_t start = rng() % expected.size();
+        const size_t end = start + rng() % (expected.size() - start + 1);
+        const size_t length = rng() % 50;
+        ScopedSettings reparsed_settings;
+        reparsed_settings.enterScope();
+        reparsed_settings.applyDiff(SettingsDiff::fromString(SCOPE_DIFFS[rng() % SCOPE_DIFFS.size()]));
+        SettingsIntervalIndex replacement;
+        std::vector<Settings> reparsed(start, Settings::getDefaults());
+        replacement.record(start, reparsed_settings.getSettings());
+        parseScopes(reparsed_settings, replacement, reparsed, length, 1, rng);
+
+        index.replaceRange(start, end, length, replacement);
+        expected.erase(expected.begin() + start, expected.begin() + end);
+        expected.insert(expected.begin() + start, reparsed.begin() + start, reparsed.end());
+        for(size_t offset = 0; offset < expected.size(); offset++) REQUIRE(index.at(offset) == expected[offset]);
+
+        // Boundaries only remain where the settings change
+        SettingsIntervalIndex rebuilt;
+        for(size_t offset = 0; offset < expected.size(); offset++) rebuilt.record(offset, expected[offset]);
+        REQUIRE(index.size() <= rebuilt.size() + 1);
+    }
+}
+
+TEST_CASE( "Settings context" ) {
+    const SettingsContext defaults;
+    REQUIRE(defaults.depth() == 0);
+    REQUIRE(defaults.getSettings() == Settings::getDefaults());
+
+    const SettingsContext outer = defaults.withDiff(SettingsDiff::fromString("UnusedVariable=Error"));
+    const SettingsContext inner = outer.withDiff(SettingsDiff::fromString("UnusedVariable=Ignore,TransposeT=Error"));
+    REQUIRE(outer.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    REQUIRE(inner.getUnusedVariableOption() == UnusedVariableOption::IGNORE);
+    REQUIRE(inner.getTransposeTOption() == TransposeTOption::ERROR);
+    REQUIRE(inner.depth() == 2);
+    REQUIRE(inner.parent().getSettings() == outer.getSettings());
+    REQUIRE(defaults.getSettings() == Settings::getDefaults());
+
+    ScopedSettings scoped = inner.toScopedSettings();
+    REQUIRE(scoped.getSettings() == inner.getSettings());
+    scoped.leaveScope();
+    REQUIRE(scoped.getSettings() == outer.getSettings());
+    scoped.leaveScope();
+    REQUIRE(scoped.getSettings() == Settings::getDefaults());
+}
+
+TEST_CASE( "Settings context threads" ) {
+    // Fork a shared tree of contexts, as a compiler would for the scopes enclosing function bodies
+    std::mt19937 rng(0);
+    std::vector<SettingsContext> shared = {SettingsContext()};
+    for(size_t i = 0; i < 100; i++)
+        shared.push_back(shared[rng() % shared.size()].withDiff(SettingsDiff::fromString(SCOPE_DIFFS[rng() % SCOPE_DIFFS.size()])));
+
+    // Each thread forks its own scopes from the shared contexts, checking them against mutable scoped settings
+    constexpr size_t NUM_THREADS = 8;
+    std::array<size_t, NUM_THREADS> num_mismatches = {};
+    std::vector<std::thread> threads;
+    for(size_t t = 0; t < NUM_THREADS; t++){
+        threads.emplace_back([&shared, &num_mismatches, t](){
+            std::mt19937 thread_rng(static_cast<unsigned>(t));
+            for(size_t trial = 0; trial < 1000; trial++){
+                SettingsContext context = shared[thread_rng() % shared.size()];
+                ScopedSettings expected = context.toScopedSettings();
+                num_mismatches[t] += (expected.getSettings() != context.getSettings());
+
+                for(size_t step = 0; step < 10; step++){
+                    if(context.depth() != 0 && thread_rng() % 3 == 0){
+                        context = context.parent();
+                        expected.leaveScope();
+                    }else{
+                        const SettingsDiff diff = SettingsDiff::fromString(SCOPE_DIFFS[thread_rng() % SCOPE_DIFFS.size()]);
+                        context = context.withDiff(diff);
+                        expected.enterScope();
+                        expected.applyDiff(diff);
+                    }
+                    num_mismatches[t] += (expected.getSettings() != context.getSettings());
+                }
+            }
+        });
+    }
+    for(std::thread& thread : threads) thread.join();
+
+    for(const size_t mismatches : num_mismatches) REQUIRE(mismatches == 0);
+}
+
+TEST_CASE( "Settings differences" ) {
+    ScopedSettings settings;
+    const Settings before = settings.getSettings();
+    REQUIRE(settings.getSettings().differences(before).none());
+
+    settings.applyDiff(SettingsDiff::fromString("ZeroToZeroPower=One,UnusedVariable=Warn"));
+    REQUIRE(settings.getSettings().differences(before).count() == 1);
+    settings.applyDiff(SettingsDiff::fromString("TransposeT=Error"));
+    REQUIRE(settings.getSettings().differences(before).count() == 2);
+    REQUIRE(before.differences(settings.getSettings()) == settings.getSettings().differences(before));
+}
+
+#ifdef FORSCAPE_SETTINGS_READ_TRACKING
+TEST_CASE( "Settings read tracking" ) {
+    ScopedSettings settings;
+    settings.getUnusedVariableOption();  // Reads are not recorded without a tracker
+
+    SettingsReadTracker outer;
+    REQUIRE(outer.reads().none());
+    settings.getUnusedVariableOption();
+    {
+        SettingsReadTracker inner;
+        settings.getTransposeTOption();
+        REQUIRE(inner.reads().count() == 1);
+
+        // Reads on other threads are recorded by their own trackers
+        std::thread([&settings](){ settings.getScopeShadowingOption(); }).join();
+        REQUIRE(inner.reads().count() == 1);
+    }
+    REQUIRE(outer.reads().count() == 2);
+
+    // Only diffs changing a setting which was read invalidate the tracked reads
+    const Settings before = settings.getSettings();
+    settings.enterScope();
+    settings.applyDiff(SettingsDiff::fromString("ZeroToZeroPower=One"));
+    REQUIRE(settings.getSettings().differences(before).count() == 1);
+    REQUIRE_FALSE(outer.dependsOn(settings.getSettings().differences(before)));
+    settings.applyDiff(SettingsDiff::fromString("TransposeT=Error"));
+    REQUIRE(outer.dependsOn(settings.getSettings().differences(before)));
+    settings.leaveScope();
+}
+#endif
+
+#ifdef FORSCAPE_SETTINGS_INSTRUMENTATION
+static size_t num_hooked_failures = 0;
+
+/// Enter two nested scopes, applying a diff in each
+template<typename ScopedSettingsType>
+static void applyNestedDiffs() {
+    ScopedSettingsType settings;
+    settings.enterScope();
+    settings.applyDiff(SettingsDiff::fromString("UnusedVariable=Error,TransposeT=Error"));
+    settings.enterScope();
+    settings.applyDiff(SettingsDiff::fromString("UnusedVariable=Ignore"));
+    settings.leaveScope();
+    settings.leaveScope();
+}
+
+TEST_CASE( "Instrumentation counters" ) {
+    resetSettingsCounters();
+    SettingsHooks hooks;
+    hooks.parse_failed = [](std::string_view, const SettingsDiffError&){ num_hooked_failures++; };
+    setSettingsHooks(hooks);
+
+    applyNestedDiffs<ScopedSettings>();
+
+    SettingsDiffError error;
+    SettingsDiff::fromString("UnusedVariable=Chamomile", error);
+    REQUIRE(error);
+
+    SettingsCounters counters = getSettingsCounters();
+    REQUIRE(counters.diffs_applied == 2);
+    REQUIRE(counters.settings_applied == 3);
+    REQUIRE(counters.meanDiffLength() == 1.5);
+    REQUIRE(counters.scopes_entered == 2);
+    REQUIRE(counters.max_scope_depth == 2);
+    REQUIRE(counters.max_scope_bytes == 2 * sizeof(size_t) + 2 * sizeof(PackedSettingsDiff));
+    REQUIRE(counters.parse_failures == 1);
+    REQUIRE(num_hooked_failures == 1);
+
+    // The scope state of snapshots is measured as well
+    resetSettingsCounters();
+    applyNestedDiffs<SnapshotScopedSettings>();
+    counters = getSettingsCounters();
+    REQUIRE(counters.max_scope_depth == 2);
+    REQUIRE(counters.max_scope_bytes == 2 * sizeof(Settings));
+
+    setSettingsHooks(SettingsHooks());
+    resetSettingsCounters();
+    REQUIRE(getSettingsCounters().diffs_applied == 0);
+}
+#endif
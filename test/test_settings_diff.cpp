@@ -3,6 +3,9 @@
 #include "forscape_settings.h"
 #include "forscape_settings_diff.h"
 
+#include <algorithm>
+#include <random>
+
 using namespace Forscape;
 
 TEST_CASE( "Valid Diff Serialisation" ) {
@@ -50,3 +53,452 @@ TEST_CASE( "Buffer trip" ) {
     settings.applyDiff(SettingsDiffView::fromBuffer(&totally_a_parse_node[3]));
     REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
 }
+
+TEST_CASE( "Perfect hash rejects near misses" ) {
+    REQUIRE(SettingsDiff::isValidSerial("ImplicitMultiplication=SpaceDelineated"));
+    REQUIRE(SettingsDiff::isValidSerial("RationalConversion=ArbitraryPrecision"));
+    REQUIRE_FALSE(SettingsDiff::isValidSerial("UnusedVariable=Erro"));
+    REQUIRE_FALSE(SettingsDiff::isValidSerial("unusedVariable=Error"));
+    REQUIRE_FALSE(SettingsDiff::isValidSerial("UnusedVariable=ErrorX"));
+    REQUIRE_FALSE(SettingsDiff::isValidSerial("UnusedVariable=FullSymbolic"));
+}
+
+TEST_CASE( "Parse errors" ) {
+    SettingsDiffBuffer buffer;
+
+    SettingsDiffError error = SettingsDiff::parse("UnusedVariable=Error,ScopeShadowing=Tea", buffer);
+    REQUIRE(error.code == SettingsDiffError::UNKNOWN_PAIR);
+    REQUIRE(error.offset == 21);
+    REQUIRE(error.length == 18);
+    REQUIRE(buffer.size() == 1);
+
+    error = SettingsDiff::parse("UnusedVariable=Error,", buffer);
+    REQUIRE(error.code == SettingsDiffError::EMPTY_PAIR);
+    REQUIRE(error.offset == 21);
+    REQUIRE(error.length == 0);
+
+    error = SettingsDiff::parse("UnusedVariable=Error,,TransposeT=Warn", buffer);
+    REQUIRE(error.code == SettingsDiffError::EMPTY_PAIR);
+    REQUIRE(error.offset == 21);
+
+    error = SettingsDiff::parse("UnusedVariable=Error,TransposeT=Warn,UnusedVariable=Ignore", buffer);
+    REQUIRE(error.code == SettingsDiffError::DUPLICATE_SETTING);
+    REQUIRE(error.offset == 37);
+    REQUIRE(error.length == 21);
+    REQUIRE_FALSE(SettingsDiff::isValidSerial("UnusedVariable=Error,UnusedVariable=Ignore"));
+
+    error = SettingsDiff::parse("", buffer);
+    REQUIRE_FALSE(error);
+    REQUIRE(buffer.size() == 0);
+}
+
+TEST_CASE( "Parse into fixed buffer" ) {
+    SettingsDiffBuffer buffer;
+    const SettingsDiffError error = SettingsDiff::parse("UnusedVariable=Error,TransposeT=Ignore", buffer);
+    REQUIRE_FALSE(error);
+    REQUIRE(buffer.size() == 2);
+
+    ScopedSettings settings;
+    settings.enterScope();
+    settings.applyDiff(buffer);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    REQUIRE(settings.getTransposeTOption() == TransposeTOption::IGNORE);
+    settings.leaveScope();
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::WARN);
+}
+
+TEST_CASE( "Deserialise with error reporting" ) {
+    SettingsDiffError error;
+    const SettingsDiff diff = SettingsDiff::fromString("TransposeT=Error,TransposeT=Ignore", error);
+    REQUIRE(error.code == SettingsDiffError::DUPLICATE_SETTING);
+    REQUIRE(error.offset == 17);
+
+    std::string out;
+    diff.writeString(out);
+    REQUIRE(out == "TransposeT=Error");
+}
+
+TEST_CASE( "Diff interning" ) {
+    SettingsDiffPool pool;
+    const SettingsDiffHandle a = pool.intern(SettingsDiff::fromString("UnusedVariable=Error,TransposeT=Ignore"));
+    const SettingsDiffHandle b = pool.intern(SettingsDiff::fromString("TransposeT=Ignore,UnusedVariable=Error"));
+    const SettingsDiffHandle c = pool.intern(SettingsDiff::fromString("TransposeT=Ignore"));
+    const SettingsDiffHandle empty = pool.intern(SettingsDiff::fromString(""));
+    REQUIRE(a == b);
+    REQUIRE(a != c);
+    REQUIRE(a != empty);
+    REQUIRE(pool.size() == 3);
+
+    ScopedSettings settings;
+    settings.enterScope();
+    settings.applyDiff(pool.view(b));
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    REQUIRE(settings.getTransposeTOption() == TransposeTOption::IGNORE);
+    settings.leaveScope();
+
+    settings.enterScope();
+    settings.applyDiff(pool.view(empty));
+    REQUIRE(settings.getSettings() == Settings::getDefaults());
+    settings.leaveScope();
+}
+
+TEST_CASE( "Diff literals" ) {
+    static constexpr auto literal = FORSCAPE_SETTINGS_DIFF("UnusedVariable=Error,TransposeT=Ignore");
+    static_assert(literal.size() == 2);
+    static_assert(FORSCAPE_SETTINGS_DIFF("").size() == 0);
+
+    SettingsDiffPool pool;
+    REQUIRE(pool.intern(literal) == pool.intern(SettingsDiff::fromString("UnusedVariable=Error,TransposeT=Ignore")));
+    REQUIRE(pool.intern(FORSCAPE_SETTINGS_DIFF("")) == pool.intern(SettingsDiff::fromString("")));
+
+    ScopedSettings settings;
+    settings.enterScope();
+    settings.applyDiff(literal);
+    REQUIRE(settings.getUnusedVariableOption() == UnusedVariableOption::ERROR);
+    REQUIRE(settings.getTransposeTOption() == TransposeTOption::IGNORE);
+    const SettingsDiffView view = FORSCAPE_SETTINGS_DIFF("ZeroToZeroPower=Zero");
+    settings.applyDiff(view);
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ZERO);
+    settings.leaveScope();
+}
+
+TEST_CASE( "Buffer trip with many settings" ) {
+    const std::string_view test_str =
+        "AmbiguousInheritance=Error,DiamondInheritance=Ignore,ImplicitMultiplication=Error,"
+        "ImplicitSymbolDeclaration=Allow,InheritanceShadowing=Error,IrrationalConversion=FullSymbolic,"
+        "LeadingDecimalPlace=Error,RationalConversion=ArbitraryPrecision,ScopeShadowing=Error,TransposeT=Error,"
+        "UnexercisedBranch=Error,UnusedVariable=Error,ZeroToZeroPower=One";
+    const SettingsDiff diff = SettingsDiff::fromString(test_str);
+    std::vector<size_t> buffer = {7};
+    diff.writeToBuffer(buffer);
+    buffer.push_back(7);
+    const size_t num_bytes = 13 * 2;  // 13 updates, each a pair of byte-sized indices
+    REQUIRE(buffer.size() == 1 + 1 + (num_bytes + sizeof(size_t) - 1) / sizeof(size_t) + 1);
+    REQUIRE(buffer.back() == 7);
+
+    ScopedSettings settings;
+    settings.applyDiff(SettingsDiffView::fromBuffer(&buffer[1]));
+    REQUIRE(settings.getZeroToZeroPowerOption() == ZeroToZeroPowerOption::ONE);
+    REQUIRE(settings.getAmbiguousInheritanceOption() == AmbiguousInheritanceOption::ERROR);
+}
+
+static const std::vector<std::string_view> SAMPLE_DIFFS = {
+    "",
+    "UnusedVariable=Error",
+    "UnusedVariable=Error,ScopeShadowing=Warn,TransposeT=Ignore",
+    "ZeroToZeroPower=One,ImplicitSymbolDeclaration=Allow,IrrationalConversion=FullSymbolic,"
+        "RationalConversion=ConvertToFloat,ImplicitMultiplication=SpaceDelineated,LeadingDecimalPlace=Ignore",
+};
+
+TEST_CASE( "Compact round trip" ) {
+    std::vector<uint8_t> buffer;
+    for(const std::string_view str : SAMPLE_DIFFS) SettingsDiff::fromString(str).writeCompact(buffer);
+
+    size_t offset = 0;
+    for(const std::string_view str : SAMPLE_DIFFS){
+        CompactSettingsDiffView compact;
+        REQUIRE(CompactSettingsDiffView::fromBytes(buffer.data() + offset, buffer.size() - offset, compact));
+        offset += compact.numBytes();
+
+        std::string out;
+        SettingsDiff::fromCompact(compact).writeString(out);
+        REQUIRE(out == str);
+
+        ScopedSettings compact_settings;
+        compact_settings.applyDiff(compact);
+        ScopedSettings string_settings;
+        string_settings.applyDiff(SettingsDiff::fromString(str));
+        REQUIRE(compact_settings.getSettings() == string_settings.getSettings());
+    }
+    REQUIRE(offset == buffer.size());
+
+    std::vector<uint8_t> single;
+    SettingsDiff::fromString("UnusedVariable=Error,ScopeShadowing=Warn").writeCompact(single);
+    REQUIRE(single.size() < 2 * sizeof(size_t));
+}
+
+TEST_CASE( "Compact rejects invalid bytes" ) {
+    std::vector<uint8_t> valid;
+    SettingsDiff::fromString(SAMPLE_DIFFS[2]).writeCompact(valid);
+    CompactSettingsDiffView compact;
+    REQUIRE(CompactSettingsDiffView::fromBytes(valid.data(), valid.size(), compact));
+
+    for(size_t size = 0; size < valid.size(); size++)
+        REQUIRE_FALSE(CompactSettingsDiffView::fromBytes(valid.data(), size, compact));
+
+    std::vector<uint8_t> wrong_version = valid;
+    wrong_version[0]++;
+    REQUIRE_FALSE(CompactSettingsDiffView::fromBytes(wrong_version.data(), wrong_version.size(), compact));
+}
+
+TEST_CASE( "Compact fuzz" ) {
+    std::mt19937 rng(0);
+    std::uniform_int_distribution<int> byte_distribution(0, 255);
+    std::uniform_int_distribution<size_t> size_distribution(0, 24);
+
+    for(size_t trial = 0; trial < 100000; trial++){
+        std::vector<uint8_t> bytes(size_distribution(rng));
+        for(uint8_t& byte : bytes) byte = static_cast<uint8_t>(byte_distribution(rng));
+        if(!bytes.empty() && trial % 2 == 0) bytes[0] = SETTINGS_DIFF_FORMAT_VERSION;
+
+        CompactSettingsDiffView compact;
+        if(!CompactSettingsDiffView::fromBytes(bytes.data(), bytes.size(), compact)) continue;
+        REQUIRE(compact.numBytes() <= bytes.size());
+
+        // Any accepted diff decodes to valid settings and re-encodes to identical bytes
+        const SettingsDiff diff = SettingsDiff::fromCompact(compact);
+        std::string str;
+        diff.writeString(str);
+        std::vector<uint8_t> reencoded;
+        diff.writeCompact(reencoded);
+        REQUIRE(reencoded == std::vector<uint8_t>(bytes.begin(), bytes.begin() + compact.numBytes()));
+        if(compact.size() == 1) REQUIRE(SettingsDiff::isValidSerial(str));
+    }
+}
+
+TEST_CASE( "Delimiter scan" ) {
+    std::mt19937 rng(0);
+    std::uniform_int_distribution<size_t> size_distribution(0, 80);
+
+    for(size_t trial = 0; trial < 2000; trial++){
+        // Sparse delimiters at every alignment relative to the 16 and 8 byte steps
+        std::string str(size_distribution(rng), 'a');
+        for(char& ch : str) if(rng() % 24 == 0) ch = ',';
+
+        for(size_t start = 0; start <= str.size(); start++)
+            REQUIRE(SettingsDiffScan::findDelimiter(str, start) == SettingsDiffScan::findDelimiterBytewise(str, start));
+    }
+}
+
+TEST_CASE( "Word hash" ) {
+    static_assert(SettingsDiffScan::hash("") == 2166136261u);
+    static_assert(SettingsDiffScan::hashBytewise("") == 2166136261u);
+    REQUIRE(SettingsDiffScan::hash("UnusedVariable=Error") != SettingsDiffScan::hash("UnusedVariable=Errot"));
+    REQUIRE(SettingsDiffScan::hash("abcd") != SettingsDiffScan::hash("abce"));
+    REQUIRE(SettingsDiffScan::hash("abcd") != SettingsDiffScan::hash("dcba"));
+}
+
+TEST_CASE( "Batch parse" ) {
+    const std::vector<std::string_view> strs = {
+        "UnusedVariable=Error,TransposeT=Ignore",
+        "",
+        "UnusedVariable=Error,UnusedVariable=Warn",
+        "ZeroToZeroPower=One",
+        "ZeroToZeroPower=One,",
+        "UnusedVariable=Eror",
+    };
+
+    SettingsDiffBatch batch;
+    batch.parse(strs);
+    REQUIRE(batch.size() == strs.size());
+    REQUIRE(batch.numErrors() == 3);
+
+    SettingsDiffPool pool;
+    for(size_t i = 0; i < strs.size(); i++){
+        SettingsDiffError error;
+        const SettingsDiff diff = SettingsDiff::fromString(strs[i], error);
+        REQUIRE(batch.error(i).code == error.code);
+        REQUIRE(batch.error(i).offset == error.offset);
+        REQUIRE(batch.error(i).length == error.length);
+        REQUIRE(pool.intern(batch.view(i)) == pool.intern(diff));
+    }
+}
+
+TEST_CASE( "Batch parse with threads" ) {
+    std::mt19937 rng(0);
+    const std::vector<std::string_view> pairs = {
+        "UnusedVariable=Error", "UnusedVariable=Warn", "TransposeT=Ignore", "ScopeShadowing=Warn",
+        "ZeroToZeroPower=One", "LeadingDecimalPlace=Error", "Invalid=Pair", "",
+    };
+
+    std::vector<std::string> owned(20000);
+    for(std::string& str : owned){
+        for(size_t i = rng() % 4; i > 0; i--){
+            str += pairs[rng() % pairs.size()];
+            if(i > 1) str += ',';
+        }
+    }
+    const std::vector<std::string_view> strs(owned.begin(), owned.end());
+
+    SettingsDiffBatch serial;
+    serial.parse(strs);
+    SettingsDiffBatch parallel;
+    parallel.parse(strs, 4);
+    REQUIRE(parallel.numErrors() == serial.numErrors());
+
+    SettingsDiffPool pool;
+    for(size_t i = 0; i < strs.size(); i++){
+        REQUIRE(parallel.error(i).code == serial.error(i).code);
+        REQUIRE(pool.intern(parallel.view(i)) == pool.intern(serial.view(i)));
+        REQUIRE(SettingsDiff::isValidSerial(strs[i]) == !serial.error(i));
+    }
+}
+
+TEST_CASE( "Incremental edits" ) {
+    SettingsDiff diff = SettingsDiff::fromString("ScopeShadowing=Warn,UnusedVariable=Error");
+    std::string str = "ScopeShadowing=Warn,UnusedVariable=Error";
+
+    SettingsDiffEdit edit;
+    REQUIRE(diff.set("UnusedVariable=Ignore", edit));
+    REQUIRE(edit.offset == std::string_view("ScopeShadowing=Warn,UnusedVariable=").size());
+    REQUIRE(edit.length == std::string_view("Error").size());
+    REQUIRE(edit.replacement == "Ignore");
+    edit.apply(str);
+    REQUIRE(str == "ScopeShadowing=Warn,UnusedVariable=Ignore");
+
+    REQUIRE(diff.set("UnusedVariable=Ignore", edit));
+    REQUIRE(edit.empty());
+
+    REQUIRE(diff.set("TransposeT=Error", edit));
+    REQUIRE(edit.replacement == "TransposeT=Error,");
+    edit.apply(str);
+    REQUIRE(str == "ScopeShadowing=Warn,TransposeT=Error,UnusedVariable=Ignore");
+
+    REQUIRE(diff.remove("ScopeShadowing", edit));
+    REQUIRE(edit.offset == 0);
+    edit.apply(str);
+    REQUIRE(str == "TransposeT=Error,UnusedVariable=Ignore");
+
+    REQUIRE_FALSE(diff.set("UnusedVariable=EarlGrey", edit));
+    REQUIRE_FALSE(diff.remove("Chamomile", edit));
+    REQUIRE(diff.remove("ZeroToZeroPower", edit));
+    REQUIRE(edit.empty());
+
+    std::string expected;
+    diff.writeString(expected);
+    REQUIRE(str == expected);
+}
+
+static constexpr std::string_view pairs[] = {
+    "AmbiguousInheritance=Error", "AmbiguousInheritance=Warn", "DiamondInheritance=Ignore",
+    "ImplicitMultiplication=Error", "ImplicitSymbolDeclaration=Allow", "LeadingDecimalPlace=Error",
+    "LeadingDecimalPlace=Ignore", "ScopeShadowing=Error", "ScopeShadowing=Warn", "TransposeT=Error",
+    "UnusedVariable=Error", "UnusedVariable=Ignore", "ZeroToZeroPower=One",
+};
+static constexpr size_t num_pairs = sizeof(pairs) / sizeof(pairs[0]);
+
+TEST_CASE( "Incremental edits fuzz" ) {
+    std::mt19937 rng(0);
+    std::uniform_int_distribution<size_t> pair_distribution(0, num_pairs - 1);
+
+    SettingsDiff diff;
+    std::string str;
+    for(size_t trial = 0; trial < 10000; trial++){
+        const std::string_view pair = pairs[pair_distribution(rng)];
+        SettingsDiffEdit edit;
+        if(trial % 3 == 0) REQUIRE(diff.remove(pair.substr(0, pair.find('=')), edit));
+        else REQUIRE(diff.set(pair, edit));
+
+        // Applying the edit to the previous serialisation gives the new serialisation, which stays sorted
+        edit.apply(str);
+        std::string expected;
+        diff.writeString(expected);
+        REQUIRE(str == expected);
+
+        std::string_view previous_setting;
+        for(size_t start = 0; start < str.size();){
+            const size_t end = std::min(str.find(',', start), str.size());
+            const std::string_view setting = std::string_view(str).substr(start, str.find('=', start) - start);
+            REQUIRE(previous_setting < setting);
+            previous_setting = setting;
+            start = end + 1;
+        }
+    }
+}
+
+TEST_CASE( "Diff algebra" ) {
+    SettingsDiff diff = SettingsDiff::fromString("UnusedVariable=Ignore,TransposeT=Error");
+    diff.canonicalise();
+    std::string str;
+    diff.writeString(str);
+    REQUIRE(str == "TransposeT=Error,UnusedVariable=Ignore");
+
+    const SettingsDiff composed = SettingsDiff::compose(
+        SettingsDiff::fromString("UnusedVariable=Error,ScopeShadowing=Warn"),
+        SettingsDiff::fromString("UnusedVariable=Ignore,ZeroToZeroPower=One"));
+    str.clear();
+    composed.writeString(str);
+    REQUIRE(str == "ScopeShadowing=Warn,UnusedVariable=Ignore,ZeroToZeroPower=One");
+
+    // Settings set to the option they already have are not part of the minimal diff
+    ScopedSettings settings;
+    settings.applyDiff(SettingsDiff::fromString("UnusedVariable=Warn,TransposeT=Error"));
+    str.clear();
+    SettingsDiff::between(Settings::getDefaults(), settings).writeString(str);
+    REQUIRE(str == "TransposeT=Error");
+    str.clear();
+    SettingsDiff::between(settings, settings).writeString(str);
+    REQUIRE(str.empty());
+}
+
+/// A diff of random pairs in random order
+static SettingsDiff randomDiff(std::mt19937& rng) {
+    std::string str;
+    for(size_t i = rng() % 6; i > 0; i--){
+        const std::string_view pair = pairs[rng() % num_pairs];
+        if(str.find(pair.substr(0, pair.find('=') + 1)) != std::string::npos) continue;
+        if(!str.empty()) str += ',';
+        str += pair;
+    }
+    return SettingsDiff::fromString(str);
+}
+
+/// The setting=option pairs of a serialised diff
+static std::vector<std::string_view> splitPairs(std::string_view str) {
+    std::vector<std::string_view> split;
+    for(size_t start = 0; start < str.size();){
+        const size_t end = std::min(str.find(',', start), str.size());
+        split.push_back(str.substr(start, end - start));
+        start = end + 1;
+    }
+    return split;
+}
+
+TEST_CASE( "Diff algebra fuzz" ) {
+    std::mt19937 rng(0);
+
+    for(size_t trial = 0; trial < 10000; trial++){
+        const SettingsDiff first = randomDiff(rng);
+        const SettingsDiff second = randomDiff(rng);
+        ScopedSettings settings;
+        settings.applyDiff(first);
+        const Settings middle = settings.getSettings();
+        settings.applyDiff(second);
+        const Settings end = settings.getSettings();
+
+        // The canonical diff has the same effect, sorted by setting
+        SettingsDiff canonical = first;
+        canonical.canonicalise();
+        ScopedSettings canonical_settings;
+        canonical_settings.applyDiff(canonical);
+        REQUIRE(canonical_settings.getSettings() == middle);
+        std::string str;
+        canonical.writeString(str);
+        std::string_view previous_setting;
+        for(const std::string_view pair : splitPairs(str)){
+            const std::string_view setting = pair.substr(0, pair.find('='));
+            REQUIRE(previous_setting < setting);
+            previous_setting = setting;
+        }
+
+        // The composed diff has the effect of both diffs
+        ScopedSettings composed_settings;
+        composed_settings.applyDiff(SettingsDiff::compose(first, second));
+        REQUIRE(composed_settings.getSettings() == end);
+
+        // The minimal diff transforms the settings, and every setting of it changes an option
+        const SettingsDiff minimal = SettingsDiff::between(middle, end);
+        ScopedSettings minimal_settings;
+        minimal_settings.applyDiff(first);
+        minimal_settings.applyDiff(minimal);
+        REQUIRE(minimal_settings.getSettings() == end);
+        str.clear();
+        minimal.writeString(str);
+        for(const std::string_view pair : splitPairs(str)){
+            ScopedSettings single_settings;
+            single_settings.applyDiff(first);
+            single_settings.applyDiff(SettingsDiff::fromString(pair));
+            REQUIRE(single_settings.getSettings() != middle);
+        }
+    }
+}
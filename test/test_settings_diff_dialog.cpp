@@ -0,0 +1,63 @@
+#include <catch2/catch_test_macros.hpp>
+
+#include "dialog_test_helpers.h"
+
+#include <QFormLayout>
+#include <QLineEdit>
+
+using namespace Forscape;
+
+TEST_CASE( "Dialog row moves" ) {
+    application();
+    initialisePalette();
+    ScopedSettings settings;
+    SettingsDiff diff = SettingsDiff::fromString("UnusedVariable=Error");
+
+    whileExecuting(settings.getSettings(), diff, [](SettingsDiffDialog& dialog){
+        QFormLayout* overridden = dialog.findChild<QFormLayout*>("overriddenFormLayout");
+        QFormLayout* inherited = dialog.findChild<QFormLayout*>("inheritedFormLayout");
+        REQUIRE(overridden->rowCount() == 1);
+        const int num_rows = overridden->rowCount() + inherited->rowCount();
+
+        // Choosing an option moves the row to the overridden section, and inheriting moves it back
+        QComboBox* box = qobject_cast<QComboBox*>(inherited->itemAt(0, QFormLayout::FieldRole)->widget());
+        box->setCurrentIndex(1);
+        REQUIRE(overridden->rowCount() == 2);
+        REQUIRE(overridden->itemAt(0, QFormLayout::FieldRole)->widget() == box);
+        REQUIRE(overridden->rowCount() + inherited->rowCount() == num_rows);
+
+        box->setCurrentIndex(0);
+        REQUIRE(overridden->rowCount() == 1);
+        REQUIRE(inherited->itemAt(0, QFormLayout::FieldRole)->widget() == box);
+    });
+}
+
+TEST_CASE( "Dialog search" ) {
+    application();
+    initialisePalette();
+    ScopedSettings settings;
+    SettingsDiff diff;
+
+    whileExecuting(settings.getSettings(), diff, [](SettingsDiffDialog& dialog){
+        QLineEdit* filter_edit = dialog.findChild<QLineEdit*>("filterEdit");
+        const size_t num_rows = numVisibleRows(dialog);
+
+        // Words of descriptions are searched as well as titles, anywhere within words and case-insensitively
+        filter_edit->setText("VTAB");
+        REQUIRE(numVisibleRows(dialog) == 1);
+        filter_edit->setText("shadowing");
+        REQUIRE(numVisibleRows(dialog) == 2);
+        filter_edit->setText("adow");
+        REQUIRE(numVisibleRows(dialog) == 2);
+        filter_edit->setText("unused");
+        REQUIRE(numVisibleRows(dialog) == 1);
+        filter_edit->setText("used");
+        REQUIRE(numVisibleRows(dialog) == 2);
+        filter_edit->setText("shadowing scope");
+        REQUIRE(numVisibleRows(dialog) == 1);
+        filter_edit->setText("chamomile");
+        REQUIRE(numVisibleRows(dialog) == 0);
+        filter_edit->setText("");
+        REQUIRE(numVisibleRows(dialog) == num_rows);
+    });
+}